@@ -13,7 +13,8 @@ import sys
 from .constants import (APP_NAME, DEFAULTS_CHANNEL_NAME, DEFAULT_AGGRESSIVE_UPDATE_PACKAGES,
                         DEFAULT_CHANNELS, DEFAULT_CHANNEL_ALIAS, DEFAULT_CUSTOM_CHANNELS,
                         DepsModifier, ERROR_UPLOAD_URL, PLATFORM_DIRECTORIES, PREFIX_MAGIC_FILE,
-                        PathConflict, ROOT_ENV_NAME, SEARCH_PATH, SafetyChecks, UpdateModifier)
+                        PathConflict, ROOT_ENV_NAME, SEARCH_PATH, SafetyChecks, SatSolverChoice,
+                        UpdateModifier)
 from .. import __version__ as CONDA_VERSION
 from .._vendor.appdirs import user_data_dir
 from .._vendor.auxlib.collection import frozendict
@@ -163,6 +164,11 @@ class Context(Configuration):
     remote_connect_timeout_secs = PrimitiveParameter(9.15)
     remote_read_timeout_secs = PrimitiveParameter(60.)
     remote_max_retries = PrimitiveParameter(3)
+    remote_max_connections = PrimitiveParameter(10, element_type=int)
+    remote_max_connections_per_host = PrimitiveParameter(4, element_type=int)
+    use_repodata_patches = PrimitiveParameter(False)
+    use_repodata_shards = PrimitiveParameter(False)
+    repodata_compression_order = SequenceParameter(string_types, default=('zst', 'bz2', 'json'))
 
     add_anaconda_token = PrimitiveParameter(True, aliases=('add_binstar_token',))
 
@@ -219,6 +225,12 @@ class Context(Configuration):
     # update_all = PrimitiveParameter(False)
 
     prune = PrimitiveParameter(False)
+    sat_solver = PrimitiveParameter(SatSolverChoice.PYCOSAT)
+    solver_cache_size = PrimitiveParameter(0, element_type=int)
+    conflict_search_processes = PrimitiveParameter(1, element_type=int)
+    solver_time_budget_secs = PrimitiveParameter(0.)
+    solver_propagation_limit = PrimitiveParameter(0, element_type=int)
+    solver_profile = PrimitiveParameter('')
     force_remove = PrimitiveParameter(False)
     force_reinstall = PrimitiveParameter(False)
 
@@ -623,9 +635,14 @@ class Context(Configuration):
             'offline',
             'proxy_servers',
             'remote_connect_timeout_secs',
+            'remote_max_connections',
+            'remote_max_connections_per_host',
             'remote_max_retries',
             'remote_read_timeout_secs',
+            'repodata_compression_order',
             'ssl_verify',
+            'use_repodata_patches',
+            'use_repodata_shards',
         )),
         ('Solver Configuration', (
             'aggressive_update_packages',
@@ -637,6 +654,12 @@ class Context(Configuration):
             'track_features',
             'prune',
             'force_reinstall',
+            'sat_solver',
+            'solver_cache_size',
+            'conflict_search_processes',
+            'solver_time_budget_secs',
+            'solver_propagation_limit',
+            'solver_profile',
         )),
         ('Package Linking and Install-time Configuration', (
             'allow_softlinks',
@@ -792,6 +815,12 @@ class Context(Configuration):
                 General configuration parameters for conda-build.
                 """),
             # TODO: add shortened link to docs for conda_build at See https://conda.io/docs/user-guide/configuration/use-condarc.html#conda-build-configuration  # NOQA
+            'conflict_search_processes': dals("""
+                The number of processes used to narrow down the conflicting specifications
+                when a solve fails. With more than one, subsets of the specifications are
+                tested in parallel, which can make reporting a conflict among many
+                specifications much faster.
+                """),
             'create_default_packages': dals("""
                 Packages that are by default added to a newly created environments.
                 """),  # TODO: This is a bad parameter name. Consider an alternate.
@@ -932,6 +961,13 @@ class Context(Configuration):
                 The number seconds conda will wait for your client to establish a connection
                 to a remote url resource.
                 """),
+            'remote_max_connections': dals("""
+                The maximum number of concurrent connections conda keeps open to remote url
+                resources.  Channel repodata is also fetched with this many threads.
+                """),
+            'remote_max_connections_per_host': dals("""
+                The maximum number of concurrent requests conda sends to any single host.
+                """),
             'remote_max_retries': dals("""
                 The maximum number of retries each HTTP connection should attempt.
                 """),
@@ -940,6 +976,13 @@ class Context(Configuration):
                 read timeout is the number of seconds conda will wait for the server to send
                 a response.
                 """),
+            'repodata_compression_order': dals("""
+                The variants of a channel's repodata to request, in order of preference.  When
+                a channel does not publish a variant, conda falls back to the next one, and
+                doesn't ask for that variant again until the index cache is cleared.  Valid
+                entries are 'zst' (repodata.json.zst, used only when the zstandard package is
+                installed), 'bz2' (repodata.json.bz2), and 'json' (repodata.json).
+                """),
             'report_errors': dals("""
                 Opt in, or opt out, of automatic error reporting to core maintainers. Error
                 reports are anonymous, with only the error stack trace and information given
@@ -953,6 +996,13 @@ class Context(Configuration):
                 Enforce available safety guarantees during package installation.
                 The value must be one of 'enabled', 'warn', or 'disabled'.
                 """),
+            'sat_solver': dals("""
+                The SAT solver used to resolve package specifications. The value must be one
+                of 'pycosat', 'pycryptosat', or 'pysat'. The pycryptosat and pysat solvers
+                are incremental, keeping what they learn across the many satisfiability
+                checks of a single solve, and require the package of the same name
+                (python-sat for pysat).
+                """),
             'shortcuts': dals("""
                 Allow packages to create OS-specific shortcuts (e.g. in the Windows Start
                 Menu) at install time.
@@ -960,6 +1010,30 @@ class Context(Configuration):
             'show_channel_urls': dals("""
                 Show channel URLs when displaying what is going to be downloaded.
                 """),
+            'solver_cache_size': dals("""
+                The number of solved environment states to keep in an on-disk cache, and reuse
+                when the same specs are solved again against the same prefix state and
+                unchanged repodata, skipping the solver entirely. The least recently used
+                entries are evicted first. 0, the default, disables the cache.
+                """),
+            'solver_profile': dals("""
+                A path to write a JSON report of each solve to: the time spent preparing the
+                index, reducing it, generating clauses and in each minimization stage, the
+                variable and clause counts, the number of bisection rounds, and the number
+                of records per package name in the reduced index.
+                """),
+            'solver_propagation_limit': dals("""
+                The most propagations each call to the SAT solver may make (conflicts, with
+                pycryptosat) before giving up. A solve that runs out keeps the best solution
+                found so far, and warns that it may not be optimal. 0, the default, means
+                no limit.
+                """),
+            'solver_time_budget_secs': dals("""
+                The wall time, in seconds, that the solver may spend improving a solution.
+                It is checked between calls to the SAT solver, which solver_propagation_limit
+                bounds. Once it runs out, the best solution found so far is used, with a
+                warning that it may not be optimal. 0, the default, means no limit.
+                """),
             'ssl_verify': dals("""
                 Conda verifies SSL certificates for HTTPS requests, just like a web
                 browser. By default, SSL verification is enabled, and conda operations will
@@ -975,6 +1049,17 @@ class Context(Configuration):
             'use_index_cache': dals("""
                 Use cache of channel index files, even if it has expired.
                 """),
+            'use_repodata_patches': dals("""
+                When a channel publishes a repodata.patch.json file, update expired cached
+                repodata by applying the JSON patches published since it was last downloaded,
+                instead of downloading the channel's full repodata again.  A channel subdir
+                found not to publish one isn't asked again until the index cache is cleared.
+                """),
+            'use_repodata_shards': dals("""
+                For channels that publish sharded repodata (a shards/index.json file in each
+                subdir), fetch only the shards for the package names conda needs, instead of
+                the full repodata.json.  Each shard is cached separately.
+                """),
             'verbosity': dals("""
                 Sets output log level. 0 is warn. 1 is info. 2 is debug. 3 is trace.
                 """),
@@ -998,6 +1083,8 @@ def reset_context(search_path=SEARCH_PATH, argparse_args=None):
     context.__init__(search_path, argparse_args)
     from ..models.channel import Channel
     Channel._reset_state()
+    from ..models.match_spec import spec_cache
+    spec_cache.clear()
     # need to import here to avoid circular dependency
     return context
 
@@ -1029,6 +1029,14 @@ def configure_parser_search(sub_parsers):
 
         conda search conda-forge::numpy
         conda search 'numpy[channel=conda-forge, subdir=osx-64]'
+
+    Search for the packages that depend on numpy:
+
+        conda search --reverse-dependency numpy
+
+    Search for the packages with a dependency that numpy 1.20 or later satisfies:
+
+        conda search --reverse-dependency 'numpy>=1.20'
     """)
     p = sub_parsers.add_parser(
         'search',
@@ -1091,9 +1099,10 @@ def configure_parser_search(sub_parsers):
     p.add_argument(
         "--reverse-dependency",
         action="store_true",
-        # help="Perform a reverse dependency search. Use 'conda search package --info' "
-        #      "to see the dependencies of a package.",
-        help=SUPPRESS,  # TODO: re-enable once we have --reverse-dependency working again
+        help="Perform a reverse dependency search, listing the packages that depend on the "
+             "named package. A version or build given with the package name limits the "
+             "results to packages with a dependency that a matching package satisfies. "
+             "Use 'conda search package --info' to see the dependencies of a package.",
     )
 
     add_parser_channels(p)
@@ -1170,6 +1179,7 @@ def add_parser_create_install_update(p):
     add_parser_prefix(p)
     add_parser_channels(p)
     solver_mode_options = add_parser_solver_mode(p)
+    add_parser_solver_profile(solver_mode_options)
     package_install_options = add_parser_package_install_options(p)
     add_parser_networking(p)
 
@@ -1444,6 +1454,16 @@ def add_parser_update_modifiers(solver_mode_options):
     )
 
 
+def add_parser_solver_profile(solver_mode_options):
+    solver_mode_options.add_argument(
+        "--solver-profile",
+        action="store",
+        default=NULL,
+        metavar="PATH",
+        help="Write a JSON report of where the solver spends its time to PATH.",
+    )
+
+
 def add_parser_prune(p):
     p.add_argument(
         "--prune",
@@ -64,10 +64,22 @@ def execute(args, parser):
         spec_channel = spec.get_exact_value('channel')
         channel_urls = (spec_channel,) if spec_channel else context.channels
 
-        matches = sorted(SubdirData.query_all(spec, channel_urls, subdirs),
+        if args.reverse_dependency:
+            # records depending on the package matched by spec, through the depends index
+            if not spec.get_exact_value('name'):
+                from ..exceptions import CondaValueError
+                raise CondaValueError("An exact package name is required with "
+                                      "--reverse-dependency, not '%s'." % spec.name)
+            matches = SubdirData.query_all_reverse_dependencies(spec, channel_urls, subdirs)
+            package_found = bool(matches) or bool(
+                SubdirData.query_all(spec, channel_urls, subdirs))
+        else:
+            matches = SubdirData.query_all(spec, channel_urls, subdirs)
+            package_found = bool(matches)
+        matches = sorted(matches,
                          key=lambda rec: (rec.name, VersionOrder(rec.version), rec.build))
 
-    if not matches:
+    if not package_found:
         channels_urls = tuple(calculate_channel_urls(
             channel_urls=context.channels,
             prepend=not args.override_channels,
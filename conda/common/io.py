@@ -4,7 +4,7 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 from collections import defaultdict
-from concurrent.futures import ThreadPoolExecutor, _base, as_completed
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, _base, as_completed, wait
 from concurrent.futures.thread import _WorkItem
 from contextlib import contextmanager
 from enum import Enum
@@ -24,7 +24,6 @@ from time import sleep, time
 from .compat import StringIO, iteritems, on_win
 from .constants import NULL
 from .path import expand
-from .._vendor.auxlib.decorators import memoizemethod
 from .._vendor.auxlib.logz import NullHandler
 from .._vendor.auxlib.type_coercion import boolify
 from .._vendor.tqdm import tqdm
@@ -469,6 +468,13 @@ class ThreadLimitedThreadPoolExecutor(ThreadPoolExecutor):
 
 
 as_completed = as_completed
+wait = wait
+FIRST_COMPLETED = FIRST_COMPLETED
+
+
+def instrumentation_enabled():
+    enabled = os.environ.get('CONDA_INSTRUMENTATION_ENABLED')
+    return bool(enabled and boolify(enabled))
 
 
 class time_recorder(ContextDecorator):  # pragma: no cover
@@ -479,8 +485,7 @@ class time_recorder(ContextDecorator):  # pragma: no cover
         self.entry_name = entry_name
 
     def __enter__(self):
-        enabled = os.environ.get('CONDA_INSTRUMENTATION_ENABLED')
-        if enabled and boolify(enabled):
+        if instrumentation_enabled():
             self.start_time = time()
         return self
 
@@ -488,14 +493,15 @@ class time_recorder(ContextDecorator):  # pragma: no cover
         if self.start_time:
             end_time = time()
             run_time = end_time - self.start_time
-            self._ensure_dir()
-            with open(self.record_file, 'a') as fh:
-                fh.write("%s,%s\n" % (self.entry_name, run_time))
-
-    @memoizemethod
-    def _ensure_dir(self):
-        if not isdir(dirname(self.record_file)):
-            os.makedirs(dirname(self.record_file))
+            self.record(self.entry_name, run_time)
+
+    @classmethod
+    def record(cls, entry_name, value):
+        # Record a value other than a run time, e.g. a count, under entry_name.
+        if not isdir(dirname(cls.record_file)):
+            os.makedirs(dirname(cls.record_file))
+        with open(cls.record_file, 'a') as fh:
+            fh.write("%s,%s\n" % (entry_name, value))
 
 
 def print_instrumentation_data():  # pragma: no cover
@@ -29,26 +29,262 @@ through the Require and Prevent functions.
 """
 from __future__ import absolute_import, division, print_function, unicode_literals
 
-from itertools import chain, combinations
+from array import array
+from itertools import chain, combinations, islice
 from logging import getLogger
+from multiprocessing import Pool
+from time import time
 import pycosat
 
 from .compat import iteritems
+from .io import time_recorder
+
+try:
+    import pycryptosat
+except ImportError:  # pragma: no cover
+    pycryptosat = None
+
+try:
+    from pysat import solvers as pysat_solvers
+except ImportError:  # pragma: no cover
+    pysat_solvers = None
 
 log = getLogger(__name__)
 
+# returned by SAT solvers when a limited search ran out before it could decide
+UNKNOWN = "UNKNOWN"
+
+
+class ClauseArray(object):
+    """
+    A list-like sequence of clauses stored as one flat array of 32-bit
+    literals, each clause terminated by 0 as in the DIMACS format, along with
+    the offset at which each clause ends.
+
+    This takes a fraction of the memory of a list of tuples, and can be handed
+    to a solver that reads the flat format without any conversion. Clauses
+    are read back as tuples; only a trailing slice can be deleted.
+    """
+    __slots__ = ('_lits', '_ends')
+
+    def __init__(self, clauses=()):
+        self._lits = array(str('i'))
+        self._ends = array(str('l'))
+        self.extend(clauses)
+
+    def append(self, clause):
+        self._lits.extend(clause)
+        self._lits.append(0)
+        self._ends.append(len(self._lits))
+
+    def extend(self, clauses):
+        for clause in clauses:
+            self.append(clause)
+
+    def flat(self, start=0):
+        """The zero-terminated literals of the clauses from index `start` on."""
+        return self._lits[self._start(start):] if start else self._lits
+
+    def _start(self, ndx):
+        return self._ends[ndx - 1] if ndx else 0
+
+    def __len__(self):
+        return len(self._ends)
+
+    def __getitem__(self, ndx):
+        if isinstance(ndx, slice):
+            return [self[k] for k in range(*ndx.indices(len(self)))]
+        if ndx < 0:
+            ndx += len(self)
+        return tuple(self._lits[self._start(ndx):self._ends[ndx] - 1])
+
+    def __delitem__(self, ndx):
+        if not isinstance(ndx, slice) or ndx.indices(len(self))[1:] != (len(self), 1):
+            raise TypeError("only a trailing slice can be deleted")
+        start = ndx.indices(len(self))[0]
+        del self._lits[self._start(start):]
+        del self._ends[start:]
+
+    def __iter__(self):
+        lits = self._lits
+        start = 0
+        for end in self._ends:
+            yield tuple(lits[start:end - 1])
+            start = end
+
+    def __eq__(self, other):
+        if isinstance(other, ClauseArray):
+            return self._lits == other._lits
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __getstate__(self):
+        return self._lits, self._ends
+
+    def __setstate__(self, state):
+        self._lits, self._ends = state
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, list(self))
+
+
+class PycosatSolver(object):
+    """Solve the complete clause list with a fresh pycosat call every time."""
+    name = 'pycosat'
+    package_name = 'pycosat'
+    module = pycosat
+    incremental = False
+    # pycosat only accepts a sequence of clause sequences, which it reads
+    # fastest from a list of tuples
+    flat_clauses = False
+
+    def solve(self, clauses, m, additional=(), limit=0):
+        if additional:
+            clauses = tuple(chain(clauses, additional))
+        log.debug("Invoking SAT with clause count: %s", len(clauses))
+        solution = pycosat.solve(clauses, vars=m, prop_limit=limit)
+        if solution == "UNSAT":
+            return None
+        return solution
+
+
+class _IncrementalSatSolver(object):
+    """
+    Keep one solver, and everything it has learned, across calls.
+
+    Clauses are handed to the solver once, as they are appended to the clause
+    list, and unit clauses in `additional` are passed as assumptions. Longer
+    additional clauses cannot be retracted from a running solver, so those
+    calls are answered by a one-off solver instead.
+    """
+    name = None
+    package_name = None
+    module = None
+    incremental = True
+    flat_clauses = False
+    limit_in_place = True
+
+    def __init__(self):
+        if self.module is None:
+            raise RuntimeError("The %s package is required for the %s SAT solver."
+                               % (self.package_name, self.name))
+        self._solver = None
+        self._nclauses = 0
+
+    def solve(self, clauses, m, additional=(), limit=0):
+        if (limit and not self.limit_in_place) or any(len(c) != 1 for c in additional):
+            solver = self._new_solver(limit)
+            self._add_clauses(solver, clauses)
+            self._add_clauses(solver, additional)
+            assumptions = []
+        else:
+            if self._solver is None or len(clauses) < self._nclauses:
+                # the clause list was truncated; start over
+                self._solver = self._new_solver()
+                self._nclauses = 0
+            solver = self._solver
+            self._add_clauses(solver, clauses, self._nclauses)
+            self._nclauses = len(clauses)
+            assumptions = [c[0] for c in additional]
+        log.debug("Invoking %s with clause count: %s, assumptions: %s",
+                  self.name, len(clauses), len(assumptions))
+        return self._solve(solver, m, assumptions, limit)
+
+    def _new_solver(self, limit=0):
+        raise NotImplementedError()
+
+    def _add_clauses(self, solver, clauses, start=0):
+        raise NotImplementedError()
+
+    def _solve(self, solver, m, assumptions, limit):
+        raise NotImplementedError()
+
+
+class CryptoMiniSatSolver(_IncrementalSatSolver):
+    name = 'pycryptosat'
+    package_name = 'pycryptosat'
+    module = pycryptosat
+    flat_clauses = True
+    # pycryptosat takes a conflict limit, and only when the solver is created
+    limit_in_place = False
+
+    def _new_solver(self, limit=0):
+        # confl_limit=0 would allow no conflicts at all, rather than any number of them
+        return pycryptosat.Solver(confl_limit=limit) if limit else pycryptosat.Solver()
+
+    def _add_clauses(self, solver, clauses, start=0):
+        if isinstance(clauses, ClauseArray):
+            solver.add_clauses(clauses.flat(start))
+        else:
+            solver.add_clauses(islice(clauses, start, None))
+
+    def _solve(self, solver, m, assumptions, limit):
+        if solver.nb_vars() < m:
+            # declare the variables that do not appear in any clause yet
+            solver.add_clause((m, -m))
+        sat, solution = solver.solve(assumptions)
+        if sat is None:
+            return UNKNOWN
+        if not sat:
+            return None
+        nsol = len(solution)
+        return [k if k < nsol and solution[k] else -k for k in range(1, m + 1)]
+
+
+class PySatSolver(_IncrementalSatSolver):
+    name = 'pysat'
+    package_name = 'python-sat'
+    module = pysat_solvers
+
+    def _new_solver(self, limit=0):
+        return pysat_solvers.Solver()
+
+    def _add_clauses(self, solver, clauses, start=0):
+        solver.append_formula(islice(clauses, start, None))
+
+    def _solve(self, solver, m, assumptions, limit):
+        if limit:
+            solver.prop_budget(limit)
+            sat = solver.solve_limited(assumptions=assumptions)
+            if sat is None:
+                return UNKNOWN
+        else:
+            sat = solver.solve(assumptions=assumptions)
+        if not sat:
+            return None
+        solution = solver.get_model()[:m]
+        solution.extend(-k for k in range(len(solution) + 1, m + 1))
+        return solution
+
+
+SAT_SOLVERS = {solver.name: solver for solver in (
+    PycosatSolver,
+    CryptoMiniSatSolver,
+    PySatSolver,
+)}
+
 
 # Code that uses special cases (generates no clauses) is in ADTs/FEnv.h in
 # minisatp. Code that generates clauses is in Hardware_clausify.cc (and are
 # also described in the paper, "Translating Pseudo-Boolean Constraints into
 # SAT," Eén and Sörensson).
 class Clauses(object):
-    def __init__(self, m=0):
-        self.clauses = []
+    def __init__(self, m=0, sat_solver=PycosatSolver):
+        self._sat_solver = sat_solver()
+        self.clauses = ClauseArray() if self._sat_solver.flat_clauses else []
         self.names = {}
         self.indices = {}
         self.unsat = False
         self.m = m
+        # The solve budget: a limit passed to every SAT call that doesn't set its own, and a
+        # time() after which minimize() keeps the solution it has.  budget_exhausted is set
+        # once either runs out; from then on, solutions are no longer known to be optimal.
+        self.limit = 0
+        self.deadline = None
+        self.budget_exhausted = False
+        self.bisection_rounds = 0  # counted across calls to minimize(), for profiling
 
     def name_var(self, m, name):
         nname = '!' + name
@@ -105,7 +341,7 @@ class Clauses(object):
         elif tvals is not bool:
             self.clauses.append((vals if polarity else -vals,))
         else:
-            self.clauses = self.clauses[:nz]
+            del self.clauses[nz:]
             self.unsat = self.unsat or polarity != vals
 
     def Combine_(self, args, polarity):
@@ -329,6 +565,51 @@ class Clauses(object):
         equation = sorted(equation)
         return equation, offset
 
+    def Totalizer(self, equation, bound, max_clauses=None):
+        """
+        Encode the sum of the (coeff, literal) pairs of `equation` as a
+        generalized totalizer: a tree of nodes, each with one output literal
+        per attainable partial sum, with every sum above `bound` merged into
+        bound + 1. Only the upward implications are generated, so whenever
+        the sum is S, the output for min(S, bound + 1) is true, and the sum
+        is at most K <= bound exactly when every output above K is false.
+
+        Returns the (sum, literal) outputs of the root, sorted by sum, or None
+        if the encoding would take more than `max_clauses` clauses.
+        """
+        top = bound + 1
+        m_orig = self.m
+        nz = len(self.clauses)
+
+        def merge(lo, hi):
+            if hi - lo == 1:
+                c, a = equation[lo]
+                return {min(c, top): a}
+            mid = (lo + hi) // 2
+            left = merge(lo, mid)
+            right = left and merge(mid, hi)
+            if not right:
+                return None
+            if max_clauses is not None and (len(self.clauses) - nz + len(left) * len(right)
+                                            + len(left) + len(right) > max_clauses):
+                return None
+            result = {}
+            for c in sorted(set(chain(left, right, (min(c1 + c2, top)
+                                                    for c1 in left for c2 in right)))):
+                result[c] = self.new_var()
+            for side in (left, right):
+                self.clauses.extend((-a, result[c]) for c, a in iteritems(side))
+            self.clauses.extend((-a1, -a2, result[min(c1 + c2, top)])
+                                for c1, a1 in iteritems(left) for c2, a2 in iteritems(right))
+            return result
+
+        outputs = merge(0, len(equation)) if equation else {}
+        if outputs is None:
+            self.m = m_orig
+            del self.clauses[nz:]
+            return None
+        return sorted(iteritems(outputs))
+
     def BDD_(self, equation, nterms, lo, hi, polarity):
         # The equation is sorted in order of increasing coefficients.
         # Then we take advantage of the following recurrence:
@@ -399,44 +680,57 @@ class Clauses(object):
         return self.Eval_(self.LinearBound_, (equation, lo, hi, preprocess),
                           polarity, name, conv=False)
 
+    def _preprocess(self, clauses):
+        # Resolve names and constants in additional clauses to literals, dropping satisfied
+        # clauses.  Returns None if some clause can't be satisfied.
+        def preproc_(cc):
+            for c in cc:
+                c = self.names.get(c, c)
+                if c is False:
+                    continue
+                yield c
+                if c is True:
+                    break
+        result = []
+        for cc in clauses:
+            cc = tuple(preproc_(cc))
+            if not cc:
+                return None
+            if cc[-1] is not True:
+                result.append(cc)
+        return result
+
+    def budget_spent(self):
+        if not self.budget_exhausted and self.deadline is not None and time() >= self.deadline:
+            log.debug('Solve time budget exhausted')
+            self.budget_exhausted = True
+        return self.budget_exhausted
+
     def sat(self, additional=None, includeIf=False, names=False, limit=0):
         """
         Calculate a SAT solution for the current clause set.
 
         Returned is the list of those solutions.  When the clauses are
-        unsatisfiable, an empty list is returned.
+        unsatisfiable, an empty list is returned.  So is the case when the SAT
+        solver runs out of its limit, which then sets budget_exhausted.
 
         """
         if self.unsat:
             return None
         if not self.m:
             return set() if names else []
-        clauses = self.clauses
         if additional:
-            def preproc(eqs):
-                def preproc_(cc):
-                    for c in cc:
-                        c = self.names.get(c, c)
-                        if c is False:
-                            continue
-                        yield c
-                        if c is True:
-                            break
-                for cc in eqs:
-                    cc = tuple(preproc_(cc))
-                    if not cc:
-                        yield cc
-                        break
-                    if cc[-1] is not True:
-                        yield cc
-            additional = list(preproc(additional))
-            if additional:
-                if not additional[-1]:
-                    return None
-                clauses = tuple(chain(clauses, additional))
-        log.debug("Invoking SAT with clause count: %s", len(clauses))
-        solution = pycosat.solve(clauses, vars=self.m, prop_limit=limit)
-        if solution in ("UNSAT", "UNKNOWN"):
+            additional = self._preprocess(additional)
+            if additional is None:
+                return None
+        with time_recorder("sat_solve_%s" % self._sat_solver.name):
+            solution = self._sat_solver.solve(self.clauses, self.m, additional or (),
+                                              limit or self.limit)
+        if solution == UNKNOWN:
+            log.debug('SAT solver limit exhausted')
+            self.budget_exhausted = True
+            return None
+        if solution is None:
             return None
         if additional and includeIf:
             self.clauses.extend(additional)
@@ -459,13 +753,38 @@ class Clauses(object):
             yield sol
             exclude.append([-k for k in sol if -m <= k <= m])
 
-    def minimize(self, objective, bestsol=None, trymax=False):
+    def minimize(self, objective, bestsol=None, trymax=False, peak=None):
         """
         Minimize the objective function given either by (coeff, integer)
         tuple pairs, or a dictionary of varname: coeff values. The actual
         minimization is multiobjective: first, we minimize the largest
         active coefficient value, then we minimize the sum.
+
+        When the objective is one part of a larger one, whose other parts
+        share no variables with it, `peak` is the smallest peak of the
+        whole, the largest of the min_peak() of each part. The peak
+        minimization is then replaced by a bound at `peak`, so that
+        minimizing the sum of each part minimizes that of the whole.
+
+        With an incremental SAT solver, the bound tested by each bisection
+        step is guarded by an activation literal instead of being truncated
+        away afterwards, so the solver keeps what it has learned from one
+        step, and one call, to the next.
+
+        Once the solve budget is spent, the best solution found so far is
+        returned as it stands, along with its objective value.
         """
+        return self._minimize(objective, bestsol, trymax, peak)
+
+    def min_peak(self, objective, bestsol=None):
+        """
+        The smallest value that the largest active coefficient of the
+        objective can take, along with a solution that has it. Unlike
+        minimize(), no bound is kept.
+        """
+        return self._minimize(objective, bestsol, peak_only=True)
+
+    def _minimize(self, objective, bestsol=None, trymax=False, peak=None, peak_only=False):
         if bestsol is None or len(bestsol) < self.m:
             log.debug('Clauses added, recomputing solution')
             bestsol = self.sat()
@@ -488,9 +807,28 @@ class Clauses(object):
         def sum_val(sol, odict):
             return sum(odict.get(s, 0) for s in sol)
 
+        if peak_only:
+            passes = (True,)
+        elif peak is not None:
+            passes = (False,)
+            if maxval > peak:
+                # the part of the bound of the whole that falls on this part
+                above = tuple(a for c, a in objective if c > peak)
+                self.Prevent(self.Any, above)
+                objective = [(c, a) for c, a in objective if c <= peak]
+                if len(bestsol) < self.m or not set(above).isdisjoint(bestsol):
+                    bestsol = self.sat()
+                if bestsol is None:
+                    return bestsol, sum(c for c, a in objective) + 1
+                if not objective:
+                    return bestsol, 0
+        else:
+            passes = (True, False) if maxval > 1 else (False,)
+
+        incremental = self._sat_solver.incremental
         lo = 0
         try0 = 0
-        for peak in ((True, False) if maxval > 1 else (False,)):
+        for peak in passes:
             if peak:
                 log.trace('Beginning peak minimization')
                 objval = peak_val
@@ -500,22 +838,34 @@ class Clauses(object):
 
             odict = {a: c for c, a in objective}
             bestval = objval(bestsol, odict)
+            if self.budget_spent():
+                break
 
             # If we got lucky and the initial solution is optimal, we still
             # need to generate the constraints at least once
             hi = bestval
+            # The sum is encoded once, as a totalizer whose outputs are then
+            # bounded through assumptions alone. Fall back to a bisection
+            # over LinearBound BDDs if that would cost more clauses than the
+            # worst case of a single BDD.
+            totalizer = None if peak else self.Totalizer(objective, hi,
+                                                         len(objective) * (hi + 1))
             m_orig = self.m
             nz = len(self.clauses)
             if trymax and not peak:
                 try0 = hi - 1
 
             log.trace("Initial range (%d,%d)" % (lo, hi))
-            while True:
+            while not self.budget_spent():
+                self.bisection_rounds += 1
                 if try0 is None:
                     mid = (lo+hi) // 2
                 else:
                     mid = try0
-                if peak:
+                nc = len(self.clauses)
+                if totalizer is not None:
+                    bound = [(-a,) for c, a in totalizer if c > mid]
+                elif peak:
                     self.Prevent(self.Any, tuple(a for c, a in objective if c > mid))
                     temp = tuple(a for c, a in objective if lo <= c <= mid)
                     if temp:
@@ -524,7 +874,19 @@ class Clauses(object):
                     self.Require(self.LinearBound, objective, lo, mid, False)
                 log.trace('Bisection attempt: (%d,%d), (%d+%d) clauses' %
                           (lo, mid, nz, len(self.clauses)-nz))
-                newsol = self.sat()
+                if totalizer is not None:
+                    newsol = self.sat(bound)
+                elif not incremental:
+                    newsol = self.sat()
+                elif self.unsat:
+                    del self.clauses[nc:]
+                    newsol = None
+                else:
+                    act = self.new_var()
+                    bound = [(-act,) + c for c in self.clauses[nc:]]
+                    del self.clauses[nc:]
+                    self.clauses.extend(bound)
+                    newsol = self.sat(((act,),))
                 if newsol is None:
                     lo = mid + 1
                     log.trace("Bisection failure, new range=(%d,%d)" % (lo, hi))
@@ -538,10 +900,26 @@ class Clauses(object):
                     hi = bestval
                     log.trace("Bisection success, new range=(%d,%d)" % (lo, hi))
                     if done:
+                        if peak_only:
+                            # the bound is only for this call
+                            if not incremental:
+                                self.m = m_orig
+                                del self.clauses[nz:]
+                            else:
+                                self.clauses.append((-act,))
+                        elif totalizer is not None:
+                            self.clauses.extend(bound)
+                        elif incremental:
+                            self.clauses.append((act,))
                         break
-                self.m = m_orig
-                if len(self.clauses) > nz:
-                    self.clauses = self.clauses[:nz]
+                if totalizer is not None:
+                    pass
+                elif not incremental:
+                    self.m = m_orig
+                    del self.clauses[nz:]
+                elif not self.unsat:
+                    # retire the bound of this step for good
+                    self.clauses.append((-act,))
                 self.unsat = False
                 try0 = None
 
@@ -656,3 +1034,85 @@ def minimal_unsatisfiable_subset(clauses, sat):
     d = 0
     ret = minimal_unsat(clauses)
     return ret
+
+
+_mus_worker_state = None
+
+
+def _init_mus_worker(sat_solver_cls, clauses, m, item_clauses):
+    # clauses arrive as a ClauseArray, the smallest form to send to each worker
+    global _mus_worker_state
+    if not sat_solver_cls.flat_clauses:
+        clauses = list(clauses)
+    _mus_worker_state = sat_solver_cls(), clauses, m, item_clauses
+
+
+def _mus_probe(indices):
+    # One probe of parallel_minimal_unsatisfiable_subset, run in a worker process.  The
+    # worker's solver is kept across probes, so incremental solvers keep what they learn.
+    solver, clauses, m, item_clauses = _mus_worker_state
+    additional = list(chain.from_iterable(item_clauses[i] for i in indices))
+    return solver.solve(clauses, m, additional) is not None
+
+
+def parallel_minimal_unsatisfiable_subset(items, item_clauses, C, processes):
+    """
+    Find a minimal subset of items whose clauses are unsatisfiable together with
+    C.clauses, probing several subsets at once in a pool of worker processes.
+
+    item_clauses[i] is the sequence of additional clauses, in the form passed to
+    Clauses.sat, that items[i] stands for.
+
+    Algorithm
+    =========
+
+    Deletion-based: U starts as every item, and a part of U is deleted whenever U
+    without it is still unsatisfiable.  U is cut into chunks that halve in size
+    down to single items, and at each size the deletion of every chunk not yet
+    known to be needed is probed in parallel.  Results are taken in chunk order:
+    the first chunk whose deletion leaves U unsatisfiable is deleted, and the
+    probes of later chunks are repeated against the smaller U, except those that
+    were satisfiable, since every subset of a satisfiable set is satisfiable.  At
+    single items, every item left is needed, so U is minimal.  The result depends
+    only on the probe outcomes, not on their timing.
+    """
+    items = tuple(items)
+    literal_clauses = []
+    for item, clauses in zip(items, item_clauses):
+        clauses = C._preprocess(clauses)
+        if clauses is None:
+            # unsatisfiable on its own
+            return item,
+        literal_clauses.append(clauses)
+
+    clauses = C.clauses if isinstance(C.clauses, ClauseArray) else ClauseArray(C.clauses)
+    pool = Pool(processes, _init_mus_worker,
+                (type(C._sat_solver), clauses, C.m, literal_clauses))
+    try:
+        U = list(range(len(items)))
+        if pool.map(_mus_probe, [tuple(U)])[0]:
+            raise ValueError("Clauses are not unsatisfiable")
+        size = max(1, -(-len(U) // processes))
+        while True:
+            chunks = [frozenset(U[k:k + size]) for k in range(0, len(U), size)]
+            needed = set()  # chunks whose deletion is known to leave U satisfiable
+            pos = 0
+            while pos < len(chunks):
+                todo = [j for j in range(pos, len(chunks)) if j not in needed]
+                if not todo:
+                    break
+                results = pool.map(_mus_probe, [tuple(i for i in U if i not in chunks[j])
+                                                for j in todo])
+                needed.update(j for j, is_sat in zip(todo, results) if is_sat)
+                deleted = next((j for j, is_sat in zip(todo, results) if not is_sat), None)
+                if deleted is None:
+                    break
+                U = [i for i in U if i not in chunks[deleted]]
+                pos = deleted + 1
+            if size == 1:
+                break
+            size = (size + 1) // 2
+    finally:
+        pool.terminate()
+        pool.join()
+    return tuple(items[i] for i in U)
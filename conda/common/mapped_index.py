@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Anaconda, Inc
+# SPDX-License-Identifier: BSD-3-Clause
+"""
+A read-only, memory-mapped on-disk index of string keys to lists of string pairs.
+
+The file is laid out as
+
+    header | string table | per-table key arrays and slot arrays | metadata json
+
+* The fixed-size header holds a magic number, a caller-defined format version, and the
+  location of the metadata.
+* The string table is the concatenation of every utf-8 encoded string in the file.
+* Each named table is a key array, sorted by the utf-8 bytes of the key, and a slot array.
+  Key entries are fixed-width (string offset, string length, first slot, slot count), and
+  slot entries are fixed-width (offset and length of two strings).
+* The metadata is a json object holding caller data and the directory of tables.
+
+Lookups bisect the key array through ``mmap``, so only the pages holding the probed keys and
+the matching slots and strings are ever read from disk.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from collections import Mapping
+import json
+from mmap import ACCESS_READ, mmap
+import struct
+
+from .compat import ensure_binary, iteritems
+
+MAPPED_INDEX_MAGIC = b'CONDAIDX'
+
+_HEADER = struct.Struct(str('<8sIQQ'))  # magic, format version, metadata offset, length
+_KEY = struct.Struct(str('<QIII'))  # string offset, string length, first slot, slot count
+_SLOT = struct.Struct(str('<QIQI'))  # first string offset, length, second string offset, length
+
+
+class MappedIndexError(ValueError):
+    pass
+
+
+def write_mapped_index(fh, format_version, metadata, tables):
+    """Write a mapped index to the binary, seekable file handle `fh`.
+
+    Args:
+        fh: a binary file handle open for writing, positioned at the start of the file.
+        format_version (int): stored in the header, and checked when the index is opened.
+        metadata (dict): json-serializable data made available as :attr:`MappedIndex.metadata`.
+        tables (Dict[str, Mapping[str, Sequence[Tuple[str, str]]]]): the tables to write.
+
+    """
+    fh.write(_HEADER.pack(MAPPED_INDEX_MAGIC, format_version, 0, 0))
+    position = [_HEADER.size]
+
+    def write_string(value):
+        value = ensure_binary(value)
+        offset = position[0]
+        fh.write(value)
+        position[0] += len(value)
+        return offset, len(value)
+
+    table_directory = {}
+    for table_name, table in iteritems(tables):
+        keys = sorted((ensure_binary(key), key) for key in table)
+        key_entries = []
+        slot_entries = []
+        for key_bytes, key in keys:
+            key_entries.append(write_string(key_bytes) + (len(slot_entries), len(table[key])))
+            for first, second in table[key]:
+                slot_entries.append(write_string(first) + write_string(second))
+
+        keys_offset = position[0]
+        fh.write(b''.join(_KEY.pack(*entry) for entry in key_entries))
+        slots_offset = keys_offset + _KEY.size * len(key_entries)
+        fh.write(b''.join(_SLOT.pack(*entry) for entry in slot_entries))
+        position[0] = slots_offset + _SLOT.size * len(slot_entries)
+        table_directory[table_name] = (keys_offset, len(key_entries), slots_offset)
+
+    metadata_offset, metadata_length = write_string(json.dumps({
+        'metadata': metadata,
+        'tables': table_directory,
+    }))
+    fh.seek(0)
+    fh.write(_HEADER.pack(MAPPED_INDEX_MAGIC, format_version, metadata_offset, metadata_length))
+
+
+class MappedIndex(object):
+    """A read-only view of a file written by :func:`write_mapped_index`.
+
+    Raises :class:`MappedIndexError` if the file is not a mapped index of `format_version`.
+    The file stays mapped until :meth:`close` is called, or the ``with`` block using the index
+    is left; on Windows, it can't be replaced or removed until then.
+    """
+
+    def __init__(self, path, format_version):
+        with open(path, 'rb') as fh:
+            try:
+                self._mmap = mmap(fh.fileno(), 0, access=ACCESS_READ)
+            except ValueError as e:
+                # ValueError: cannot mmap an empty file
+                raise MappedIndexError("%s: %s" % (path, e))
+        try:
+            if len(self._mmap) < _HEADER.size:
+                raise MappedIndexError("%s: truncated header" % path)
+            magic, version, metadata_offset, metadata_length = _HEADER.unpack_from(self._mmap)
+            if magic != MAPPED_INDEX_MAGIC:
+                raise MappedIndexError("%s: not a mapped index" % path)
+            if version != format_version:
+                raise MappedIndexError("%s: format version %d != %d"
+                                       % (path, version, format_version))
+            if not metadata_offset or metadata_offset + metadata_length > len(self._mmap):
+                raise MappedIndexError("%s: incomplete index" % path)
+            contents = json.loads(self._mmap[metadata_offset:metadata_offset + metadata_length]
+                                  .decode('utf-8'))
+        except Exception:
+            self._mmap.close()
+            raise
+        self.metadata = contents['metadata']
+        self._tables = contents['tables']
+
+    def table(self, table_name):
+        keys_offset, key_count, slots_offset = self._tables[table_name]
+        return MappedTable(self._mmap, keys_offset, key_count, slots_offset)
+
+    def close(self):
+        """Unmap the index file.  Tables taken from the index can't be read afterwards."""
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class MappedTable(Mapping):
+    """A Mapping[str, List[Tuple[str, str]]] read directly from a :class:`MappedIndex`."""
+
+    def __init__(self, mm, keys_offset, key_count, slots_offset):
+        self._mmap = mm
+        self._keys_offset = keys_offset
+        self._key_count = key_count
+        self._slots_offset = slots_offset
+
+    def _key_entry(self, ndx):
+        return _KEY.unpack_from(self._mmap, self._keys_offset + ndx * _KEY.size)
+
+    def _string(self, offset, length):
+        return self._mmap[offset:offset + length].decode('utf-8')
+
+    def _find(self, key):
+        key = ensure_binary(key)
+        lo, hi = 0, self._key_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            offset, length, first_slot, slot_count = self._key_entry(mid)
+            probe = self._mmap[offset:offset + length]
+            if probe < key:
+                lo = mid + 1
+            elif probe > key:
+                hi = mid
+            else:
+                return first_slot, slot_count
+        return None
+
+    def __getitem__(self, key):
+        found = self._find(key)
+        if found is None:
+            raise KeyError(key)
+        first_slot, slot_count = found
+        result = []
+        for ndx in range(first_slot, first_slot + slot_count):
+            first_offset, first_length, second_offset, second_length = _SLOT.unpack_from(
+                self._mmap, self._slots_offset + ndx * _SLOT.size)
+            result.append((self._string(first_offset, first_length),
+                           self._string(second_offset, second_length)))
+        return result
+
+    def __contains__(self, key):
+        return self._find(key) is not None
+
+    def __iter__(self):
+        for ndx in range(self._key_count):
+            offset, length, _, _ = self._key_entry(ndx)
+            yield self._string(offset, length)
+
+    def __len__(self):
+        return self._key_count
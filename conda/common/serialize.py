@@ -3,10 +3,13 @@
 # SPDX-License-Identifier: BSD-3-Clause
 from __future__ import absolute_import, division, print_function, unicode_literals
 
+import codecs
+from copy import deepcopy
 import json
 from logging import getLogger
+import re
 
-from .compat import PY2, odict, ensure_text_type
+from .compat import PY2, ensure_text_type, odict, string_types
 from .._vendor.auxlib.decorators import memoize
 from .._vendor.auxlib.entity import EntityEncoder
 
@@ -90,3 +93,299 @@ def json_load(string):
 def json_dump(object):
     return ensure_text_type(json.dumps(object, indent=2, sort_keys=True,
                                        separators=(',', ': '), cls=EntityEncoder))
+
+
+class _JSONStream(object):
+    """A read-ahead buffer over a file handle, decoding JSON values on demand."""
+
+    _whitespace = ' \t\n\r'
+    _structural = re.compile(r'[{}\[\]"]')
+    _string_special = re.compile(r'["\\]')
+    _scalar_end = re.compile(r'[,}\]\s]')
+
+    def __init__(self, fh, chunk_size):
+        self._fh = fh
+        self._chunk_size = chunk_size
+        self._buf = ''
+        self._pos = 0
+        self._eof = False
+        self._bytes_decoder = None
+        self._json_decoder = json.JSONDecoder()
+
+    def _fill(self):
+        # Returns True if more data was appended to the buffer.
+        while not self._eof:
+            chunk = self._fh.read(self._chunk_size)
+            if isinstance(chunk, bytes):
+                if self._bytes_decoder is None:
+                    self._bytes_decoder = codecs.getincrementaldecoder('utf-8')()
+                text = self._bytes_decoder.decode(chunk, final=not chunk)
+            else:
+                text = chunk
+            if not chunk:
+                self._eof = True
+            if text:
+                self._buf = self._buf[self._pos:] + text
+                self._pos = 0
+                return True
+        return False
+
+    def peek(self):
+        while True:
+            buf, pos = self._buf, self._pos
+            while pos < len(buf) and buf[pos] in self._whitespace:
+                pos += 1
+            self._pos = pos
+            if pos < len(buf):
+                return buf[pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, char):
+        found = self.peek()
+        if found != char:
+            raise ValueError("Expecting %r at offset %d, found %r" % (char, self._pos, found))
+        self._pos += 1
+
+    def _value_end(self):
+        # Returns the offset just past the value that starts at self._pos, reading more of the
+        # file until the whole value, and for a number the delimiter after it, is buffered.
+        # Strings and nesting are tracked as the buffer grows, so each character is scanned
+        # once however many chunks the value spans.  For malformed input, the offset returned
+        # is only a point at which decoding will fail.
+        first = self.peek()
+        depth = 0
+        in_string = False
+        offset = 0  # from self._pos, which _fill() may move, of the first unscanned character
+        while True:
+            buf = self._buf
+            pos = self._pos + offset
+            if first and first not in '{["':
+                # a number or literal; it ends at the first delimiter
+                match = self._scalar_end.search(buf, pos)
+                if match:
+                    return match.start()
+                pos = len(buf)
+            else:
+                while True:
+                    if in_string:
+                        match = self._string_special.search(buf, pos)
+                        if match is None:
+                            pos = len(buf)
+                            break
+                        if match.group() == '\\':
+                            if match.end() == len(buf):
+                                # the escaped character is in the next chunk
+                                pos = match.start()
+                                break
+                            pos = match.end() + 1
+                            continue
+                        in_string = False
+                        pos = match.end()
+                        if depth <= 0:
+                            return pos
+                    else:
+                        match = self._structural.search(buf, pos)
+                        if match is None:
+                            pos = len(buf)
+                            break
+                        char, pos = match.group(), match.end()
+                        if char == '"':
+                            in_string = True
+                        elif char in '{[':
+                            depth += 1
+                        else:
+                            depth -= 1
+                            if depth <= 0:
+                                return pos
+            offset = pos - self._pos
+            if not self._fill():
+                return len(self._buf)
+
+    def decode_value(self):
+        self.peek()
+        try:
+            value, end = self._json_decoder.raw_decode(self._buf, self._pos)
+        except ValueError:
+            # Most likely the value straddles the end of the buffer.
+            end = None
+        if end is None or end == len(self._buf):
+            # Buffer the rest of the value, which for a number or literal may have been cut
+            # short at the buffer boundary, before decoding it once more.
+            self._value_end()
+            value, end = self._json_decoder.raw_decode(self._buf, self._pos)
+        self._pos = end
+        return value
+
+    def iter_object_keys(self):
+        # Assumes the opening '{' has been consumed. The caller must consume the value
+        # belonging to each key before asking for the next one.
+        first = True
+        while True:
+            if self.peek() == '}':
+                self._pos += 1
+                return
+            if not first:
+                self.expect(',')
+            first = False
+            key = self.decode_value()
+            if not isinstance(key, string_types):
+                raise ValueError("Expecting string object key, found %r" % (key,))
+            self.expect(':')
+            yield key
+
+
+def json_stream_items(fh, expand_keys=(), chunk_size=1 << 16):
+    """Incrementally decode the top-level JSON object read from the file handle `fh`.
+
+    Rather than materializing the whole document, this yields one ``(parent_key, key, value)``
+    event per entry as it is read.  Top-level entries are yielded with ``parent_key=None``.
+    The values of top-level keys listed in `expand_keys` must themselves be JSON objects; they
+    are never decoded as a whole, and their entries are instead yielded individually with
+    ``parent_key`` set to the expanded key.  `fh` may produce either text or utf-8 bytes.
+    An empty document yields nothing.
+
+    Examples:
+        >>> from io import StringIO
+        >>> doc = StringIO('{"info": {"subdir": "noarch"}, "packages": {"a": 1, "b": [2]}}')
+        >>> for event in json_stream_items(doc, expand_keys=('packages',)):
+        ...     print(event)
+        (None, 'info', {'subdir': 'noarch'})
+        ('packages', 'a', 1)
+        ('packages', 'b', [2])
+
+    """
+    stream = _JSONStream(fh, chunk_size)
+    if not stream.peek():
+        return
+    stream.expect('{')
+    for key in stream.iter_object_keys():
+        if key in expand_keys:
+            stream.expect('{')
+            for sub_key in stream.iter_object_keys():
+                yield key, sub_key, stream.decode_value()
+        else:
+            yield None, key, stream.decode_value()
+    if stream.peek():
+        raise ValueError("Extra data after end of JSON document")
+
+
+class JsonPatchError(ValueError):
+    pass
+
+
+def split_json_pointer(pointer):
+    if pointer == '':
+        return []
+    if not pointer.startswith('/'):
+        raise JsonPatchError("Invalid JSON pointer %r" % (pointer,))
+    return [part.replace('~1', '/').replace('~0', '~') for part in pointer.split('/')[1:]]
+
+
+def _json_pointer_parent(document, pointer):
+    parts = split_json_pointer(pointer)
+    if not parts:
+        return None, None
+    parent = document
+    try:
+        for part in parts[:-1]:
+            parent = parent[int(part)] if isinstance(parent, list) else parent[part]
+    except (KeyError, IndexError, ValueError, TypeError):
+        raise JsonPatchError("JSON pointer %r does not exist in document" % (pointer,))
+    key = parts[-1]
+    if isinstance(parent, list) and key != '-':
+        try:
+            key = int(key)
+        except ValueError:
+            raise JsonPatchError("Invalid array index in JSON pointer %r" % (pointer,))
+    elif not isinstance(parent, (dict, list)):
+        raise JsonPatchError("JSON pointer %r does not exist in document" % (pointer,))
+    return parent, key
+
+
+def _json_pointer_get(document, pointer):
+    parent, key = _json_pointer_parent(document, pointer)
+    if parent is None:
+        return document
+    try:
+        return parent[key]
+    except (KeyError, IndexError, TypeError):
+        raise JsonPatchError("JSON pointer %r does not exist in document" % (pointer,))
+
+
+def _json_pointer_add(document, pointer, value):
+    parent, key = _json_pointer_parent(document, pointer)
+    if parent is None:
+        return value
+    if isinstance(parent, list):
+        if key == '-':
+            parent.append(value)
+        elif 0 <= key <= len(parent):
+            parent.insert(key, value)
+        else:
+            raise JsonPatchError("Array index out of range in JSON pointer %r" % (pointer,))
+    else:
+        parent[key] = value
+    return document
+
+
+def _json_pointer_remove(document, pointer):
+    parent, key = _json_pointer_parent(document, pointer)
+    if parent is None:
+        raise JsonPatchError("Cannot remove the whole document")
+    try:
+        return parent.pop(key)
+    except (KeyError, IndexError, TypeError):
+        raise JsonPatchError("JSON pointer %r does not exist in document" % (pointer,))
+
+
+def _apply_json_patch_operation(document, operation):
+    op, path = operation['op'], operation['path']
+    if op == 'add':
+        document = _json_pointer_add(document, path, operation['value'])
+    elif op == 'remove':
+        _json_pointer_remove(document, path)
+    elif op == 'replace':
+        _json_pointer_get(document, path)
+        parent, key = _json_pointer_parent(document, path)
+        if parent is None:
+            document = operation['value']
+        else:
+            parent[key] = operation['value']
+    elif op == 'move':
+        if path.startswith(operation['from'] + '/'):
+            raise JsonPatchError("Cannot move %r into itself" % (operation['from'],))
+        value = _json_pointer_remove(document, operation['from'])
+        document = _json_pointer_add(document, path, value)
+    elif op == 'copy':
+        value = deepcopy(_json_pointer_get(document, operation['from']))
+        document = _json_pointer_add(document, path, value)
+    elif op == 'test':
+        if _json_pointer_get(document, path) != operation['value']:
+            raise JsonPatchError("Test failed for JSON pointer %r" % (path,))
+    else:
+        raise JsonPatchError("Unknown JSON patch operation %r" % (op,))
+    return document
+
+
+def apply_json_patch(document, patch):
+    """Apply a sequence of RFC 6902 JSON patch operations to a decoded JSON `document`.
+
+    The document is modified in place where possible; the patched document is returned.
+    Raises :class:`JsonPatchError` if an operation cannot be applied.
+
+    Examples:
+        >>> doc = {"packages": {"a": {"version": "1.0"}}}
+        >>> apply_json_patch(doc, [
+        ...     {"op": "replace", "path": "/packages/a/version", "value": "1.1"},
+        ...     {"op": "add", "path": "/packages/b", "value": {}},
+        ... ]) == {"packages": {"a": {"version": "1.1"}, "b": {}}}
+        True
+
+    """
+    for operation in patch:
+        try:
+            document = _apply_json_patch_operation(document, operation)
+        except (KeyError, TypeError) as e:
+            raise JsonPatchError("Invalid JSON patch operation %r: %r" % (operation, e))
+    return document
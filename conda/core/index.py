@@ -12,10 +12,11 @@ from .subdir_data import SubdirData, make_feature_record
 from .._vendor.boltons.setutils import IndexedSet
 from ..base.context import context
 from ..common.compat import itervalues
-from ..common.io import ThreadLimitedThreadPoolExecutor, as_completed, time_recorder
+from ..common.io import (FIRST_COMPLETED, ThreadLimitedThreadPoolExecutor, instrumentation_enabled,
+                         time_recorder, wait)
 from ..exceptions import OperationNotAllowed
 from ..models.channel import Channel, all_channel_urls
-from ..models.match_spec import MatchSpec
+from ..models.match_spec import MatchSpec, spec_cache
 from ..models.records import EMPTY_LINK, PackageCacheRecord, PrefixRecord
 from ..resolve import dashlist
 
@@ -139,6 +140,20 @@ def calculate_channel_urls(channel_urls=(), prepend=True, platform=None, use_loc
     return all_channel_urls(channel_urls, subdirs=subdirs)
 
 
+def get_subdir_datas(channels, subdirs):
+    channel_urls = all_channel_urls(channels, subdirs=subdirs)
+    check_whitelist(channel_urls)
+
+    if context.offline:
+        grouped_urls = groupby(lambda url: url.startswith('file://'), channel_urls)
+        ignored_urls = grouped_urls.get(False, ())
+        if ignored_urls:
+            log.info("Ignoring the following channel urls because mode is offline.%s",
+                     dashlist(ignored_urls))
+        channel_urls = IndexedSet(grouped_urls.get(True, ()))
+    return tuple(SubdirData(Channel(url)) for url in channel_urls)
+
+
 def get_reduced_index(prefix, channels, subdirs, specs):
 
     # # this block of code is a "combine" step intended to filter out redundant specs
@@ -159,39 +174,40 @@ def get_reduced_index(prefix, channels, subdirs, specs):
     #                 keep_specs.append(spec)
     #         consolidated_specs.update(keep_specs)
 
-    with ThreadLimitedThreadPoolExecutor() as executor:
+    spec_cache_hits, spec_cache_misses = spec_cache.hits, spec_cache.misses
 
-        channel_urls = all_channel_urls(channels, subdirs=subdirs)
-        check_whitelist(channel_urls)
+    with ThreadLimitedThreadPoolExecutor() as executor:
 
-        if context.offline:
-            grouped_urls = groupby(lambda url: url.startswith('file://'), channel_urls)
-            ignored_urls = grouped_urls.get(False, ())
-            if ignored_urls:
-                log.info("Ignoring the following channel urls because mode is offline.%s",
-                         dashlist(ignored_urls))
-            channel_urls = IndexedSet(grouped_urls.get(True, ()))
-        subdir_datas = tuple(SubdirData(Channel(url)) for url in channel_urls)
+        subdir_datas = get_subdir_datas(channels, subdirs)
+        # Fetch and parse all repodata up front, so that every channel and subdir is
+        # downloaded concurrently rather than on its first query below.
+        SubdirData.load_all(subdir_datas)
 
         records = IndexedSet()
         collected_names = set()
         collected_track_features = set()
-        pending_names = set()
-        pending_track_features = set()
+        in_flight = set()
+
+        def query_subdir(sd, spec):
+            # SubdirData.query() is a generator; consume it in the worker thread
+            return tuple(sd.query(spec))
 
-        def query_all(spec):
-            futures = tuple(executor.submit(sd.query, spec) for sd in subdir_datas)
-            return tuple(concat(future.result() for future in as_completed(futures)))
+        def submit(spec):
+            in_flight.update(executor.submit(query_subdir, sd, spec) for sd in subdir_datas)
 
         def push_spec(spec):
+            # Each newly seen name or feature is queried as soon as it is discovered, rather
+            # than after every query already in flight has returned.
             name = spec.get_raw_value('name')
             if name and name not in collected_names:
-                pending_names.add(name)
+                collected_names.add(name)
+                submit(MatchSpec(name))
             track_features = spec.get_raw_value('track_features')
             if track_features:
                 for ftr_name in track_features:
                     if ftr_name not in collected_track_features:
-                        pending_track_features.add(ftr_name)
+                        collected_track_features.add(ftr_name)
+                        submit(MatchSpec(track_features=ftr_name))
 
         def push_record(record):
             push_spec(MatchSpec(record.name))
@@ -207,21 +223,11 @@ def get_reduced_index(prefix, channels, subdirs, specs):
         for spec in specs:
             push_spec(spec)
 
-        while pending_names or pending_track_features:
-            while pending_names:
-                name = pending_names.pop()
-                collected_names.add(name)
-                spec = MatchSpec(name)
-                new_records = query_all(spec)
-                for record in new_records:
-                    push_record(record)
-                records.update(new_records)
-
-            while pending_track_features:
-                feature_name = pending_track_features.pop()
-                collected_track_features.add(feature_name)
-                spec = MatchSpec(track_features=feature_name)
-                new_records = query_all(spec)
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            in_flight.difference_update(done)
+            for future in done:
+                new_records = future.result()
                 for record in new_records:
                     push_record(record)
                 records.update(new_records)
@@ -247,4 +253,11 @@ def get_reduced_index(prefix, channels, subdirs, specs):
             rec = make_feature_record(ftr_str)
             reduced_index[rec] = rec
 
+        spec_cache_hits = spec_cache.hits - spec_cache_hits
+        spec_cache_misses = spec_cache.misses - spec_cache_misses
+        log.debug("MatchSpec parse cache: %d hits, %d misses", spec_cache_hits, spec_cache_misses)
+        if instrumentation_enabled():
+            time_recorder.record('matchspec_parse_cache_hits', spec_cache_hits)
+            time_recorder.record('matchspec_parse_cache_misses', spec_cache_misses)
+
         return reduced_index
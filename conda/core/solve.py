@@ -4,31 +4,40 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 from genericpath import exists
+import hashlib
 from logging import DEBUG, getLogger
-from os.path import join
+from os import listdir
+from os.path import getmtime, join
 import sys
 from textwrap import dedent
+from time import time
+from uuid import uuid4
 
-from .index import get_reduced_index
+from .index import get_reduced_index, get_subdir_datas
 from .link import PrefixSetup, UnlinkLinkTransaction
 from .prefix_data import PrefixData
-from .subdir_data import SubdirData
+from .subdir_data import SubdirData, create_cache_dir
 from .. import CondaError, __version__ as CONDA_VERSION
 from .._vendor.auxlib.ish import dals
 from .._vendor.boltons.setutils import IndexedSet
 from ..base.constants import DepsModifier, UNKNOWN_CHANNEL, UpdateModifier
 from ..base.context import context
-from ..common.compat import iteritems, itervalues, odict, text_type
+from ..common.compat import ensure_binary, iteritems, itervalues, odict, on_win, text_type
 from ..common.constants import NULL
 from ..common.io import Spinner
 from ..common.path import get_major_minor_version, paths_equal
+from ..common.serialize import json_dump, json_load
 from ..exceptions import PackagesNotFoundError
+from ..gateways.disk import mkdir_p
+from ..gateways.disk.delete import rm_rf
+from ..gateways.disk.update import rename, touch
 from ..gateways.logging import TRACE
 from ..history import History
 from ..models.channel import Channel
 from ..models.enums import NoarchType
 from ..models.match_spec import MatchSpec
 from ..models.prefix_graph import PrefixGraph
+from ..models.records import PackageRecord
 from ..models.version import VersionOrder
 from ..resolve import Resolve, dashlist
 
@@ -77,6 +86,7 @@ class Solver(object):
         self._index = None
         self._r = None
         self._prepared = False
+        self._profile = None
 
     def solve_final_state(self, update_modifier=NULL, deps_modifier=NULL, prune=NULL,
                           ignore_pinned=NULL, force_remove=NULL):
@@ -113,6 +123,31 @@ class Solver(object):
                 the solved state of the environment.
 
         """
+        if not context.solver_profile:
+            return self._solve_final_state(update_modifier, deps_modifier, prune,
+                                           ignore_pinned, force_remove)
+
+        self._profile = profile = {
+            'prefix': self.prefix,
+            'specs_to_add': sorted(text_type(s) for s in self.specs_to_add),
+            'specs_to_remove': sorted(text_type(s) for s in self.specs_to_remove),
+        }
+        start = time()
+        try:
+            return self._solve_final_state(update_modifier, deps_modifier, prune,
+                                           ignore_pinned, force_remove)
+        except Exception as e:
+            profile['error'] = type(e).__name__
+            raise
+        finally:
+            profile['seconds'] = time() - start
+            self._profile = None
+            if self._r is not None:
+                self._r.profile = None
+            write_solver_profile(context.solver_profile, profile)
+
+    def _solve_final_state(self, update_modifier, deps_modifier, prune, ignore_pinned,
+                           force_remove):
         if update_modifier is NULL:
             update_modifier = context.update_modifier
         else:
@@ -156,6 +191,16 @@ class Solver(object):
                 # Return early, with a solution that should just be PrefixData().iter_records()
                 return IndexedSet(PrefixGraph(solution).graph)
 
+        solver_cache_key = self._solver_cache_key(update_modifier, deps_modifier, prune,
+                                                  ignore_pinned)
+        if solver_cache_key:
+            cached_solution = read_solver_cache(solver_cache_key)
+            if cached_solution is not None:
+                log.debug("using cached solution %s for prefix %s", solver_cache_key, self.prefix)
+                if self._profile is not None:
+                    self._profile['solver_cache_hit'] = True
+                return cached_solution
+
         specs_from_history_map = History(self.prefix).get_requested_specs_map()
         if prune:  # or update_modifier == UpdateModifier.UPDATE_ALL  # pending conda/constructor#138  # NOQA
             # Users are struggling with the prune functionality in --update-all, due to
@@ -188,7 +233,11 @@ class Solver(object):
             itervalues(specs_from_history_map),
         ))
 
+        start = time()
         index, r = self._prepare(prepared_specs)
+        if self._profile is not None:
+            self._profile['prepare_seconds'] = time() - start
+            r.profile = self._profile.setdefault('solves', [])
 
         if specs_to_remove:
             # In a previous implementation, we invoked SAT here via `r.remove()` to help with
@@ -430,6 +479,8 @@ class Solver(object):
                   "  solved_linked_dists:\n"
                   "    %s\n",
                   self.prefix, "\n    ".join(prec.dist_str() for prec in solution))
+        if solver_cache_key and not r.suboptimal:
+            write_solver_cache(solver_cache_key, solution)
         return solution
 
     def solve_for_diff(self, update_modifier=NULL, deps_modifier=NULL, prune=NULL,
@@ -558,19 +609,7 @@ class Solver(object):
             self._prepared_specs = prepared_specs
             self._r = Resolve(self._index, channels=self.channels)
         else:
-            # add in required channels that aren't explicitly given in the channels list
-            # For correctness, we should probably add to additional_channels any channel that
-            #  is given by PrefixData(self.prefix).all_subdir_urls().  However that causes
-            #  usability problems with bad / expired tokens.
-
-            additional_channels = set()
-            for spec in self.specs_to_add:
-                # TODO: correct handling for subdir isn't yet done
-                channel = spec.get_exact_value('channel')
-                if channel:
-                    additional_channels.add(Channel(channel))
-
-            self.channels.update(additional_channels)
+            self._add_spec_channels()
             reduced_index = get_reduced_index(self.prefix, self.channels,
                                               self.subdirs, prepared_specs)
             self._prepared_specs = prepared_specs
@@ -580,6 +619,72 @@ class Solver(object):
         self._prepared = True
         return self._index, self._r
 
+    def _add_spec_channels(self):
+        # add in required channels that aren't explicitly given in the channels list
+        # For correctness, we should probably add to additional_channels any channel that
+        #  is given by PrefixData(self.prefix).all_subdir_urls().  However that causes
+        #  usability problems with bad / expired tokens.
+
+        additional_channels = set()
+        for spec in self.specs_to_add:
+            # TODO: correct handling for subdir isn't yet done
+            channel = spec.get_exact_value('channel')
+            if channel:
+                additional_channels.add(Channel(channel))
+
+        self.channels.update(additional_channels)
+
+    def _solver_cache_key(self, update_modifier, deps_modifier, prune, ignore_pinned):
+        # A digest of everything the final state depends on: the repodata stamps of every
+        # channel subdir, the specs, the state of the prefix, and the configuration that
+        # changes solver behavior.  Returns None, and the solve isn't cached, if the cache is
+        # disabled or some input can't be fingerprinted without solving.
+        if not context.solver_cache_size or self._index:
+            return None
+
+        self._add_spec_channels()
+        subdir_datas = get_subdir_datas(self.channels, self.subdirs)
+        # A fresh cache file gives its stamp without being loaded, so that a hit costs no more
+        # than reading a few headers.  Only the rest are fetched and loaded here.
+        stamps = {sd: sd.cached_repodata_stamp() for sd in subdir_datas}
+        SubdirData.load_all(sd for sd in subdir_datas if stamps[sd] is None)
+        repodata_stamps = []
+        for sd in subdir_datas:
+            stamp = stamps[sd] or sd.repodata_stamp()
+            if stamp is None:
+                log.debug("not caching solution; no repodata stamp for %s", sd.url_w_subdir)
+                return None
+            repodata_stamps.append((sd.url_w_subdir, stamp))
+
+        def strings(items):
+            return sorted(text_type(item) for item in items)
+
+        fingerprint = {
+            'conda_version': CONDA_VERSION,
+            'prefix': self.prefix,
+            'subdirs': list(self.subdirs),
+            'repodata': repodata_stamps,
+            'specs_to_add': strings(self.specs_to_add),
+            'specs_to_remove': strings(self.specs_to_remove),
+            'prefix_records': strings(prec.dist_str()
+                                      for prec in PrefixData(self.prefix).iter_records()),
+            'history_specs': strings(itervalues(History(self.prefix).get_requested_specs_map())),
+            'pinned_specs': strings(get_pinned_specs(self.prefix)),
+            'modifiers': [text_type(arg) for arg in (update_modifier, deps_modifier, prune,
+                                                     ignore_pinned)],
+            'context': {name: text_type(getattr(context, name)) for name in (
+                'add_pip_as_python_dependency',
+                'aggressive_update_packages',
+                'auto_update_conda',
+                'channel_priority',
+                'offline',
+                'root_prefix',
+                'sat_solver',
+                'track_features',
+            )},
+        }
+        return hashlib.sha256(ensure_binary(json_dump(fingerprint))).hexdigest()
+
     def _check_solution(self, solution, pinned_specs):
         # Ensure that solution is consistent with pinned specs.
         for spec in pinned_specs:
@@ -601,6 +706,65 @@ class Solver(object):
                 #         assert any(spec.match(d) for d in solution)
 
 
+def _solver_cache_dir():
+    return join(create_cache_dir(), 'solver')
+
+
+def read_solver_cache(key):
+    """Return the solution cached under `key`, or None if there isn't one."""
+    path = join(_solver_cache_dir(), key + '.json')
+    try:
+        with open(path) as fh:
+            cached = json_load(fh.read())
+        solution = IndexedSet(PackageRecord(**prec) for prec in cached['solution'])
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        return None
+    try:
+        # the modification time of an entry records its last use, for eviction
+        touch(path)
+    except (IOError, OSError):  # pragma: no cover
+        pass
+    return solution
+
+
+def write_solver_cache(key, solution):
+    """Cache `solution` under `key`, evicting the least recently used entries to keep at most
+    context.solver_cache_size of them."""
+    cache_dir = _solver_cache_dir()
+    path = join(cache_dir, key + '.json')
+    temp_path = '%s.%s.tmp' % (path, uuid4().hex[:8])
+    try:
+        mkdir_p(cache_dir)
+        with open(temp_path, 'w') as fh:
+            fh.write(json_dump({'solution': [prec.dump() for prec in solution]}))
+        rename(temp_path, path, force=on_win)
+
+        entries = []
+        for fn in listdir(cache_dir):
+            if fn.endswith('.json'):
+                try:
+                    entries.append((getmtime(join(cache_dir, fn)), fn))
+                except (IOError, OSError):  # pragma: no cover
+                    pass
+        for _, fn in sorted(entries, reverse=True)[context.solver_cache_size:]:
+            rm_rf(join(cache_dir, fn))
+    except (IOError, OSError) as e:
+        log.debug("failed to write solver cache %s: %r", path, e)
+    finally:
+        rm_rf(temp_path)
+
+
+def write_solver_profile(path, profile):
+    """Write the report collected for Solver.solve_final_state() to `path`, as JSON."""
+    try:
+        with open(path, 'w') as fh:
+            fh.write(json_dump(profile))
+    except (IOError, OSError) as e:
+        log.warning("failed to write solver profile %s: %r", path, e)
+    else:
+        log.info("solver profile written to %s", path)
+
+
 def get_pinned_specs(prefix):
     """Find pinned specs from file and return a tuple of MatchSpec."""
     pinfile = join(prefix, 'conda-meta', 'pinned')
@@ -4,18 +4,21 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 import bz2
-from collections import defaultdict
+from collections import Mapping, defaultdict
 from contextlib import closing
 from errno import EACCES, ENODEV, EPERM
 from genericpath import getmtime, isfile
 import hashlib
+from io import BytesIO
 import json
 from logging import DEBUG, getLogger
 from mmap import ACCESS_READ, mmap
 from os.path import dirname, isdir, join, splitext
 import re
 from textwrap import dedent
+from threading import Lock
 from time import time
+from uuid import uuid4
 import warnings
 
 from .. import CondaError
@@ -23,18 +26,23 @@ from .._vendor.auxlib.ish import dals
 from .._vendor.auxlib.logz import stringify
 from ..base.constants import CONDA_HOMEPAGE_URL
 from ..base.context import context
-from ..common.compat import (ensure_binary, ensure_text_type, ensure_unicode, iteritems,
-                             string_types, text_type, with_metaclass)
+from ..common.compat import (StringIO, ensure_binary, ensure_text_type, ensure_unicode,
+                             iteritems, itervalues, odict, on_win, string_types, text_type,
+                             with_metaclass)
 from ..common.io import ThreadLimitedThreadPoolExecutor, as_completed
+from ..common.mapped_index import MappedIndex, write_mapped_index
+from ..common.serialize import (JsonPatchError, apply_json_patch, json_stream_items,
+                                split_json_pointer)
 from ..common.url import join_url, maybe_unquote
 from ..core.package_cache_data import PackageCacheData
 from ..exceptions import CondaDependencyError, CondaHTTPError, NotWritableError
 from ..gateways.connection import (ConnectionError, HTTPError, InsecureRequestWarning,
                                    InvalidSchema, SSLError)
-from ..gateways.connection.session import CondaSession
+from ..gateways.connection.session import CondaSession, host_request_limit
 from ..gateways.disk import mkdir_p, mkdir_p_sudo_safe
 from ..gateways.disk.delete import rm_rf
-from ..gateways.disk.update import touch
+from ..gateways.disk.update import rename, touch
+from ..lock import ReadWriteLock
 from ..models.channel import Channel, all_channel_urls
 from ..models.match_spec import MatchSpec
 from ..models.records import PackageRecord, PackageRef
@@ -45,14 +53,20 @@ except ImportError:  # pragma: no cover
     from .._vendor.toolz.itertoolz import concat, take  # NOQA
 
 try:
-    import cPickle as pickle
+    import zstandard
 except ImportError:  # pragma: no cover
-    import pickle  # NOQA
+    zstandard = None
 
 log = getLogger(__name__)
 stderrlog = getLogger('conda.stderrlog')
 
-REPODATA_PICKLE_VERSION = 25
+REPODATA_PICKLE_VERSION = 28
+REPODATA_PATCH_FILENAME = 'repodata.patch.json'
+REPODATA_FILENAMES = {
+    'zst': 'repodata.json.zst',
+    'bz2': 'repodata.json.bz2',
+    'json': 'repodata.json',
+}
 REPODATA_HEADER_RE = b'"(_etag|_mod|_cache_control)":[ ]?"(.*?[^\\\\])"[,\}\s]'
 
 
@@ -90,6 +104,18 @@ class SubdirData(object):
             ) for url in channel_urls)
             return tuple(concat(future.result() for future in as_completed(futures)))
 
+    @staticmethod
+    def load_all(subdir_datas):
+        """Load every SubdirData not already loaded, fetching and parsing them concurrently."""
+        pending = tuple(sd for sd in subdir_datas if not sd._loaded)
+        if not pending:
+            return
+        max_workers = max(1, min(len(pending), context.remote_max_connections))
+        with ThreadLimitedThreadPoolExecutor(max_workers) as executor:
+            futures = tuple(executor.submit(sd.load) for sd in pending)
+            for future in as_completed(futures):
+                future.result()
+
     def query(self, package_ref_or_match_spec):
         if not self._loaded:
             self.load()
@@ -99,23 +125,30 @@ class SubdirData(object):
         if isinstance(param, MatchSpec):
             if param.get_exact_value('name'):
                 package_name = param.get_exact_value('name')
-                for prec in self._names_index[package_name]:
+                for prec in self._package_records_for_name(package_name):
                     if param.match(prec):
                         yield prec
             elif param.get_exact_value('track_features'):
                 track_features = param.get_exact_value('track') or ()
-                candidates = concat(self._track_features_index[feature_name]
-                                    for feature_name in track_features)
-                for prec in candidates:
-                    if param.match(prec):
-                        yield prec
+                candidate_names = set(concat(self._track_features_index.get(feature_name, ())
+                                             for feature_name in track_features))
+                for package_name in candidate_names:
+                    for prec in self._package_records_for_name(package_name):
+                        if param.match(prec):
+                            yield prec
             else:
-                for prec in self._package_records:
+                candidate_names = self._candidate_names(param)
+                if candidate_names is None:
+                    precs = self.iter_records()
+                else:
+                    precs = concat(self._package_records_for_name(package_name)
+                                   for package_name in candidate_names)
+                for prec in precs:
                     if param.match(prec):
                         yield prec
         else:
             assert isinstance(param, PackageRef)
-            for prec in self._names_index[param.name]:
+            for prec in self._package_records_for_name(param.name):
                 if prec == param:
                     yield prec
 
@@ -131,6 +164,7 @@ class SubdirData(object):
         self.cache_path_base = join(create_cache_dir(),
                                     splitext(cache_fn_url(self.url_w_credentials))[0])
         self._loaded = False
+        self._names_index_lock = Lock()
 
     def reload(self):
         self._loaded = False
@@ -142,24 +176,267 @@ class SubdirData(object):
         return self.cache_path_base + '.json'
 
     @property
-    def cache_path_pickle(self):
-        return self.cache_path_base + '.q'
+    def cache_path_index(self):
+        return self.cache_path_base + '.idx'
+
+    @property
+    def cache_path_depends_index(self):
+        return self.cache_path_base + '.deps.idx'
+
+    @property
+    def cache_path_shards(self):
+        return self.cache_path_base + '.shards'
+
+    @property
+    def cache_path_state(self):
+        return self.cache_path_base + '.state.json'
 
     def load(self):
         _internal_state = self._load()
-        self._internal_state = _internal_state
-        self._package_records = _internal_state['_package_records']
-        self._names_index = _internal_state['_names_index']
-        self._track_features_index = _internal_state['_track_features_index']
+        self._set_internal_state(_internal_state)
         self._loaded = True
         return self
 
+    def _set_internal_state(self, _internal_state):
+        self._close_mapped_indexes()
+        self._internal_state = _internal_state
+        self._package_data = _internal_state['_package_data']
+        self._track_features_index = _internal_state['_track_features_index']
+        self._names_index = {}  # PackageRecords materialized so far, keyed by package name
+        self._secondary_indexes = None  # see _secondary_index()
+
+    def _close_mapped_indexes(self):
+        # Unmaps the index files read by the current state, which can't be used afterwards.
+        # On Windows, an index file can't be replaced while it's mapped.
+        _internal_state = getattr(self, '_internal_state', None) or {}
+        for key in ('_mapped_index', '_depends_index'):
+            mapped_index = _internal_state.pop(key, None)
+            if mapped_index is not None:
+                mapped_index.close()
+
+    def repodata_stamp(self):
+        """The (etag, last-modified) pair of the loaded repodata, or None if neither is known.
+
+        Sharded repodata has no single stamp, as each shard is fetched and versioned separately.
+        """
+        if not self._loaded:
+            self.load()
+        etag = self._internal_state.get('_etag')
+        mod = self._internal_state.get('_mod')
+        return (etag, mod) if etag or mod else None
+
+    def cached_repodata_stamp(self):
+        """The stamp load() would give the repodata, read from the headers of the cache file
+        without loading it.  None if that takes a load: the cache is missing or has expired, the
+        channel is local, or the repodata is sharded.
+        """
+        if self._loaded:
+            return self.repodata_stamp()
+        if self.url_w_subdir.startswith('file://') or context.use_repodata_shards:
+            return None
+        try:
+            mtime = getmtime(self.cache_path_json)
+        except (IOError, OSError):
+            return None
+        mod_etag_headers = read_mod_and_etag(self.cache_path_json)
+        if not (context.use_index_cache or context.offline
+                or mtime + get_repodata_max_age(mod_etag_headers) > time()):
+            return None
+        etag, mod = mod_etag_headers.get('_etag'), mod_etag_headers.get('_mod')
+        return (etag, mod) if etag or mod else None
+
     def iter_records(self):
         if not self._loaded:
             self.load()
-        return iter(self._package_records)
+        self._require_all_package_data()
+        return concat(self._package_records_for_name(package_name)
+                      for package_name in tuple(self._package_data))
+
+    @staticmethod
+    def query_all_reverse_dependencies(package_ref_or_match_spec, channels=None, subdirs=None):
+        """The records that depend on a package, given by name or by a MatchSpec.
+
+        For a MatchSpec with more than a package name, a record is only kept when each of its
+        dependencies on that package is satisfied by some record matching the MatchSpec.
+        """
+        from .index import check_whitelist  # TODO: fix in-line import
+        if channels is None:
+            channels = context.channels
+        if subdirs is None:
+            subdirs = context.subdirs
+        spec = MatchSpec(package_ref_or_match_spec)
+        channel_urls = all_channel_urls(channels, subdirs=subdirs)
+        check_whitelist(channel_urls)
+        with ThreadLimitedThreadPoolExecutor() as executor:
+            futures = tuple(executor.submit(
+                SubdirData(Channel(url)).reverse_dependencies, spec.name
+            ) for url in channel_urls)
+            dependents = tuple(concat(future.result() for future in as_completed(futures)))
+        if spec.is_name_only_spec:
+            return dependents
+
+        targets = SubdirData.query_all(spec, channels, subdirs)
+        satisfied = {}
+
+        def is_satisfied(dep_str):
+            if dep_str not in satisfied:
+                dep_spec = MatchSpec(dep_str)
+                satisfied[dep_str] = (dep_spec.name != spec.name
+                                      or any(dep_spec.match(prec) for prec in targets))
+            return satisfied[dep_str]
+
+        return tuple(prec for prec in dependents if all(is_satisfied(dep_str)
+                                                        for dep_str in prec.depends))
+
+    def reverse_dependencies(self, package_name):
+        """The PackageRecords in this subdir that depend on the package `package_name`."""
+        if not self._loaded:
+            self.load()
+        dependents = self._depends_table().get(package_name, ())
+        dependents = set(tuple(dependent) for dependent in dependents)
+        return tuple(prec for name in sorted(set(name for name, _ in dependents))
+                     for prec in self._package_records_for_name(name)
+                     if (name, prec.fn) in dependents)
+
+    def _require_all_package_data(self):
+        if isinstance(self._package_data, _ShardedPackageData):
+            # going through shard by shard would fetch every shard; use the full repodata
+            self._set_internal_state(self._load(use_shards=False))
+
+    def _secondary_index(self, field):
+        # Maps each value of a record field (build, md5, version, or the package names in
+        # depends) to the names of the packages with that value.  All of the secondary
+        # indexes are built together, from the raw package data, on first use.
+        if self._secondary_indexes is None:
+            self._require_all_package_data()
+            with self._names_index_lock:
+                if self._secondary_indexes is None:
+                    self._secondary_indexes = build_secondary_indexes(
+                        self._package_data, self._internal_state['_add_pip'])
+        return self._secondary_indexes[field]
+
+    def _depends_table(self):
+        # Maps each package name to the (name, fn) of the records that depend on it.  Like the
+        # other secondary indexes, it's only built when first needed; but it's then also saved,
+        # in an index file of its own, for later reverse-dependency queries to reuse.
+        self._require_all_package_data()
+        depends_table = self._internal_state.get('_depends_table')
+        if depends_table is None:
+            depends_index = self._read_depends_index()
+            if depends_index is not None:
+                self._internal_state['_depends_index'] = depends_index
+                depends_table = depends_index.table('depends')
+            else:
+                depends_table = self._secondary_index('depends')
+                self._write_depends_index(depends_table)
+            self._internal_state['_depends_table'] = depends_table
+        return depends_table
+
+    def _depends_index_metadata(self):
+        return {key: self._internal_state.get(key) for key in (
+            '_url', '_add_pip', '_mod', '_etag', '_pickle_version',
+        )}
+
+    def _read_depends_index(self):
+        if not isfile(self.cache_path_depends_index):
+            return None
+        try:
+            mapped_index = MappedIndex(self.cache_path_depends_index, REPODATA_PICKLE_VERSION)
+        except Exception:
+            log.debug("Failed to load reverse-dependency index.", exc_info=True)
+            rm_rf(self.cache_path_depends_index)
+            return None
+        if mapped_index.metadata != self._depends_index_metadata():
+            mapped_index.close()
+            return None
+        return mapped_index
 
-    def _load(self):
+    def _write_depends_index(self, depends_index):
+        depends_table = {
+            dep_name: sorted(dependents) for dep_name, dependents in iteritems(depends_index)
+        }
+        try:
+            self._write_cache_file(self.cache_path_depends_index, lambda fh: write_mapped_index(
+                fh, REPODATA_PICKLE_VERSION, self._depends_index_metadata(),
+                {'depends': depends_table},
+            ))
+        except Exception:
+            log.debug("Failed to write reverse-dependency index.", exc_info=True)
+            rm_rf(self.cache_path_depends_index)
+
+    def _candidate_names(self, match_spec):
+        # The names of all packages that might match a spec without an exact name, narrowed
+        # through the secondary indexes, or None if the spec has no indexed field.
+        candidate_names = None
+        for field in SECONDARY_INDEX_FIELDS:
+            if field not in match_spec:
+                continue
+            index = self._secondary_index(field)
+            # exact version specs can still match other spellings, e.g. 1.2 and 1.2.0
+            exact_value = field != 'version' and match_spec.get_exact_value(field)
+            if exact_value:
+                names = index.get(exact_value, ())
+            else:
+                # match against each distinct value, rather than against every record
+                matcher = match_spec._match_components[field]
+                names = concat(value_names for value, value_names in iteritems(index)
+                               if matcher.match(value))
+            candidate_names = (set(names) if candidate_names is None
+                               else candidate_names.intersection(names))
+        return candidate_names
+
+    def _package_records_for_name(self, package_name):
+        # PackageRecord objects are expensive to create, and a typical solve only needs a small
+        # fraction of a subdir's packages.  They are built on first use, one name at a time.
+        try:
+            return self._names_index[package_name]
+        except KeyError:
+            pass
+        # package data is fetched outside the lock, since for sharded repodata it may be
+        # downloaded on demand
+        package_data = self._package_data.get(package_name, ())
+        with self._names_index_lock:
+            if package_name not in self._names_index:
+                self._names_index[package_name] = [
+                    self._make_package_record(fn, info) for fn, info in package_data
+                ]
+            return self._names_index[package_name]
+
+    def _make_package_record(self, fn, info):
+        _internal_state = self._internal_state
+        info = dict(info)
+        info['fn'] = fn
+        info['url'] = join_url(self.url_w_credentials, fn)
+        if (_internal_state['_add_pip'] and info['name'] == 'python'
+                and info['version'].startswith(('2.', '3.'))):
+            info['depends'] = list(info['depends']) + ['pip']
+        info.update(_internal_state['_meta_in_common'])
+        return PackageRecord(**info)
+
+    def _load(self, use_shards=True):
+        if (use_shards and context.use_repodata_shards
+                and not self.url_w_subdir.startswith('file://')):
+            _internal_state = self._load_shards_index()
+            if _internal_state is not None:
+                return _internal_state
+
+        # The cached repodata, and its index, are only ever replaced, atomically, by a process
+        # holding the cache lock for writing.  When the cache has expired, or its index has to
+        # be rebuilt, one process does it while any others wait, and then reuse the result.
+        cache_lock = ReadWriteLock(self.cache_path_base + '.lock')
+        with cache_lock.read():
+            _internal_state = self._load_cached(write_index=False)
+        if _internal_state is None:
+            with cache_lock.write():
+                # another process may have refreshed the cache while this one waited
+                _internal_state = self._load_cached()
+                if _internal_state is None:
+                    _internal_state = self._refresh_cache()
+        return _internal_state
+
+    def _load_cached(self, write_index=True):
+        # Returns the state loaded from the local cache, or None if it needs to be refreshed.
+        # Unless `write_index`, None is also returned when the index needs to be rebuilt.
         try:
             mtime = getmtime(self.cache_path_json)
         except (IOError, OSError):
@@ -169,45 +446,62 @@ class SubdirData(object):
                 log.debug("Using cached data for %s at %s forced. Returning empty repodata.",
                           self.url_w_subdir, self.cache_path_json)
                 return {
-                    '_package_records': (),
-                    '_names_index': defaultdict(list),
-                    '_track_features_index': defaultdict(list),
+                    '_package_data': {},
+                    '_track_features_index': {},
+                    '_add_pip': False,
+                    '_meta_in_common': {},
                 }
-            else:
-                mod_etag_headers = {}
-        else:
-            mod_etag_headers = read_mod_and_etag(self.cache_path_json)
+            return None
 
-            if context.use_index_cache:
-                log.debug("Using cached repodata for %s at %s because use_cache=True",
-                          self.url_w_subdir, self.cache_path_json)
+        mod_etag_headers = read_mod_and_etag(self.cache_path_json)
 
-                _internal_state = self._read_local_repdata(mod_etag_headers.get('_etag'),
-                                                           mod_etag_headers.get('_mod'))
-                return _internal_state
+        if context.use_index_cache:
+            log.debug("Using cached repodata for %s at %s because use_cache=True",
+                      self.url_w_subdir, self.cache_path_json)
 
-            if context.local_repodata_ttl > 1:
-                max_age = context.local_repodata_ttl
-            elif context.local_repodata_ttl == 1:
-                max_age = get_cache_control_max_age(mod_etag_headers.get('_cache_control', ''))
-            else:
-                max_age = 0
-
-            timeout = mtime + max_age - time()
-            if (timeout > 0 or context.offline) and not self.url_w_subdir.startswith('file://'):
-                log.debug("Using cached repodata for %s at %s. Timeout in %d sec",
-                          self.url_w_subdir, self.cache_path_json, timeout)
-                _internal_state = self._read_local_repdata(mod_etag_headers.get('_etag'),
-                                                           mod_etag_headers.get('_mod'))
-                return _internal_state
+            _internal_state = self._read_local_repdata(mod_etag_headers.get('_etag'),
+                                                       mod_etag_headers.get('_mod'),
+                                                       write_index)
+            return _internal_state
 
-            log.debug("Local cache timed out for %s at %s",
-                      self.url_w_subdir, self.cache_path_json)
+        timeout = mtime + get_repodata_max_age(mod_etag_headers) - time()
+        if (timeout > 0 or context.offline) and not self.url_w_subdir.startswith('file://'):
+            log.debug("Using cached repodata for %s at %s. Timeout in %d sec",
+                      self.url_w_subdir, self.cache_path_json, timeout)
+            _internal_state = self._read_local_repdata(mod_etag_headers.get('_etag'),
+                                                       mod_etag_headers.get('_mod'),
+                                                       write_index)
+            return _internal_state
+
+        log.debug("Local cache timed out for %s at %s",
+                  self.url_w_subdir, self.cache_path_json)
+        return None
+
+    def _refresh_cache(self):
+        mod_etag_headers = read_mod_and_etag(self.cache_path_json) if isfile(
+            self.cache_path_json) else {}
+        unavailable = self._read_unavailable_files()
+        known_unavailable = frozenset(unavailable)
+
+        patched_entries = []
+
+        def write_repodata(fh):
+            try:
+                changed = self._patch_cached_repodata(mod_etag_headers.get('_etag'),
+                                                      unavailable, fh)
+                if changed is not None:
+                    patched_entries.append(changed)
+                elif fetch_repodata_remote_request(self.url_w_credentials,
+                                                   mod_etag_headers.get('_etag'),
+                                                   mod_etag_headers.get('_mod'),
+                                                   out_fh=fh, unavailable=unavailable) is None:
+                    fh.write(b'{}')
+            finally:
+                if unavailable != known_unavailable:
+                    self._write_unavailable_files(unavailable)
 
         try:
-            raw_repodata_str = fetch_repodata_remote_request(self.url_w_credentials,
-                                                             mod_etag_headers.get('_etag'),
-                                                             mod_etag_headers.get('_mod'))
+            self._write_cache_file(self.cache_path_json, write_repodata)
         except Response304ContentUnchanged:
             log.debug("304 NOT MODIFIED for '%s'. Updating mtime and loading from disk",
                       self.url_w_subdir)
@@ -216,40 +510,273 @@ class SubdirData(object):
                                                        mod_etag_headers.get('_mod'))
             return _internal_state
         else:
-            if not isdir(dirname(self.cache_path_json)):
-                mkdir_p(dirname(self.cache_path_json))
-            try:
-                with open(self.cache_path_json, 'w') as fh:
-                    fh.write(raw_repodata_str or '{}')
-            except (IOError, OSError) as e:
-                if e.errno in (EACCES, EPERM):
-                    raise NotWritableError(self.cache_path_json, e.errno, caused_by=e)
-                else:
-                    raise
-            _internal_state = self._process_raw_repodata_str(raw_repodata_str)
-            self._internal_state = _internal_state
-            self._pickle_me()
+            if patched_entries:
+                _internal_state = self._update_index(mod_etag_headers, patched_entries[0])
+                if _internal_state is not None:
+                    return _internal_state
+            # stream the records back from the cache file
+            with open(self.cache_path_json, 'rb') as fh:
+                _internal_state = self._process_raw_repodata(fh)
+            self._write_index()
             return _internal_state
 
-    def _pickle_me(self):
+    def _write_cache_file(self, path, write):
+        # Repodata is written to a temporary file, and only replaces the cached file once it
+        # has been completely received.
+        if not isdir(dirname(path)):
+            mkdir_p(dirname(path))
+        temp_path = '%s.%s.tmp' % (path, uuid4().hex[:8])
+        try:
+            with open(temp_path, 'wb') as fh:
+                write(fh)
+            rename(temp_path, path, force=on_win)
+        except (IOError, OSError) as e:
+            if e.errno in (EACCES, EPERM):
+                raise NotWritableError(path, e.errno, caused_by=e)
+            else:
+                raise
+        finally:
+            rm_rf(temp_path)
+
+    def _load_shards_index(self):
+        # In sharded mode, the channel publishes <subdir>/shards/index.json, listing the
+        # package names in the subdir, and one <subdir>/shards/<name>.json file per name with
+        # that name's entries from repodata.json.  Shards are fetched as names are queried.
+        shards_index = self._read_shard_file('index.json')
+        if not shards_index or 'names' not in shards_index:
+            log.debug("No repodata shards published for %s", self.url_w_subdir)
+            return None
+
+        info = shards_index.get('info') or {}
+        subdir = info.get('subdir') or self.channel.subdir
+        assert subdir == self.channel.subdir
+        _track_features_index = {}
+        return {
+            'channel': self.channel,
+            'url_w_subdir': self.url_w_subdir,
+            'url_w_credentials': self.url_w_credentials,
+            'cache_path_base': self.cache_path_base,
+
+            '_package_data': _ShardedPackageData(self, shards_index['names'],
+                                                 _track_features_index),
+            '_track_features_index': _track_features_index,
+            '_add_pip': context.add_pip_as_python_dependency,
+            '_meta_in_common': {
+                'arch': info.get('arch'),
+                'channel': self.channel,
+                'platform': info.get('platform'),
+                'schannel': self.channel.canonical_name,
+                'subdir': subdir,
+            },
+        }
+
+    def _read_shard_file(self, filename):
+        # Returns the decoded json of <subdir>/shards/<filename>, or None if the channel
+        # doesn't publish it.  Each shard is cached separately, with its own etag.
+        cache_path = join(self.cache_path_shards, filename)
+        mod_etag_headers = {}
+        try:
+            mtime = getmtime(cache_path)
+        except (IOError, OSError):
+            if context.use_index_cache or context.offline:
+                return None
+        else:
+            mod_etag_headers = read_mod_and_etag(cache_path)
+            timeout = mtime + get_repodata_max_age(mod_etag_headers) - time()
+            if timeout > 0 or context.use_index_cache or context.offline:
+                return self._read_cached_shard_file(cache_path)
+
+        def write_shard(fh):
+            if fetch_repodata_remote_request(join_url(self.url_w_credentials, 'shards'),
+                                             mod_etag_headers.get('_etag'),
+                                             mod_etag_headers.get('_mod'),
+                                             out_fh=fh, filenames=(filename,)) is None:
+                fh.write(b'{}')
+
         try:
-            log.debug("Saving pickled state for %s at %s", self.url_w_subdir, self.cache_path_json)
-            with open(self.cache_path_pickle, 'wb') as fh:
-                pickle.dump(self._internal_state, fh, -1)  # -1 means HIGHEST_PROTOCOL
+            self._write_cache_file(cache_path, write_shard)
+        except Response304ContentUnchanged:
+            touch(cache_path)
+        return self._read_cached_shard_file(cache_path)
+
+    @staticmethod
+    def _read_cached_shard_file(cache_path):
+        try:
+            with open(cache_path, 'rb') as fh:
+                return json.loads(ensure_text_type(fh.read()))
+        except (IOError, OSError, ValueError):
+            log.debug("Failed to read repodata shard %s", cache_path, exc_info=True)
+            return None
+
+    def _read_unavailable_files(self):
+        # The optional repodata files, such as repodata.patch.json, that this channel subdir has
+        # been found not to publish.  They are remembered, next to the cached repodata, so that
+        # each refresh doesn't ask for them again.
+        try:
+            with open(self.cache_path_state) as fh:
+                return set(json.loads(fh.read())['unavailable'])
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            return set()
+
+    def _write_unavailable_files(self, unavailable):
+        def write_state(fh):
+            fh.write(ensure_binary(json.dumps({'unavailable': sorted(unavailable)})))
+        try:
+            self._write_cache_file(self.cache_path_state, write_state)
+        except (IOError, OSError, NotWritableError) as e:
+            log.debug("Failed to write %s: %r", self.cache_path_state, e)
+
+    def _patch_cached_repodata(self, etag, unavailable, out_fh):
+        """
+        Bring the cached repodata up to date by applying the JSON patches the channel publishes
+        in its repodata.patch.json file.  That file has the form
+
+            {
+              "latest": "<etag of the channel's current repodata.json>",
+              "patches": [
+                {"from": "<etag>", "to": "<etag>", "patch": [<RFC 6902 operations>]},
+                ...
+              ]
+            }
+
+        The patched repodata is streamed from the cache file to `out_fh`, one package entry at
+        a time.  Returns an odict of the entries the patches changed, keyed as by
+        group_repodata_patch_operations(), where each package entry maps to a (previous package
+        name, patched entry) pair; either is None for an added or removed entry.  Returns None,
+        with `out_fh` left empty, if the full repodata must be fetched instead.  Raises
+        Response304ContentUnchanged if the cached repodata is already current.
+        REPODATA_PATCH_FILENAME is added to the `unavailable` set if the channel doesn't
+        publish it, and isn't asked for while it's there.
+        """
+        if (not etag or not context.use_repodata_patches or REPODATA_PATCH_FILENAME in unavailable
+                or self.url_w_subdir.startswith('file://')):
+            return None
+        fetched = fetch_repodata_patches(self.url_w_credentials, unavailable)
+        if fetched is None:
+            return None
+        patch_document, saved_fields = fetched
+
+        try:
+            latest_etag = patch_document['latest']
+            patches_by_etag = {patch['from']: patch for patch in patch_document['patches']}
+        except (KeyError, TypeError):
+            log.debug("Ignoring malformed %s for %s", REPODATA_PATCH_FILENAME, self.url_w_subdir)
+            return None
+
+        patch_chain = []
+        current_etag = etag
+        while current_etag != latest_etag:
+            # each patch is used at most once, so a cycle ends the walk
+            patch = patches_by_etag.pop(current_etag, None)
+            if patch is None:
+                log.debug("No repodata patches lead from %s to %s for %s",
+                          etag, latest_etag, self.url_w_subdir)
+                return None
+            patch_chain.append(patch)
+            current_etag = patch.get('to')
+
+        if not patch_chain:
+            raise Response304ContentUnchanged()
+
+        # saved fields go first, where read_mod_and_etag() expects them
+        saved_fields['_etag'] = latest_etag
+        changed = odict()
+        try:
+            operations = group_repodata_patch_operations(patch_chain)
+            with open(self.cache_path_json, 'rb') as fh:
+                write_repodata_with_saved_fields(iter_patched_repodata(fh, operations, changed),
+                                                 saved_fields, out_fh)
+        except (JsonPatchError, KeyError, TypeError) as e:
+            log.debug("Failed to apply repodata patches for %s: %r", self.url_w_subdir, e)
+            out_fh.seek(0)
+            out_fh.truncate()
+            return None
+        log.debug("Applied %d repodata patches for %s", len(patch_chain), self.url_w_subdir)
+        return changed
+
+    def _update_index(self, mod_etag_headers, changed):
+        # Carries the index of the cached repodata, as it was before patching, over to the
+        # patched repodata.  Only the package names with entries in `changed`, as returned by
+        # _patch_cached_repodata(), are re-indexed; the entries of every other name are copied
+        # across undecoded.  Returns None if there's no valid index to update, or if the patches
+        # changed more than package entries.
+        if any(parent_key != 'packages' for parent_key, _ in changed):
+            return None
+        changed = odict((fn, change) for (_, fn), change in iteritems(changed))
+        mapped_index = self._open_index(mod_etag_headers.get('_etag'),
+                                        mod_etag_headers.get('_mod'))
+        if mapped_index is None:
+            return None
+        patched_headers = read_mod_and_etag(self.cache_path_json)
+        # the index is about to be replaced, so the state read from it is given up
+        self._close_mapped_indexes()
+        try:
+            with mapped_index:
+                packages = mapped_index.table('packages')
+                metadata, updated_packages = update_repodata_index_entries(
+                    packages, mapped_index.metadata, changed)
+                metadata.update((key, patched_headers.get(key)) for key in (
+                    '_etag', '_mod', '_cache_control',
+                ))
+
+                def write_index(fh):
+                    try:
+                        write_mapped_index(fh, REPODATA_PICKLE_VERSION, metadata, {
+                            'packages': _UpdatedMappedTable(packages, updated_packages),
+                        })
+                    finally:
+                        # the previous index has to be closed before it's replaced
+                        mapped_index.close()
+
+                log.debug("Updating index for %s at %s", self.url_w_subdir, self.cache_path_index)
+                self._write_cache_file(self.cache_path_index, write_index)
         except Exception:
-            log.debug("Failed to dump pickled repodata.", exc_info=True)
+            log.debug("Failed to update repodata index.", exc_info=True)
+            rm_rf(self.cache_path_index)
+            return None
+        return self._read_index(patched_headers.get('_etag'), patched_headers.get('_mod'))
 
-    def _read_local_repdata(self, etag, mod_stamp):
-        # first try reading pickled data
-        _pickled_state = self._read_pickled(etag, mod_stamp)
-        if _pickled_state:
-            return _pickled_state
+    def _write_index(self):
+        _internal_state = self._internal_state
+        try:
+            log.debug("Saving index for %s at %s", self.url_w_subdir, self.cache_path_index)
+            metadata = {key: _internal_state[key] for key in (
+                '_url', '_schannel', '_add_pip', '_mod', '_etag', '_cache_control',
+                '_pickle_version',
+            )}
+            metadata['_meta_in_common'] = {k: v for k, v in
+                                           iteritems(_internal_state['_meta_in_common'])
+                                           if k != 'channel'}
+            metadata['_track_features_index'] = {
+                ftr_name: sorted(package_names) for ftr_name, package_names
+                in iteritems(_internal_state['_track_features_index'])
+            }
+            package_data = {
+                package_name: tuple((fn, json.dumps(info, separators=(',', ':')))
+                                    for fn, info in entries)
+                for package_name, entries in iteritems(_internal_state['_package_data'])
+            }
+            self._write_cache_file(self.cache_path_index, lambda fh: write_mapped_index(
+                fh, REPODATA_PICKLE_VERSION, metadata, {'packages': package_data}
+            ))
+        except Exception:
+            log.debug("Failed to write repodata index.", exc_info=True)
+            rm_rf(self.cache_path_index)
+
+    def _read_local_repdata(self, etag, mod_stamp, write_index=True):
+        # first try reading the binary index
+        _indexed_state = self._read_index(etag, mod_stamp)
+        if _indexed_state:
+            return _indexed_state
+        if not write_index:
+            # rebuilding the index needs the cache lock held for writing
+            return None
 
-        # pickled data is bad or doesn't exist; load cached json
+        # the index is bad or doesn't exist; load cached json
         log.debug("Loading raw json for %s at %s", self.url_w_subdir, self.cache_path_json)
-        with open(self.cache_path_json) as fh:
+        with open(self.cache_path_json, 'rb') as fh:
             try:
-                raw_repodata_str = fh.read()
+                _internal_state = self._process_raw_repodata(fh)
             except ValueError as e:
                 # ValueError: Expecting object: line 11750 column 6 (char 303397)
                 log.debug("Error for cache path: '%s'\n%r", self.cache_path_json, e)
@@ -259,54 +786,76 @@ class SubdirData(object):
                 so they can be downloaded again.
                 """)
                 raise CondaError(message)
-            else:
-                _internal_state = self._process_raw_repodata_str(raw_repodata_str)
-                self._internal_state = _internal_state
-                self._pickle_me()
-                return _internal_state
-
-    def _read_pickled(self, etag, mod_stamp):
+        self._write_index()
+        return _internal_state
 
-        if not isfile(self.cache_path_pickle) or not isfile(self.cache_path_json):
-            # Don't trust pickled data if there is no accompanying json data
+    def _open_index(self, etag, mod_stamp):
+        # Returns the MappedIndex of the cached repodata, or None if it's missing or stale.
+        if not isfile(self.cache_path_index) or not isfile(self.cache_path_json):
+            # Don't trust the index if there is no accompanying json data
             return None
 
         try:
-            if isfile(self.cache_path_pickle):
-                log.debug("found pickle file %s", self.cache_path_pickle)
-            with open(self.cache_path_pickle, 'rb') as fh:
-                _pickled_state = pickle.load(fh)
-        except Exception as e:
-            log.debug("Failed to load pickled repodata.", exc_info=True)
-            rm_rf(self.cache_path_pickle)
+            log.debug("found index file %s", self.cache_path_index)
+            mapped_index = MappedIndex(self.cache_path_index, REPODATA_PICKLE_VERSION)
+        except Exception:
+            log.debug("Failed to load repodata index.", exc_info=True)
+            rm_rf(self.cache_path_index)
             return None
-
-        def _check_pickled_valid():
-            yield _pickled_state.get('_url') == self.url_w_credentials
-            yield _pickled_state.get('_schannel') == self.channel.canonical_name
-            yield _pickled_state.get('_add_pip') == context.add_pip_as_python_dependency
-            yield _pickled_state.get('_mod') == mod_stamp
-            yield _pickled_state.get('_etag') == etag
-            yield _pickled_state.get('_pickle_version') == REPODATA_PICKLE_VERSION
-
-        if not all(_check_pickled_valid()):
-            log.debug("Pickle load validation failed for %s at %s.",
+        metadata = mapped_index.metadata
+
+        def _check_index_valid():
+            yield metadata.get('_url') == self.url_w_credentials
+            yield metadata.get('_schannel') == self.channel.canonical_name
+            yield metadata.get('_add_pip') == context.add_pip_as_python_dependency
+            yield metadata.get('_mod') == mod_stamp
+            yield metadata.get('_etag') == etag
+            yield metadata.get('_pickle_version') == REPODATA_PICKLE_VERSION
+
+        if not all(_check_index_valid()):
+            log.debug("Index load validation failed for %s at %s.",
                       self.url_w_subdir, self.cache_path_json)
+            mapped_index.close()
             return None
+        return mapped_index
+
+    def _read_index(self, etag, mod_stamp):
+        mapped_index = self._open_index(etag, mod_stamp)
+        if mapped_index is None:
+            return None
+        metadata = mapped_index.metadata
+
+        _internal_state = {
+            'channel': self.channel,
+            'url_w_subdir': self.url_w_subdir,
+            'url_w_credentials': self.url_w_credentials,
+            'cache_path_base': self.cache_path_base,
 
-        return _pickled_state
+            '_mapped_index': mapped_index,
+            '_package_data': _MappedPackageData(mapped_index.table('packages')),
+            '_track_features_index': {ftr_name: set(package_names) for ftr_name, package_names
+                                      in iteritems(metadata['_track_features_index'])},
+            '_meta_in_common': dict(metadata['_meta_in_common'], channel=self.channel),
+        }
+        _internal_state.update((key, metadata[key]) for key in (
+            '_url', '_schannel', '_add_pip', '_mod', '_etag', '_cache_control',
+            '_pickle_version',
+        ))
+        return _internal_state
 
     def _process_raw_repodata_str(self, raw_repodata_str):
-        json_obj = json.loads(raw_repodata_str or '{}')
+        return self._process_raw_repodata(StringIO(raw_repodata_str or '{}'))
 
-        subdir = json_obj.get('info', {}).get('subdir') or self.channel.subdir
-        assert subdir == self.channel.subdir
+    def _process_raw_repodata(self, fh):
+        # Repodata is decoded incrementally from the file handle, and each package entry is
+        # indexed by name as it arrives.  Entries are kept as the plain decoded dicts; the
+        # corresponding PackageRecord objects are only created on demand.
         add_pip = context.add_pip_as_python_dependency
         schannel = self.channel.canonical_name
 
-        self._package_records = _package_records = []
-        self._names_index = _names_index = defaultdict(list)
-        self._track_features_index = _track_features_index = defaultdict(list)
+        _package_data = defaultdict(list)
+        _track_features_index = defaultdict(set)
+        info = {}
 
         _internal_state = {
             'channel': self.channel,
@@ -314,43 +863,122 @@ class SubdirData(object):
             'url_w_credentials': self.url_w_credentials,
             'cache_path_base': self.cache_path_base,
 
-            '_package_records': _package_records,
-            '_names_index': _names_index,
+            '_package_data': _package_data,
             '_track_features_index': _track_features_index,
 
-            '_etag': json_obj.get('_etag'),
-            '_mod': json_obj.get('_mod'),
-            '_cache_control': json_obj.get('_cache_control'),
-            '_url': json_obj.get('_url'),
+            '_etag': None,
+            '_mod': None,
+            '_cache_control': None,
+            '_url': None,
             '_add_pip': add_pip,
             '_pickle_version': REPODATA_PICKLE_VERSION,
             '_schannel': schannel,
         }
 
-        meta_in_common = {  # just need to make this once, then apply with .update()
-            'arch': json_obj.get('info', {}).get('arch'),
+        for parent_key, key, value in json_stream_items(fh, expand_keys=('packages',)):
+            if parent_key == 'packages':
+                package_name = value['name']
+                _package_data[package_name].append((key, value))
+                for ftr_name in package_track_features(value):
+                    _track_features_index[ftr_name].add(package_name)
+            elif key == 'info':
+                info = value or {}
+            elif key in ('_etag', '_mod', '_cache_control', '_url'):
+                _internal_state[key] = value
+
+        subdir = info.get('subdir') or self.channel.subdir
+        assert subdir == self.channel.subdir
+        _internal_state['_meta_in_common'] = {  # applied with .update() to each record
+            'arch': info.get('arch'),
             'channel': self.channel,
-            'platform': json_obj.get('info', {}).get('platform'),
+            'platform': info.get('platform'),
             'schannel': schannel,
             'subdir': subdir,
         }
 
-        channel_url = self.url_w_credentials
-        for fn, info in iteritems(json_obj.get('packages', {})):
-            info['fn'] = fn
-            info['url'] = join_url(channel_url, fn)
-            if add_pip and info['name'] == 'python' and info['version'].startswith(('2.', '3.')):
-                info['depends'].append('pip')
-            info.update(meta_in_common)
-            package_record = PackageRecord(**info)
+        self._set_internal_state(_internal_state)
+        return _internal_state
 
-            _package_records.append(package_record)
-            _names_index[package_record.name].append(package_record)
-            for ftr_name in package_record.track_features:
-                _track_features_index[ftr_name].append(package_record)
 
-        self._internal_state = _internal_state
-        return _internal_state
+class _ShardedPackageData(Mapping):
+    """Package data fetched one shard, holding the packages of a single name, at a time."""
+
+    def __init__(self, subdir_data, package_names, track_features_index):
+        self._subdir_data = subdir_data
+        self._package_names = frozenset(package_names)
+        self._track_features_index = track_features_index
+        self._shards = {}
+        self._lock = Lock()
+
+    def __getitem__(self, package_name):
+        if package_name not in self._package_names:
+            raise KeyError(package_name)
+        try:
+            return self._shards[package_name]
+        except KeyError:
+            pass
+        shard = self._subdir_data._read_shard_file(package_name + '.json') or {}
+        entries = list(iteritems(shard.get('packages') or {}))
+        with self._lock:
+            for _, info in entries:
+                for ftr_name in package_track_features(info):
+                    self._track_features_index.setdefault(ftr_name, set()).add(package_name)
+            return self._shards.setdefault(package_name, entries)
+
+    def __contains__(self, package_name):
+        return package_name in self._package_names
+
+    def __iter__(self):
+        return iter(self._package_names)
+
+    def __len__(self):
+        return len(self._package_names)
+
+
+class _MappedPackageData(Mapping):
+    """Package data read through a repodata index. Entries are decoded on access."""
+
+    def __init__(self, mapped_table):
+        self._mapped_table = mapped_table
+
+    def __getitem__(self, package_name):
+        return [(fn, json.loads(info)) for fn, info in self._mapped_table[package_name]]
+
+    def __contains__(self, package_name):
+        return package_name in self._mapped_table
+
+    def __iter__(self):
+        return iter(self._mapped_table)
+
+    def __len__(self):
+        return len(self._mapped_table)
+
+
+class _UpdatedMappedTable(Mapping):
+    """A mapped table with the entries of some keys replaced. Keys replaced with no entries
+    are left out."""
+
+    def __init__(self, mapped_table, updates):
+        self._mapped_table = mapped_table
+        self._updates = updates
+
+    def __getitem__(self, key):
+        if key in self._updates:
+            if not self._updates[key]:
+                raise KeyError(key)
+            return self._updates[key]
+        return self._mapped_table[key]
+
+    def __iter__(self):
+        for key in self._mapped_table:
+            if self._updates.get(key, True):
+                yield key
+        for key, entries in iteritems(self._updates):
+            if entries and key not in self._mapped_table:
+                yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
 
 
 def read_mod_and_etag(path):
@@ -372,6 +1000,86 @@ def read_mod_and_etag(path):
             raise
 
 
+def update_repodata_index_entries(packages, metadata, changed):
+    """Given the `packages` table and `metadata` of a repodata index, and the package entries
+    a repodata patch `changed`, as a mapping of filenames to (previous package name, patched
+    entry) pairs, returns the updated metadata, and the updated entries of each affected
+    package name.  Only the entries of the affected names are decoded.
+    """
+    affected_names = set(concat(
+        (previous_name, info and info['name']) for previous_name, info in itervalues(changed)
+    ))
+    affected_names.discard(None)
+
+    updated_packages = {}
+    for package_name in affected_names:
+        entries = []
+        for fn, info_json in packages.get(package_name, ()):
+            if fn not in changed:
+                entries.append((fn, info_json))
+            elif changed[fn][1] and changed[fn][1]['name'] == package_name:
+                entries.append((fn, json.dumps(changed[fn][1], separators=(',', ':'))))
+        entries.extend(
+            (fn, json.dumps(info, separators=(',', ':')))
+            for fn, (previous_name, info) in iteritems(changed)
+            if info and info['name'] == package_name and previous_name != package_name
+        )
+        updated_packages[package_name] = entries
+
+    track_features_index = defaultdict(set, (
+        (ftr_name, set(package_names) - affected_names)
+        for ftr_name, package_names in iteritems(metadata['_track_features_index'])
+    ))
+    for package_name, entries in iteritems(updated_packages):
+        for _, info_json in entries:
+            for ftr_name in package_track_features(json.loads(info_json)):
+                track_features_index[ftr_name].add(package_name)
+    metadata = dict(metadata, _track_features_index={
+        ftr_name: sorted(package_names)
+        for ftr_name, package_names in iteritems(track_features_index) if package_names
+    })
+    return metadata, updated_packages
+
+
+SECONDARY_INDEX_FIELDS = ('build', 'md5', 'version')
+
+
+def build_secondary_indexes(package_data, add_pip=False):
+    indexes = {field: defaultdict(set) for field in SECONDARY_INDEX_FIELDS + ('depends',)}
+    depends_index = indexes['depends']
+    for package_name, entries in iteritems(package_data):
+        for fn, info in entries:
+            for field in SECONDARY_INDEX_FIELDS:
+                value = info.get(field)
+                if value:
+                    indexes[field][value].add(package_name)
+            # the depends index is keyed by dependency name, and holds (name, fn) pairs
+            for dep in info.get('depends') or ():
+                dep_name = dep.split(' ', 1)[0]
+                if dep_name:
+                    depends_index[dep_name].add((package_name, fn))
+            if add_pip and package_name == 'python':
+                depends_index['pip'].add((package_name, fn))
+    return indexes
+
+
+def package_track_features(info):
+    track_features = info.get('track_features') or ()
+    if isinstance(track_features, string_types):
+        track_features = track_features.replace(' ', ',').split(',')
+    return tuple(ftr_name.strip() for ftr_name in track_features if ftr_name.strip())
+
+
+def get_repodata_max_age(mod_etag_headers):
+    # number of seconds cached repodata remains valid; see context.local_repodata_ttl
+    if context.local_repodata_ttl > 1:
+        return context.local_repodata_ttl
+    elif context.local_repodata_ttl == 1:
+        return get_cache_control_max_age(mod_etag_headers.get('_cache_control', ''))
+    else:
+        return 0
+
+
 def get_cache_control_max_age(cache_control_value):
     max_age = re.search(r"max-age=(\d+)", cache_control_value)
     return int(max_age.groups()[0]) if max_age else 0
@@ -381,10 +1089,39 @@ class Response304ContentUnchanged(Exception):
     pass
 
 
-def fetch_repodata_remote_request(url, etag, mod_stamp):
+def fetch_repodata_remote_request(url, etag, mod_stamp, out_fh=None, filenames=None,
+                                  unavailable=None):
+    """
+    Fetch repodata for the channel subdir at `url`, trying each of the compressed variants in
+    `context.repodata_compression_order` that the channel publishes, or else each of
+    `filenames`.  Variants in the `unavailable` set, if given, are skipped, and those the
+    channel turns out not to publish are added to it.
+
+    Returns the repodata as a string, with the _url, _etag, _mod, and _cache_control fields
+    added.  If `out_fh` is given, the repodata is instead decompressed and written to that
+    binary file handle as it is downloaded, and True is returned.  Returns None if the subdir
+    does not exist, and raises Response304ContentUnchanged if the cached repodata is current.
+    """
+    if out_fh is None:
+        out_fh = BytesIO()
+        if fetch_repodata_remote_request(url, etag, mod_stamp, out_fh, filenames,
+                                         unavailable) is None:
+            return None
+        return ensure_text_type(out_fh.getvalue())
+
     if not context.ssl_verify:
         warnings.simplefilter('ignore', InsecureRequestWarning)
 
+    filenames = filenames or repodata_filenames()
+    if unavailable:
+        # the last variant is always asked for, as the fallback
+        filenames = [fn for fn in filenames[:-1] if fn not in unavailable] + filenames[-1:]
+    with host_request_limit(url):
+        return _fetch_repodata_remote_request(url, etag, mod_stamp, out_fh, filenames,
+                                              unavailable)
+
+
+def _fetch_repodata_remote_request(url, etag, mod_stamp, out_fh, filenames, unavailable=None):
     session = CondaSession()
 
     headers = {}
@@ -393,21 +1130,26 @@ def fetch_repodata_remote_request(url, etag, mod_stamp):
     if mod_stamp:
         headers["If-Modified-Since"] = mod_stamp
 
-    if 'repo.anaconda.com' in url:
-        filename = 'repodata.json.bz2'
-        headers['Accept-Encoding'] = 'identity'
-    else:
-        headers['Accept-Encoding'] = 'gzip, deflate, compress, identity'
-        headers['Content-Type'] = 'application/json'
-        filename = 'repodata.json'
-
     try:
         timeout = context.remote_connect_timeout_secs, context.remote_read_timeout_secs
-        resp = session.get(join_url(url, filename), headers=headers, proxies=session.proxies,
-                           timeout=timeout)
-        if log.isEnabledFor(DEBUG):
-            log.debug(stringify(resp, content_max_len=256))
-        resp.raise_for_status()
+        for filename in filenames:
+            if filename.endswith('.json'):
+                headers['Accept-Encoding'] = 'gzip, deflate, compress, identity'
+                headers['Content-Type'] = 'application/json'
+            else:
+                headers['Accept-Encoding'] = 'identity'
+            resp = session.get(join_url(url, filename), headers=headers,
+                               proxies=session.proxies, timeout=timeout, stream=True)
+            if log.isEnabledFor(DEBUG):
+                log.debug(stringify(resp, content_max_len=0))
+            if resp.status_code in (403, 404) and filename != filenames[-1]:
+                # this compressed variant isn't published; fall back to the next one
+                resp.close()
+                if unavailable is not None:
+                    unavailable.add(filename)
+                continue
+            resp.raise_for_status()
+            break
 
     except InvalidSchema as e:
         if 'SOCKS' in text_type(e):
@@ -541,29 +1283,192 @@ def fetch_repodata_remote_request(url, etag, mod_stamp):
                              caused_by=e)
 
     if resp.status_code == 304:
+        resp.close()
         raise Response304ContentUnchanged()
 
-    def maybe_decompress(filename, resp_content):
-        return ensure_text_type(bz2.decompress(resp_content)
-                                if filename.endswith('.bz2')
-                                else resp_content).strip()
-
-    json_str = maybe_decompress(filename, resp.content)
-
     saved_fields = {'_url': url}
     add_http_value_to_dict(resp, 'Etag', saved_fields, '_etag')
     add_http_value_to_dict(resp, 'Last-Modified', saved_fields, '_mod')
     add_http_value_to_dict(resp, 'Cache-Control', saved_fields, '_cache_control')
 
-    # add extra values to the raw repodata json
-    if json_str and json_str != "{}":
-        raw_repodata_str = "%s, %s" % (
-            json.dumps(saved_fields)[:-1],  # remove trailing '}'
-            json_str[1:]  # remove first '{'
-        )
+    with closing(resp):
+        chunks = resp.iter_content(chunk_size=1 << 16)
+        decompressor = make_repodata_decompressor(filename)
+        if decompressor:
+            chunks = (decompressor.decompress(chunk) for chunk in chunks)
+        write_repodata_with_saved_fields(chunks, saved_fields, out_fh)
+        for _ in chunks:
+            pass  # whatever follows the end of the document still has to be decompressed
+        # a truncated stream decompresses without error, up to where it was cut off
+        if decompressor and not getattr(decompressor, 'eof', True):
+            message = dals("""
+            The download ended before the end of the compressed repodata.  The connection
+            may have been interrupted; a simple retry will usually get you on your way.
+            """)
+            raise CondaHTTPError(message, join_url(url, filename), resp.status_code,
+                                 'incomplete read', resp.elapsed, resp)
+    return True
+
+
+def repodata_filenames():
+    """The repodata variants to request, in order of preference, given the configured
+    context.repodata_compression_order and the decompressors available."""
+    filenames = []
+    for compression in context.repodata_compression_order:
+        if compression == 'zst' and zstandard is None:
+            log.debug("Skipping repodata.json.zst; the zstandard package is not installed.")
+            continue
+        filename = REPODATA_FILENAMES.get(compression)
+        if filename and filename not in filenames:
+            filenames.append(filename)
+    return filenames or ['repodata.json']
+
+
+def make_repodata_decompressor(filename):
+    """A decompressor object for the repodata variant `filename`, or None if it's not
+    compressed.  Its `eof` attribute, where the decompressor has one, tells whether the end of
+    the compressed stream was reached."""
+    if filename.endswith('.zst'):
+        return zstandard.ZstdDecompressor().decompressobj()
+    elif filename.endswith('.bz2'):
+        return bz2.BZ2Decompressor()
+    return None
+
+
+def write_repodata_with_saved_fields(chunks, saved_fields, out_fh):
+    """Write the repodata json document given as a sequence of byte `chunks` to `out_fh`,
+    with `saved_fields` merged into its top-level object.  The document is never decoded."""
+    saved_fields_json = ensure_binary(json.dumps(saved_fields))
+    head = b''
+    chunks = iter(chunks)
+    for chunk in chunks:
+        head += chunk
+        # read up to the first character following the document's opening brace
+        body = head.lstrip()
+        if body and not body.startswith(b'{'):
+            raise ValueError("Expecting a json object, found %r" % body[:32])
+        body = body[1:].lstrip()
+        if body:
+            break
     else:
-        raw_repodata_str = json.dumps(saved_fields)
-    return raw_repodata_str
+        # the document is empty, or an empty object
+        out_fh.write(saved_fields_json)
+        return
+
+    if body.startswith(b'}'):
+        out_fh.write(saved_fields_json)
+        return
+    out_fh.write(saved_fields_json[:-1])  # remove trailing '}'
+    out_fh.write(b', ')
+    out_fh.write(body)
+    for chunk in chunks:
+        out_fh.write(chunk)
+
+
+def group_repodata_patch_operations(patch_chain):
+    """Group the operations of the patches in `patch_chain`, in order, by the repodata entry
+    they change.  A package entry is keyed by ('packages', filename), and any other top-level
+    entry by (None, key).  Entries are patched independently of each other, so each can be
+    patched on its own, as it's read.  Raises JsonPatchError for an operation that isn't
+    confined to a single entry.
+    """
+    operations = odict()
+    for patch in patch_chain:
+        for operation in patch['patch']:
+            entry_keys = set()
+            for field in ('path', 'from'):
+                if field not in operation:
+                    continue
+                parts = split_json_pointer(operation[field])
+                if parts[:1] == ['packages']:
+                    entry_keys.add(('packages', parts[1]) if len(parts) > 1 else None)
+                else:
+                    entry_keys.add((None, parts[0]) if parts else None)
+            if len(entry_keys) != 1 or None in entry_keys:
+                raise JsonPatchError("Repodata patch operation %r changes more than one entry"
+                                     % (operation,))
+            operations.setdefault(entry_keys.pop(), []).append(operation)
+    return operations
+
+
+def iter_patched_repodata(fh, operations, changed):
+    """Yield the repodata json document read from `fh` as chunks of bytes, with the patch
+    `operations` grouped by group_repodata_patch_operations() applied, and without the saved
+    fields of a cache file.  The document is decoded one entry at a time.  Each entry the
+    operations change is recorded in the `changed` dict; see _patch_cached_repodata().
+    """
+    operations = odict(operations)
+    top_level = odict()
+
+    def patch_entry(entry_key, entry):
+        parent_key, key = entry_key
+        document = {parent_key: entry} if parent_key else entry
+        apply_json_patch(document, operations.pop(entry_key))
+        return entry
+
+    yield b'{"packages": {'
+    separator = b''
+    for parent_key, key, value in json_stream_items(fh, expand_keys=('packages',)):
+        if parent_key == 'packages':
+            if ('packages', key) in operations:
+                entry = patch_entry(('packages', key), {key: value})
+                changed['packages', key] = value['name'], entry.get(key)
+                if key not in entry:
+                    continue
+                value = entry[key]
+            yield separator + ensure_binary('%s: %s' % (json.dumps(key), json.dumps(value)))
+            separator = b', '
+        elif key not in ('_url', '_etag', '_mod', '_cache_control'):
+            top_level[key] = value
+
+    for parent_key, key in tuple(operations):
+        if parent_key == 'packages':
+            entry = patch_entry(('packages', key), {})
+            if key in entry:
+                changed['packages', key] = None, entry[key]
+                yield separator + ensure_binary('%s: %s' % (json.dumps(key),
+                                                            json.dumps(entry[key])))
+                separator = b', '
+    yield b'}'
+
+    for entry_key in tuple(operations):
+        top_level = patch_entry(entry_key, top_level)
+        changed[entry_key] = None, top_level.get(entry_key[1])
+    for key, value in iteritems(top_level):
+        yield ensure_binary(', %s: %s' % (json.dumps(key), json.dumps(value)))
+    yield b'}'
+
+
+def fetch_repodata_patches(url, unavailable=None):
+    """
+    Returns a (patch_document, saved_fields) tuple for the repodata.patch.json file published
+    at `url`, or None if the channel publishes no patches or they could not be fetched.  In the
+    first case, REPODATA_PATCH_FILENAME is also added to the `unavailable` set, if given.
+    """
+    if not context.ssl_verify:
+        warnings.simplefilter('ignore', InsecureRequestWarning)
+
+    session = CondaSession()
+    headers = {'Accept-Encoding': 'gzip, deflate, compress, identity'}
+    try:
+        timeout = context.remote_connect_timeout_secs, context.remote_read_timeout_secs
+        with host_request_limit(url):
+            resp = session.get(join_url(url, REPODATA_PATCH_FILENAME), headers=headers,
+                               proxies=session.proxies, timeout=timeout)
+        if log.isEnabledFor(DEBUG):
+            log.debug(stringify(resp, content_max_len=256))
+        resp.raise_for_status()
+        patch_document = json.loads(ensure_text_type(resp.content))
+    except (ConnectionError, HTTPError, InvalidSchema, SSLError, ValueError) as e:
+        log.debug("No repodata patches available for %s: %r", url, e)
+        response = getattr(e, 'response', None)
+        if unavailable is not None and getattr(response, 'status_code', None) in (403, 404):
+            unavailable.add(REPODATA_PATCH_FILENAME)
+        return None
+
+    saved_fields = {'_url': url}
+    add_http_value_to_dict(resp, 'Cache-Control', saved_fields, '_cache_control')
+    return patch_document, saved_fields
 
 
 def make_feature_record(feature_name):
@@ -613,6 +613,17 @@ Use "conda search <package> --info" to see the dependencies for each package.'''
         super(UnsatisfiableError, self).__init__(msg)
 
 
+class SolverBudgetExhaustedError(CondaError):
+    def __init__(self, propagation_limit):
+        message = dals("""
+        The solver ran out of its budget before it could find any solution.
+          solver_propagation_limit: %(propagation_limit)s
+        Raise solver_propagation_limit, or set it to 0 to remove the limit.
+        """)
+        super(SolverBudgetExhaustedError, self).__init__(message,
+                                                         propagation_limit=propagation_limit)
+
+
 class InstallError(CondaError):
     def __init__(self, message):
         msg = '%s' % message
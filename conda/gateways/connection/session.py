@@ -3,8 +3,9 @@
 # SPDX-License-Identifier: BSD-3-Clause
 from __future__ import absolute_import, division, print_function, unicode_literals
 
+from contextlib import contextmanager
 from logging import getLogger
-from threading import local
+from threading import BoundedSemaphore, Lock, local
 
 from . import (AuthBase, BaseAdapter, HTTPAdapter, Session, _basic_auth_str,
                extract_cookies_to_jar, get_auth_from_url, get_netrc_auth)
@@ -23,6 +24,46 @@ from ...exceptions import ProxyError
 log = getLogger(__name__)
 RETRIES = 3
 
+_shared_lock = Lock()
+_http_adapters = {}
+_host_semaphores = {}
+
+
+def get_http_adapter():
+    """
+    Sessions are created per thread, but they all share one HTTPAdapter, and so one urllib3
+    pool manager.  Connections opened by one thread can then be reused by any other.
+    """
+    key = context.remote_max_retries, context.remote_max_connections
+    with _shared_lock:
+        http_adapter = _http_adapters.get(key)
+        if http_adapter is None:
+            http_adapter = _http_adapters[key] = HTTPAdapter(
+                max_retries=context.remote_max_retries,
+                pool_connections=context.remote_max_connections,
+                pool_maxsize=context.remote_max_connections,
+            )
+        return http_adapter
+
+
+@contextmanager
+def host_request_limit(url):
+    """
+    Blocks while `context.remote_max_connections_per_host` requests are already in progress
+    to the host of `url`.  Non-network urls are never limited.
+    """
+    parsed = urlparse(url)
+    if parsed.scheme not in ('http', 'https') or not parsed.host:
+        yield
+        return
+    key = parsed.host, parsed.port, max(1, context.remote_max_connections_per_host)
+    with _shared_lock:
+        semaphore = _host_semaphores.get(key)
+        if semaphore is None:
+            semaphore = _host_semaphores[key] = BoundedSemaphore(key[2])
+    with semaphore:
+        yield
+
 
 class EnforceUnusedAdapter(BaseAdapter):
 
@@ -75,8 +116,8 @@ class CondaSession(Session):
             self.mount("s3://", unused_adapter)
 
         else:
-            # Configure retries
-            http_adapter = HTTPAdapter(max_retries=context.remote_max_retries)
+            # Configure retries and connection pooling
+            http_adapter = get_http_adapter()
             self.mount("http://", http_adapter)
             self.mount("https://", http_adapter)
             self.mount("ftp://", FTPAdapter())
@@ -14,15 +14,23 @@ We don't raise an error if the lock is named with the current PID
 """
 from __future__ import absolute_import, division, print_function, unicode_literals
 
+from contextlib import contextmanager
+from errno import EACCES, EAGAIN, EDEADLK, EWOULDBLOCK
 from glob import glob
 import logging
 import os
 from os.path import abspath, basename, dirname, isdir, join
 import time
 
-from .common.compat import range
+from .common.compat import on_win, range
 from .exceptions import LockError
 
+if on_win:  # pragma: unix no cover
+    import msvcrt
+    fcntl = None
+else:  # pragma: win no cover
+    import fcntl
+
 LOCK_EXTENSION = 'conda_lock'
 
 # Keep the string "LOCKERROR" in this string so that external
@@ -125,4 +133,77 @@ class DirectoryLock(FileLock):  # lgtm [py/missing-call-to-init]
                 log.warn("Failed to create directory %s [errno %d]", self.directory_path, e.errno)
 
 
+class ReadWriteLock(object):
+    """An advisory reader/writer lock shared between processes, held on `lock_file_path`.
+
+    Any number of processes may hold the lock for reading at once, while a writer holds it
+    exclusively.  On Windows, where only exclusive file locks are available, readers also
+    exclude one another.  The lock file itself is left in place.  If it can't be created,
+    a warning is logged and the lock is not held.
+
+    :param lock_file_path: the path of the lock file, created if it doesn't exist
+    :param timeout: max number of seconds to wait for the lock before raising LockError
+    """
+    def __init__(self, lock_file_path, timeout=600):
+        self.lock_file_path = abspath(lock_file_path)
+        self.timeout = timeout
+        assert isdir(dirname(self.lock_file_path)), "{0} doesn't exist".format(
+            dirname(self.lock_file_path))
+
+    @contextmanager
+    def read(self):
+        with self._locked(shared=True):
+            yield self
+
+    @contextmanager
+    def write(self):
+        with self._locked(shared=False):
+            yield self
+
+    @contextmanager
+    def _locked(self, shared):
+        try:
+            fd = os.open(self.lock_file_path, os.O_RDWR | os.O_CREAT, 0o666)
+        except (OSError, IOError) as e:
+            log.warn("Failed to create lock, do not run conda in parallel processes [errno %d]",
+                     e.errno)
+            yield
+            return
+        try:
+            self._acquire(fd, shared)
+            try:
+                yield
+            finally:
+                self._release(fd)
+        finally:
+            os.close(fd)
+
+    def _acquire(self, fd, shared):
+        deadline = time.time() + self.timeout
+        sleep_time = 0.01
+        while True:
+            try:
+                if fcntl:
+                    fcntl.flock(fd, (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) | fcntl.LOCK_NB)
+                else:  # pragma: unix no cover
+                    msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+                return
+            except (IOError, OSError) as e:
+                if e.errno not in (EACCES, EAGAIN, EDEADLK, EWOULDBLOCK):
+                    raise
+            if time.time() >= deadline:
+                raise LockError(LOCKSTR.format(self.lock_file_path))
+            log.debug("Waiting for lock %s", self.lock_file_path)
+            time.sleep(sleep_time)
+            sleep_time = min(sleep_time * 2, 1)
+
+    @staticmethod
+    def _release(fd):
+        if fcntl:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        else:  # pragma: unix no cover
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+
 Locked = DirectoryLock
@@ -17,6 +17,7 @@ from .._vendor.auxlib.collection import frozendict
 from ..base.constants import CONDA_TARBALL_EXTENSION
 from ..common.compat import (isiterable, iteritems, itervalues, string_types, text_type,
                              with_metaclass)
+from ..common.lru import LRUCache
 from ..common.path import expand
 from ..common.url import is_url, path_to_url, unquote
 from ..exceptions import CondaValueError
@@ -27,6 +28,12 @@ except ImportError:  # pragma: no cover
     from .._vendor.toolz.itertoolz import concat, concatv, groupby  # NOQA
 
 
+# MatchSpecs parsed from strings, keyed by the string; dependency strings recur across
+# thousands of records in an index.  Channel names resolve against the context, so
+# reset_context() clears it.
+spec_cache = LRUCache(32768)
+
+
 class MatchSpecType(type):
 
     def __call__(cls, spec_arg=None, **kwargs):
@@ -40,6 +47,14 @@ class MatchSpecType(type):
                 new_kwargs.update(**kwargs)
                 return super(MatchSpecType, cls).__call__(**new_kwargs)
             elif isinstance(spec_arg, string_types):
+                if not kwargs and CONDA_TARBALL_EXTENSION not in spec_arg:
+                    # MatchSpecs are immutable, so every parse of the same string can share
+                    # one instance.  Tarball paths aren't cached; they resolve against the cwd.
+                    spec = spec_cache.get(spec_arg)
+                    if spec is None:
+                        spec = super(MatchSpecType, cls).__call__(**_parse_spec_str(spec_arg))
+                        spec_cache[spec_arg] = spec
+                    return spec
                 parsed = _parse_spec_str(spec_arg)
                 parsed.update(kwargs)
                 return super(MatchSpecType, cls).__call__(**parsed)
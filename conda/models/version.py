@@ -6,7 +6,8 @@ from logging import getLogger
 import operator as op
 import re
 
-from ..common.compat import string_types, zip, zip_longest, text_type
+from ..common.compat import string_types, zip_longest, text_type
+from ..common.lru import LRUCache
 from ..exceptions import CondaValueError, InvalidVersionSpecError
 
 try:
@@ -29,7 +30,48 @@ def ver_eval(vtest, spec):
 
 version_check_re = re.compile(r'^[\*\.\+!_0-9a-z]+$')
 version_split_re = re.compile('([0-9]+|[*]+|[^0-9*]+)')
-version_cache = {}
+version_cache = LRUCache(65536)
+version_spec_cache = LRUCache(16384)
+
+
+def _padded_key(items):
+    # A tuple that orders natively like the sequence of `items` when the shorter of two
+    # sequences is padded with a zero value.  `items` are (sign, value) pairs, with a
+    # negative sign for values ordered below the padding value, 0 for the padding value
+    # itself, and a positive sign for values above it.  Runs of padding values are folded
+    # into the value that follows them, and the key ends in a terminator that sorts above
+    # every value below padding and below every value above it.
+    key = []
+    run = 0
+    for sign, value in items:
+        if sign == 0:
+            run += 1
+        elif sign < 0:
+            key.append((0, run, value))
+            run = 0
+        else:
+            key.append((1, -run, value))
+            run = 0
+    key.append((1,))
+    return tuple(key)
+
+
+def _subcomponent_item(c):
+    if isinstance(c, string_types):
+        return -1, c
+    return (1 if c else 0), c
+
+
+def _version_part_key(components):
+    items = []
+    for component in components:
+        component_key = _padded_key(_subcomponent_item(c) for c in component)
+        if len(component_key) == 1:
+            # only the terminator; the component is all zeros
+            items.append((0, component_key))
+        else:
+            items.append((-1 if component_key[0][0] == 0 else 1, component_key))
+    return _padded_key(items)
 
 
 class VersionOrder(object):
@@ -100,6 +142,9 @@ class VersionOrder(object):
     * if a subcomponent has no correspondent, the missing correspondent is
       treated as integer 0 to ensure '1.1' == '1.1.0'.
 
+    For speed, the lists are encoded once into nested tuples that obey the same rules
+    under native tuple comparison, and all comparisons are made on those.
+
     The resulting order is:
 
            0.4
@@ -142,6 +187,8 @@ class VersionOrder(object):
       1.0.1a  =>  1.0.1post.a      # ensure correct ordering for openssl
     """
 
+    __slots__ = ('norm_version', 'fillvalue', 'version', 'local', '_key')
+
     def __new__(cls, vstr):
         if isinstance(vstr, cls):
             return vstr
@@ -170,7 +217,7 @@ class VersionOrder(object):
 
         # when fillvalue ==  0  =>  1.1 == 1.1.0
         # when fillvalue == -1  =>  1.1  < 1.1.0
-        self = version_cache[vstr] = version_cache[version] = object.__new__(cls)
+        self = object.__new__(cls)
         self.norm_version = version
         self.fillvalue = 0
 
@@ -225,6 +272,8 @@ class VersionOrder(object):
                     # strings in phase => prepend fillvalue
                     v[k] = [self.fillvalue] + c
 
+        self._key = (_version_part_key(self.version), _version_part_key(self.local))
+        version_cache[vstr] = version_cache[self.norm_version] = self
         return self
 
     def __str__(self):
@@ -238,8 +287,10 @@ class VersionOrder(object):
         return True
 
     def __eq__(self, other):
-        return (self._eq(self.version, other.version) and
-                self._eq(self.local, other.local))
+        return self._key == other._key
+
+    def __hash__(self):
+        return hash(self._key)
 
     def startswith(self, other):
         # Tests if the version lists match up to the last element in "other".
@@ -269,22 +320,7 @@ class VersionOrder(object):
         return not (self == other)
 
     def __lt__(self, other):
-        for t1, t2 in zip([self.version, self.local], [other.version, other.local]):
-            for v1, v2 in zip_longest(t1, t2, fillvalue=[]):
-                for c1, c2 in zip_longest(v1, v2, fillvalue=self.fillvalue):
-                    if c1 == c2:
-                        continue
-                    elif isinstance(c1, string_types):
-                        if not isinstance(c2, string_types):
-                            # str < int
-                            return True
-                    elif isinstance(c2, string_types):
-                            # not (int < str)
-                            return False
-                    # c1 and c2 have the same type
-                    return c1 < c2
-        # self == other
-        return False
+        return self._key < other._key
 
     def __gt__(self, other):
         return other < self
@@ -401,6 +437,64 @@ opdict = {'==': op.__eq__, '!=': op.__ne__, '<=': op.__le__,
           '>=': op.__ge__, '<': op.__lt__, '>': op.__gt__}
 
 
+def _intersect_intervals(intervals1, intervals2):
+    # intervals are (lower, lower_inclusive, upper, upper_inclusive), with None for an
+    # unbounded side
+    result = []
+    for lo1, lo1_incl, hi1, hi1_incl in intervals1:
+        for lo2, lo2_incl, hi2, hi2_incl in intervals2:
+            if lo1 is None or lo2 is not None and (lo2 > lo1 or lo2 == lo1 and not lo2_incl):
+                lo, lo_incl = lo2, lo2_incl
+            else:
+                lo, lo_incl = lo1, lo1_incl
+            if hi1 is None or hi2 is not None and (hi2 < hi1 or hi2 == hi1 and not hi2_incl):
+                hi, hi_incl = hi2, hi2_incl
+            else:
+                hi, hi_incl = hi1, hi1_incl
+            if lo is not None and hi is not None and (lo > hi or lo == hi
+                                                      and not (lo_incl and hi_incl)):
+                continue
+            result.append((lo, lo_incl, hi, hi_incl))
+    return _union_intervals(result)
+
+
+def _union_intervals(intervals):
+    # sorted, with overlapping and adjacent intervals merged
+    def lower_key(interval):
+        lo, lo_incl = interval[:2]
+        return (0,) if lo is None else (1, lo, not lo_incl)
+
+    merged = []
+    for interval in sorted(intervals, key=lower_key):
+        if merged:
+            prev_lo, prev_lo_incl, prev_hi, prev_hi_incl = merged[-1]
+            lo, lo_incl, hi, hi_incl = interval
+            if (prev_hi is None or lo is None or lo < prev_hi
+                    or lo == prev_hi and (lo_incl or prev_hi_incl)):
+                if prev_hi is not None and (hi is None or hi > prev_hi
+                                            or hi == prev_hi and hi_incl):
+                    merged[-1] = prev_lo, prev_lo_incl, hi, hi_incl
+                continue
+        merged.append(interval)
+    return tuple(merged)
+
+
+def _relation_intervals(operator, version):
+    if operator is op.__eq__:
+        return (version, True, version, True),
+    elif operator is op.__ge__:
+        return (version, True, None, False),
+    elif operator is op.__gt__:
+        return (version, False, None, False),
+    elif operator is op.__le__:
+        return (None, False, version, True),
+    elif operator is op.__lt__:
+        return (None, False, version, False),
+    elif operator is op.__ne__:
+        return (None, False, version, False), (version, False, None, False)
+    return None
+
+
 class VersionSpec(object):
     def exact_match_(self, vspec):
         return self.spec == vspec
@@ -420,18 +514,49 @@ class VersionSpec(object):
     def triv_match_(self, vspec):
         return True
 
+    def interval_match_(self, vspec):
+        vo = VersionOrder(vspec)
+        for lo, lo_incl, hi, hi_incl in self._intervals:
+            if lo is not None and (vo < lo if lo_incl else vo <= lo):
+                continue
+            if hi is not None and (vo > hi if hi_incl else vo >= hi):
+                continue
+            return True
+        return False
+
     def __new__(cls, spec):
         if isinstance(spec, cls):
             return spec
+        if isinstance(spec, string_types):
+            self = version_spec_cache.get(spec)
+            if self is None:
+                self = version_spec_cache[spec] = cls._from_spec(spec)
+            return self
+        return cls._from_spec(spec)
+
+    @classmethod
+    def _from_spec(cls, spec):
         if isinstance(spec, string_types) and regex_split_re.match(spec):
             spec = treeify(spec)
 
         self = object.__new__(cls)
+        self._intervals = None
         if isinstance(spec, tuple):
             self.tup = tup = tuple(VersionSpec(s) for s in spec[1:])
             self.match = self.any_match_ if spec[0] == '|' else self.all_match_
             self.spec = untreeify((spec[0],) + tuple(t.spec for t in tup))
             self.depth = 2
+            if all(t._intervals is not None for t in tup):
+                # Fold the whole expression into one set of version ranges, so that
+                # matching is a handful of comparisons rather than a walk of the tree.
+                intervals = tup[0]._intervals
+                for t in tup[1:]:
+                    if spec[0] == '|':
+                        intervals = _union_intervals(intervals + t._intervals)
+                    else:
+                        intervals = _intersect_intervals(intervals, t._intervals)
+                self._intervals = intervals
+                self.match = self.interval_match_
             return self
 
         self.depth = 0
@@ -449,8 +574,10 @@ class VersionSpec(object):
             self.op = opdict[op]
             self.cmp = VersionOrder(b)
             self.match = self.veval_match_
+            self._intervals = _relation_intervals(self.op, self.cmp)
         elif spec == '*':
             self.match = self.triv_match_
+            self._intervals = (None, False, None, False),
         elif '*' in spec.rstrip('*'):
             self.spec = spec
             rx = spec.replace('.', r'\.')
@@ -469,6 +596,7 @@ class VersionSpec(object):
             self.op = opdict["=="]
             self.cmp = VersionOrder(spec)
             self.match = self.veval_match_
+            self._intervals = _relation_intervals(self.op, self.cmp)
         else:
             self.match = self.exact_match_
         return self
@@ -477,6 +605,15 @@ class VersionSpec(object):
         return (self.match == self.exact_match_
                 or self.match == self.veval_match_ and self.op == op.__eq__)
 
+    def as_intervals(self):
+        """The versions matched by this spec, as a sorted tuple of disjoint ranges.
+
+        Each range is a (lower, lower_inclusive, upper, upper_inclusive) tuple of
+        VersionOrder bounds, with None for an unbounded side.  Returns None if the spec
+        can't be expressed as ranges, e.g. for regexes and '1.2.*' prefix matches.
+        """
+        return self._intervals
+
     def __eq__(self, other):
         try:
             other = VersionSpec(other)
@@ -3,17 +3,21 @@
 # SPDX-License-Identifier: BSD-3-Clause
 from __future__ import absolute_import, division, print_function, unicode_literals
 
+from bisect import bisect_left, bisect_right
 from collections import defaultdict
 from itertools import chain
 from logging import DEBUG, getLogger
+from time import time
 
 from .base.constants import MAX_CHANNEL_PRIORITY
 from .base.context import context
 from .common.compat import iteritems, iterkeys, itervalues, odict, on_win, text_type
 from .common.io import time_recorder
-from .common.logic import Clauses, minimal_unsatisfiable_subset
+from .common.logic import (Clauses, SAT_SOLVERS, minimal_unsatisfiable_subset,
+                           parallel_minimal_unsatisfiable_subset)
 from .common.toposort import toposort
-from .exceptions import ResolvePackageNotFound, UnsatisfiableError
+from .exceptions import (CondaDependencyError, ResolvePackageNotFound,
+                         SolverBudgetExhaustedError, UnsatisfiableError)
 from .models.channel import Channel, MultiChannel
 from .models.enums import NoarchType
 from .models.match_spec import MatchSpec
@@ -37,6 +41,11 @@ def dashlist(iterable, indent=2):
     return ''.join('\n' + ' ' * indent + '- ' + str(x) for x in iterable)
 
 
+def _bitset_select(bitset, items):
+    # The items whose bit is set in an int bitset; bit i stands for items[i].
+    return [item for i, item in enumerate(items) if bitset >> i & 1]
+
+
 class Resolve(object):
 
     def __init__(self, index, sort=False, processed=False, channels=()):
@@ -56,8 +65,13 @@ class Resolve(object):
         self.groups = groups  # Dict[package_name, List[PackageRecord]]
         self.trackers = trackers  # Dict[track_feature, List[PackageRecord]]
         self.find_matches_ = {}  # Dict[MatchSpec, List[PackageRecord]]
+        self._match_bitsets = {}  # Dict[MatchSpec, int]; see _match_bitset()
+        self._version_sorted_groups = {}  # Dict[package_name, (List[VersionOrder], List[int])]
         self.ms_depends_ = {}  # Dict[PackageRecord, List[MatchSpec]]
+        self._version_ranks = {}  # Dict[package_name, Dict[version, int]]; see _version_rank()
         self._reduced_index_cache = {}
+        self.suboptimal = False  # set by solve() when it ran out of its budget
+        self.profile = None  # a list; if set, solve() appends a report of each solve to it
 
         if sort:
             for name, group in iteritems(groups):
@@ -271,11 +285,14 @@ class Resolve(object):
 
             # Prune packages that don't match any of the patterns
             # or which have unsatisfiable dependencies
+            match_bits = 0
+            for ms in matches:
+                match_bits |= self._match_bitset(ms)
             nold = nnew = 0
-            for fkey in group:
+            for i, fkey in enumerate(group):
                 if filter.setdefault(fkey, True):
                     nold += 1
-                    sat = (self.match_any(matches, fkey) and
+                    sat = (bool(match_bits >> i & 1) and
                            all(any(filter.get(f2, True) for f2 in self.find_matches(ms))
                                for ms in self.ms_depends(fkey)))
                     filter[fkey] = sat
@@ -371,7 +388,10 @@ class Resolve(object):
         res = self.find_matches_.get(ms, None)
         if res is None:
             if ms.get_exact_value('name'):
-                res = self.groups.get(ms.name, [])
+                group = self.groups.get(ms.name, [])
+                res = _bitset_select(self._match_bitset(ms), group)
+                self.find_matches_[ms] = res
+                return res
             elif ms.get_exact_value('track_features'):
                 feature_names = ms.get_exact_value('track_features')
                 res = list(chain.from_iterable(self.trackers[feature_name]
@@ -383,6 +403,50 @@ class Resolve(object):
             self.find_matches_[ms] = res
         return res
 
+    def _match_bitset(self, ms):
+        # type: (MatchSpec) -> int
+        """The records of self.groups[ms.name] that match ms, as a bitset.
+
+        Bit i is set when self.groups[ms.name][i] matches.  Each spec is matched against its
+        group only once per Resolve; unions and intersections of specs on the same name are
+        then just bitwise operations.
+        """
+        bits = self._match_bitsets.get(ms)
+        if bits is None:
+            candidates = self._version_candidates(ms)
+            bits = 0
+            for i, prec in enumerate(self.groups.get(ms.name, ())):
+                if (candidates is None or i in candidates) and self.match(ms, prec):
+                    bits |= 1 << i
+            self._match_bitsets[ms] = bits
+        return bits
+
+    def _version_candidates(self, ms):
+        # type: (MatchSpec) -> Optional[Set[int]]
+        """The positions in self.groups[ms.name] of records whose version is within the ranges
+        of ms's version spec, found by bisecting the group sorted by version.  Returns None if
+        the spec has no version ranges, and every record must be tested.
+        """
+        vspec = ms.version
+        intervals = vspec.as_intervals() if hasattr(vspec, 'as_intervals') else None
+        if intervals is None:
+            return None
+        name = ms.name
+        sorted_group = self._version_sorted_groups.get(name)
+        if sorted_group is None:
+            group = self.groups.get(name, ())
+            order = sorted(range(len(group)), key=lambda i: VersionOrder(group[i].version))
+            versions = [VersionOrder(group[i].version) for i in order]
+            sorted_group = self._version_sorted_groups[name] = versions, order
+        versions, order = sorted_group
+        candidates = set()
+        for lo, lo_incl, hi, hi_incl in intervals:
+            start = 0 if lo is None else (bisect_left if lo_incl else bisect_right)(versions, lo)
+            stop = (len(versions) if hi is None
+                    else (bisect_right if hi_incl else bisect_left)(versions, hi))
+            candidates.update(order[start:stop])
+        return candidates
+
     def ms_depends(self, prec):
         # type: (PackageRecord) -> List[MatchSpec]
         deps = self.ms_depends_.get(prec)
@@ -396,7 +460,7 @@ class Resolve(object):
         channel = prec.channel
         channel_priority = self._channel_priorities_map.get(channel.name, 1)  # TODO: ask @mcg1969 why the default value is 1 here  # NOQA
         valid = 1 if channel_priority < MAX_CHANNEL_PRIORITY else 0
-        version_comparator = VersionOrder(prec.get('version', ''))
+        version_comparator = self._version_rank(prec)
         build_number = prec.get('build_number', 0)
         build_string = prec.get('build')
         ts = prec.get('timestamp', 0)
@@ -405,6 +469,33 @@ class Resolve(object):
         else:
             return valid, version_comparator, -channel_priority, build_number, ts, build_string
 
+    def _version_rank(self, prec):
+        # type: (PackageRecord) -> int
+        """A dense integer rank of prec's version among the versions of its package name.
+
+        Ranks order like VersionOrder, and equal VersionOrders share a rank, but ranks are
+        computed once per name, so sorting and version metrics compare plain ints.  Ranks of
+        different package names aren't comparable.
+        """
+        name = prec.name
+        version = prec.get('version', '')
+        ranks = self._version_ranks.get(name)
+        if ranks is None or version not in ranks:
+            versions = set(p.get('version', '') for p in self.groups.get(name, ()))
+            versions.add(version)
+            if ranks:
+                versions.update(ranks)
+            ranks = {}
+            rank = -1
+            prev = None
+            for vo, v in sorted((VersionOrder(v), v) for v in versions):
+                if prev is None or vo != prev:
+                    rank += 1
+                    prev = vo
+                ranks[v] = rank
+            self._version_ranks[name] = ranks
+        return ranks[version]
+
     @staticmethod
     def _make_channel_priorities(channels):
         priorities_map = odict()
@@ -464,7 +555,10 @@ class Resolve(object):
             tgroup = libs = self.index.keys()
             simple = False
         if not simple:
-            libs = [fkey for fkey in tgroup if self.match(spec, fkey)]
+            if nm:
+                libs = _bitset_select(self._match_bitset(spec), tgroup)
+            else:
+                libs = [fkey for fkey in tgroup if self.match(spec, fkey)]
         if len(libs) == len(tgroup):
             if spec.optional:
                 m = True
@@ -480,8 +574,17 @@ class Resolve(object):
         C.name_var(m, sat_name)
         return sat_name
 
+    @staticmethod
+    def _get_sat_solver_cls():
+        sat_solver_cls = SAT_SOLVERS[text_type(context.sat_solver)]
+        if sat_solver_cls.module is None:
+            raise CondaDependencyError("The '%s' sat_solver requires the %s package. Install it, "
+                                       "or set sat_solver to 'pycosat'."
+                                       % (sat_solver_cls.name, sat_solver_cls.package_name))
+        return sat_solver_cls
+
     def gen_clauses(self):
-        C = Clauses()
+        C = Clauses(sat_solver=self._get_sat_solver_cls())
         for name, group in iteritems(self.groups):
             group = [self.to_sat_name(prec) for prec in group]
             # Create one variable for each package
@@ -672,9 +775,16 @@ class Resolve(object):
         if solution:
             return ()
         else:
-            specs = minimal_unsatisfiable_subset(specs, sat=mysat)
+            specs = r2._minimal_unsatisfiable_specs(C, specs, mysat)
             return specs
 
+    def _minimal_unsatisfiable_specs(self, C, specs, sat):
+        processes = context.conflict_search_processes
+        if processes > 1 and len(specs) > 1:
+            item_clauses = [(clause,) for clause in self.generate_spec_constraints(C, specs)]
+            return parallel_minimal_unsatisfiable_subset(specs, item_clauses, C, processes)
+        return minimal_unsatisfiable_subset(specs, sat=sat)
+
     def bad_installed(self, installed, new_specs):
         log.debug('Checking if the current environment is consistent')
         if not installed:
@@ -798,24 +908,179 @@ class Resolve(object):
             log.debug('Solving for: %s', dashlist(sorted(text_type(s) for s in specs)))
 
         # Find the compliant packages
-        len0 = len(specs)
         specs = tuple(map(MatchSpec, specs))
+        start = time()
         reduced_index = self.get_reduced_index(specs)
+        profile = None
+        if self.profile is not None:
+            counts = defaultdict(int)
+            for prec in itervalues(reduced_index or {}):
+                counts[prec.name] += 1
+            profile = {
+                'specs': sorted(text_type(s) for s in specs),
+                'get_reduced_index_seconds': time() - start,
+                'reduced_index': dict(counts),
+                'components': [],
+            }
+            self.profile.append(profile)
         if not reduced_index:
             return False if reduced_index is None else ([[]] if returnall else [])
 
+        # Packages that share no dependencies, directly or through features, can't constrain
+        # one another, so each independent component of the index gets its own, much smaller,
+        # clause set.  The components are minimized together, stage by stage, for the same
+        # result as a single clause set; see _minimize_stages().
+        subproblems = self._split_index(specs, reduced_index)
+        if len(subproblems) > 1:
+            log.debug('Solving %d independent components separately', len(subproblems))
+        time_budget = context.solver_time_budget_secs
+        deadline = time() + time_budget if time_budget else None
+        subproblems = [_Subproblem(self, sub_specs, sub_index, _remove, deadline,
+                                   profile and profile['components'])
+                       for sub_specs, sub_index in subproblems]
+        _minimize_stages(subproblems)
+        # the alternate solutions of the whole problem are those of its components, combined
+        psolutions = [[]]
+        for subproblem in subproblems:
+            psolutions = [psol + sub_psol for psol in psolutions
+                          for sub_psol in subproblem.alternate_solutions()][:11]
+        self.suboptimal = any(subproblem.suboptimal for subproblem in subproblems)
+        if profile is not None:
+            profile['seconds'] = time() - start
+            profile['suboptimal'] = self.suboptimal
+        if self.suboptimal:
+            log.warning('The solver ran out of its budget (solver_time_budget_secs: %s, '
+                        'solver_propagation_limit: %s); the solution found may not be the '
+                        'best one.', time_budget, context.solver_propagation_limit)
+
+        nsol = len(psolutions)
+        if nsol > 1:
+            psols2 = [set(self.to_sat_name(prec) for prec in psol) for psol in psolutions[:10]]
+            common = set.intersection(*psols2)
+            diffs = [sorted(set(sol) - common) for sol in psols2]
+            if not context.json:
+                stdoutlog.info(
+                    '\nWarning: %s possible package resolutions '
+                    '(only showing differing packages):%s%s' %
+                    ('>10' if nsol > 10 else nsol,
+                     dashlist(', '.join(diff) for diff in diffs),
+                     '\n  ... and others' if nsol > 10 else ''))
+
+        if returnall:
+            if nsol > 1:
+                raise RuntimeError()
+            # TODO: clean up this mess
+            # return [sorted(Dist(stripfeat(dname)) for dname in psol) for psol in psolutions]
+            # return [sorted((new_index[sat_name] for sat_name in psol), key=lambda x: x.name)
+            #         for psol in psolutions]
+
+            # return sorted(Dist(stripfeat(dname)) for dname in psolutions[0])
+        return sorted(psolutions[0], key=lambda x: x.name)
+
+    def _split_index(self, specs, reduced_index):
+        """Partition specs and reduced_index into the weakly connected components of the
+        dependency graph, where package names are linked by dependencies and by the features
+        their records track or require.  Returns a single (specs, reduced_index) pair if the
+        problem doesn't split.
+        """
+        unsplit = [(specs, reduced_index)]
+        parent = {}
+
+        def find(node):
+            root = parent.setdefault(node, node)
+            while root != parent[root]:
+                root = parent[root]
+            while node != root:
+                parent[node], node = root, parent[node]
+            return root
+
+        def union(node1, node2):
+            root1, root2 = find(node1), find(node2)
+            if root1 != root2:
+                parent[root2] = root1
+
+        for spec in specs:
+            name = spec.get_exact_value('name')
+            if not name:
+                return unsplit
+            for feature_name in spec.get_exact_value('track_features') or ():
+                union(name, ('@feature', feature_name))
+        for prec in reduced_index:
+            for feature_name in chain(prec.track_features, prec.features):
+                union(prec.name, ('@feature', feature_name))
+            for ms in self.ms_depends(prec):
+                dep_name = ms.get_exact_value('name')
+                feature_names = ms.get_exact_value('track_features')
+                if not dep_name and not feature_names:
+                    return unsplit
+                if dep_name:
+                    union(prec.name, dep_name)
+                for feature_name in feature_names or ():
+                    union(prec.name, ('@feature', feature_name))
+
+        component_indexes = defaultdict(dict)
+        for prec in reduced_index:
+            component_indexes[find(prec.name)][prec] = prec
+        component_specs = defaultdict(list)
+        for spec in specs:
+            component_specs[find(spec.name)].append(spec)
+        if len(component_indexes) < 2 or any(root not in component_indexes
+                                             for root in component_specs):
+            return unsplit
+        return [(tuple(component_specs[root]), component_indexes[root])
+                for root in component_indexes]
+
+
+class _Subproblem(object):
+    """One independent component of a solve: the clauses of its reduced index, its best solution
+    so far, and the metrics still to minimize on it."""
+
+    def __init__(self, resolve, specs, reduced_index, _remove=False, deadline=None,
+                 profile=None):
+        # type: (Resolve, Tuple[MatchSpec], Dict[PackageRecord, PackageRecord], bool, float, List[Dict]) -> None  # NOQA
+        len0 = len(specs)
+
         # Check if satisfiable
         def mysat(specs, add_if=False):
             constraints = r2.generate_spec_constraints(C, specs)
             return C.sat(constraints, add_if)
 
-        r2 = Resolve(reduced_index, True, True, channels=self.channels)
-        C = r2.gen_clauses()
-        solution = mysat(specs, True)
-        if not solution:
-            specs = minimal_unsatisfiable_subset(specs, sat=mysat)
-            self.find_conflicts(specs)
-
+        self.reduced_index = reduced_index
+        self.r2 = r2 = Resolve(reduced_index, True, True, channels=resolve.channels)
+        start = time()
+        self.C = C = r2.gen_clauses()
+        self.stats = None
+        if profile is not None:
+            self.stats = {
+                'names': sorted(r2.groups),
+                'gen_clauses_seconds': time() - start,
+                'variables': C.m,
+                'clauses': len(C.clauses),
+                'minimize': [],
+            }
+            profile.append(self.stats)
+
+        C.limit = context.solver_propagation_limit
+        C.deadline = deadline
+        self.solution = mysat(specs, True)
+        if not self.solution:
+            if C.budget_exhausted:
+                raise SolverBudgetExhaustedError(context.solver_propagation_limit)
+            # the conflict search runs without the budget: a probe cut short by it would be
+            # taken for an unsatisfiable one
+            C.limit = 0
+            C.deadline = None
+            specs = r2._minimal_unsatisfiable_specs(C, specs, mysat)
+            resolve.find_conflicts(specs)
+
+        self.suboptimal = False
+        self.stages = self._stages(specs, len0, _remove)
+        self._stage_start = None
+
+    def _stages(self, specs, len0, _remove):
+        # The metrics to minimize, most important first: yields a (stage, objective, trymax)
+        # triple for each, and is sent back its minimized value.
+        r2, C = self.r2, self.C
         speco = []  # optional packages
         specr = []  # requested packages
         speca = []  # all other packages
@@ -834,18 +1099,18 @@ class Resolve(object):
         # Removed packages: minimize count
         if _remove:
             eq_optional_c = r2.generate_removal_count(C, speco)
-            solution, obj7 = C.minimize(eq_optional_c, solution)
+            obj7 = yield 'removal_count', eq_optional_c, False
             log.debug('Package removal metric: %d', obj7)
 
         # Requested packages: maximize versions
         eq_req_c, eq_req_v, eq_req_b, eq_req_t = r2.generate_version_metrics(C, specr)
-        solution, obj3a = C.minimize(eq_req_c, solution)
-        solution, obj3 = C.minimize(eq_req_v, solution)
+        obj3a = yield 'requested_channels', eq_req_c, False
+        obj3 = yield 'requested_versions', eq_req_v, False
         log.debug('Initial package channel/version metric: %d/%d', obj3a, obj3)
 
         # Track features: minimize feature count
         eq_feature_count = r2.generate_feature_count(C)
-        solution, obj1 = C.minimize(eq_feature_count, solution)
+        obj1 = yield 'track_feature_count', eq_feature_count, False
         log.debug('Track feature count: %d', obj1)
 
         # Featured packages: minimize number of featureless packages
@@ -856,86 +1121,110 @@ class Resolve(object):
         # environment, but not 'feat2'. In this case, the 'feat2' version of foo is
         # considered "featureless."
         eq_feature_metric = r2.generate_feature_metric(C)
-        solution, obj2 = C.minimize(eq_feature_metric, solution)
+        obj2 = yield 'misfeature_count', eq_feature_metric, False
         log.debug('Package misfeature count: %d', obj2)
 
         # Requested packages: maximize builds
-        solution, obj4 = C.minimize(eq_req_b, solution)
+        obj4 = yield 'requested_builds', eq_req_b, False
         log.debug('Initial package build metric: %d', obj4)
 
         # Optional installations: minimize count
         if not _remove:
             eq_optional_install = r2.generate_install_count(C, speco)
-            solution, obj49 = C.minimize(eq_optional_install, solution)
+            obj49 = yield 'optional_install_count', eq_optional_install, False
             log.debug('Optional package install metric: %d', obj49)
 
         # Dependencies: minimize the number of packages that need upgrading
         eq_u = r2.generate_update_count(C, speca)
-        solution, obj50 = C.minimize(eq_u, solution)
+        obj50 = yield 'update_count', eq_u, False
         log.debug('Dependency update count: %d', obj50)
 
         # Remaining packages: maximize versions, then builds
         eq_c, eq_v, eq_b, eq_t = r2.generate_version_metrics(C, speca)
-        solution, obj5a = C.minimize(eq_c, solution)
-        solution, obj5 = C.minimize(eq_v, solution)
-        solution, obj6 = C.minimize(eq_b, solution)
+        obj5a = yield 'channels', eq_c, False
+        obj5 = yield 'versions', eq_v, False
+        obj6 = yield 'builds', eq_b, False
         log.debug('Additional package channel/version/build metrics: %d/%d/%d',
                   obj5a, obj5, obj6)
 
         # Maximize timestamps
         eq_t.update(eq_req_t)
-        solution, obj6t = C.minimize(eq_t, solution)
+        obj6t = yield 'timestamps', eq_t, False
         log.debug('Timestamp metric: %d', obj6t)
 
         # Prune unnecessary packages
         eq_c = r2.generate_package_count(C, specm)
-        solution, obj7 = C.minimize(eq_c, solution, trymax=True)
+        obj7 = yield 'package_count', eq_c, True
         log.debug('Weak dependency count: %d', obj7)
 
+    def min_peak(self, objective):
+        self._stage_start = time(), self.C.bisection_rounds
+        self.solution, value = self.C.min_peak(objective, self.solution)
+        return value
+
+    def minimize(self, stage, objective, trymax=False, peak=None):
+        C = self.C
+        start, rounds = self._stage_start or (time(), C.bisection_rounds)
+        self._stage_start = None
+        self.solution, value = C.minimize(objective, self.solution, trymax, peak)
+        if self.stats is not None:
+            self.stats['minimize'].append({
+                'stage': stage,
+                'seconds': time() - start,
+                'objective': value,
+                'bisection_rounds': C.bisection_rounds - rounds,
+            })
+        return value
+
+    def alternate_solutions(self):
+        """The best solution, followed by up to ten alternatives to it."""
+        C = self.C
+
         def clean(sol):
             return [q for q in (C.from_index(s) for s in sol)
                     if q and q[0] != '!' and '@' not in q]
         log.debug('Looking for alternate solutions')
-        nsol = 1
-        psolutions = []
-        psolution = clean(solution)
-        psolutions.append(psolution)
-        while True:
+        psolution = clean(self.solution)
+        psolutions = [psolution]
+        if C.budget_spent():
+            # alternatives to a solution that may not be optimal say nothing useful
+            self.suboptimal = True
+        while not C.budget_exhausted:
             nclause = tuple(C.Not(C.from_name(q)) for q in psolution)
             solution = C.sat((nclause,), True)
             if solution is None:
                 break
-            nsol += 1
-            if nsol > 10:
-                log.debug('Too many solutions; terminating')
-                break
             psolution = clean(solution)
             psolutions.append(psolution)
+            # one more than the ten shown tells that there are others
+            if len(psolutions) > 10:
+                log.debug('Too many solutions; terminating')
+                break
 
-        if nsol > 1:
-            psols2 = list(map(set, psolutions))
-            common = set.intersection(*psols2)
-            diffs = [sorted(set(sol) - common) for sol in psols2]
-            if not context.json:
-                stdoutlog.info(
-                    '\nWarning: %s possible package resolutions '
-                    '(only showing differing packages):%s%s' %
-                    ('>10' if nsol > 10 else nsol,
-                     dashlist(', '.join(diff) for diff in diffs),
-                     '\n  ... and others' if nsol > 10 else ''))
-
-        def stripfeat(sol):
-            return sol.split('[')[0]
-
-        new_index = {self.to_sat_name(prec): prec for prec in itervalues(self.index)}
-
-        if returnall:
-            if len(psolutions) > 1:
-                raise RuntimeError()
-            # TODO: clean up this mess
-            # return [sorted(Dist(stripfeat(dname)) for dname in psol) for psol in psolutions]
-            # return [sorted((new_index[sat_name] for sat_name in psol), key=lambda x: x.name)
-            #         for psol in psolutions]
-
-            # return sorted(Dist(stripfeat(dname)) for dname in psolutions[0])
-        return sorted((new_index[sat_name] for sat_name in psolutions[0]), key=lambda x: x.name)
+        if self.stats is not None:
+            self.stats['final_variables'] = C.m
+            self.stats['final_clauses'] = len(C.clauses)
+
+        new_index = {self.r2.to_sat_name(prec): prec for prec in itervalues(self.reduced_index)}
+        return [[new_index[sat_name] for sat_name in psol] for psol in psolutions]
+
+
+def _minimize_stages(subproblems):
+    # Minimize the metrics of every subproblem, stage by stage.  Minimizing a metric starts by
+    # minimizing its peak, its largest coefficient in the solution, which for a problem split
+    # into parts is the largest of the smallest peaks of the parts.  Bounded by that, the sum
+    # of the whole is then minimized by minimizing the sum of each part on its own.
+    requests = [next(subproblem.stages) for subproblem in subproblems]
+    while requests:
+        peak = None
+        if len(subproblems) > 1:
+            peak = max(subproblem.min_peak(objective)
+                       for subproblem, (_, objective, _) in zip(subproblems, requests))
+        next_requests = []
+        for subproblem, (stage, objective, trymax) in zip(subproblems, requests):
+            value = subproblem.minimize(stage, objective, trymax, peak)
+            try:
+                next_requests.append(subproblem.stages.send(value))
+            except StopIteration:
+                pass
+        requests = next_requests
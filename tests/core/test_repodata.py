@@ -1,24 +1,37 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import, division, print_function, unicode_literals
 
+import bz2
+from io import BytesIO
+import json
 from logging import getLogger
+from os.path import isfile, join
+from threading import Thread
+from time import sleep
 from unittest import TestCase
 
 import pytest
+import responses
 
 from conda.base.context import context, reset_context
-from conda.common.compat import iteritems
+from conda.common.compat import ensure_binary, iteritems
 from conda.common.disk import temporary_content_in_file
-from conda.common.io import env_var
+from conda.common.io import env_var, env_vars
+from conda.common.mapped_index import MappedIndex, MappedIndexError, write_mapped_index
+from conda.common.serialize import JsonPatchError, apply_json_patch, json_stream_items
 from conda.core.index import get_index
+from conda.exceptions import CondaHTTPError, LockError
 from conda.core.subdir_data import Response304ContentUnchanged, cache_fn_url, read_mod_and_etag, \
-    SubdirData
+    SubdirData, fetch_repodata_remote_request, write_repodata_with_saved_fields, zstandard
+from conda.lock import ReadWriteLock
 from conda.models.channel import Channel
 
+from ..helpers import tempdir
+
 try:
-    from unittest.mock import patch
+    from unittest.mock import call, patch
 except ImportError:
-    from mock import patch
+    from mock import call, patch
 
 log = getLogger(__name__)
 
@@ -163,6 +176,672 @@ class StaticFunctionTests(TestCase):
         assert hash4 != hash6
 
 
+def forget_subdir_data(channel_url):
+    SubdirData._cache_.pop(Channel(channel_url).url(with_credentials=True), None)
+
+
+class StreamingRepodataTests(TestCase):
+
+    def tearDown(self):
+        forget_subdir_data('https://conda.anaconda.org/conda-test/linux-64')
+
+    repodata = {
+        "_etag": "\"569c0ecb-48\"",
+        "packages": {
+            "flask-0.11.1-py35_0.tar.bz2": {
+                "build": "py35_0",
+                "build_number": 0,
+                "depends": ["python 3.5*", "werkzeug >=0.7"],
+                "md5": "7be8ad2bbd7b7e5d6d6b9f0ac4a5f1e2",
+                "name": "flask",
+                "size": 129153,
+                "version": "0.11.1",
+            },
+            "mkl-2017.0.1-0.tar.bz2": {
+                "build": "0",
+                "build_number": 0,
+                "depends": [],
+                "md5": "e5ad3b8b4de6e5e1ab5c1c0e2d7c2a4f",
+                "name": "mkl",
+                "size": 135839,
+                "track_features": "mkl",
+                "version": "2017.0.1",
+            },
+        },
+        "info": {
+            "subdir": "linux-64",
+        },
+    }
+
+    def test_json_stream_items_small_chunks(self):
+        raw = json.dumps(self.repodata, indent=2).encode('utf-8')
+        for chunk_size in (1, 3, 7, 64, 1 << 16):
+            events = list(json_stream_items(BytesIO(raw), expand_keys=('packages',),
+                                            chunk_size=chunk_size))
+            expected = [(None, '_etag', self.repodata['_etag']),
+                        (None, 'info', self.repodata['info'])]
+            expected.extend(('packages', fn, info)
+                            for fn, info in iteritems(self.repodata['packages']))
+            assert sorted(events, key=lambda e: (e[0] or '', e[1])) == \
+                sorted(expected, key=lambda e: (e[0] or '', e[1]))
+
+    def test_json_stream_items_decodes_each_value_once(self):
+        doc = {
+            'a': ['x\\"}]', {'b': '\\', 'c': [[], {}]}, 1.5e3, -2, True, None],
+            'd': '\u00e9"{[',
+            'e': 12345,
+        }
+        raw = json.dumps(doc).encode('utf-8')
+        raw_decode = json.JSONDecoder.raw_decode
+        calls = []
+
+        def counting_raw_decode(decoder, s, idx=0):
+            calls.append(idx)
+            return raw_decode(decoder, s, idx)
+
+        for chunk_size in (1, 2, 5, 1 << 16):
+            del calls[:]
+            with patch.object(json.JSONDecoder, 'raw_decode', counting_raw_decode):
+                events = list(json_stream_items(BytesIO(raw), chunk_size=chunk_size))
+            assert dict((key, value) for _, key, value in events) == doc
+            # at most one failed and one final call for each key and each value, however
+            # many chunks it spans
+            assert len(calls) <= 2 * 2 * len(doc)
+
+    def test_json_stream_items_malformed(self):
+        with pytest.raises(ValueError):
+            list(json_stream_items(BytesIO(b'{"info": {}, "packages": {"a": }}'),
+                                   expand_keys=('packages',)))
+        with pytest.raises(ValueError):
+            list(json_stream_items(BytesIO(b'{"info": {}} {}')))
+
+    def test_process_raw_repodata_info_after_packages(self):
+        channel = Channel('https://conda.anaconda.org/conda-test/linux-64')
+        sd = SubdirData(channel)
+        state = sd._process_raw_repodata_str(json.dumps(self.repodata))
+        sd._loaded = True
+        assert state['_etag'] == self.repodata['_etag']
+        assert sorted(rec.name for rec in sd.iter_records()) == ['flask', 'mkl']
+        assert all(rec.subdir == 'linux-64' for rec in sd.iter_records())
+        assert state['_track_features_index']['mkl'] == {'mkl'}
+
+    def test_package_records_built_on_demand(self):
+        channel = Channel('https://conda.anaconda.org/conda-test/linux-64')
+        sd = SubdirData(channel)
+        with env_var("CONDA_ADD_PIP_AS_PYTHON_DEPENDENCY", "false", reset_context):
+            sd._process_raw_repodata_str(json.dumps(self.repodata))
+        sd._loaded = True
+        assert sd._names_index == {}
+
+        precs = tuple(sd.query('flask'))
+        assert len(precs) == 1
+        assert precs[0].fn == "flask-0.11.1-py35_0.tar.bz2"
+        assert precs[0].url == channel.url() + "/flask-0.11.1-py35_0.tar.bz2"
+        assert set(sd._names_index) == {'flask'}
+        assert sd._package_records_for_name('flask') is sd._package_records_for_name('flask')
+
+        # raw package data is left untouched by materialization
+        assert 'fn' not in sd._package_data['flask'][0][1]
+
+    def test_secondary_indexes(self):
+        channel = Channel('https://conda.anaconda.org/conda-test/linux-64')
+        sd = SubdirData(channel)
+        sd._process_raw_repodata_str(json.dumps(self.repodata))
+        sd._loaded = True
+
+        flask_info = self.repodata['packages']['flask-0.11.1-py35_0.tar.bz2']
+        for spec in ('*[md5=%s]' % flask_info['md5'], '*[build=py35_0]', '*[build=py35*]',
+                     '*[version=0.11.*]', '*[version=">0.10,<1"]'):
+            precs = tuple(sd.query(spec))
+            assert [prec.name for prec in precs] == ['flask'], spec
+            assert set(sd._names_index) == {'flask'}, spec
+        assert not tuple(sd.query('*[md5=0123456789abcdef0123456789abcdef]'))
+        assert not tuple(sd.query('*[build=py35_0,version=2017.0.1]'))
+
+        assert [prec.fn for prec in sd.reverse_dependencies('werkzeug')] == [
+            "flask-0.11.1-py35_0.tar.bz2"
+        ]
+        assert sd.reverse_dependencies('flask') == ()
+
+    def test_load_all(self):
+        channel_urls = ('https://conda.anaconda.org/conda-test/linux-64',
+                        'https://conda.anaconda.org/conda-test/noarch')
+        subdir_datas = tuple(SubdirData(Channel(url)) for url in channel_urls)
+        loaded = []
+
+        def load(sd):
+            loaded.append(sd)
+            sd._loaded = True
+            return sd
+
+        try:
+            with patch.object(SubdirData, 'load', autospec=True, side_effect=load):
+                SubdirData.load_all(subdir_datas)
+                SubdirData.load_all(subdir_datas)
+            assert sorted(sd.url_w_subdir for sd in loaded) == sorted(channel_urls)
+        finally:
+            for sd in subdir_datas:
+                sd._loaded = False
+
+
+class MappedIndexTests(TestCase):
+
+    def tearDown(self):
+        forget_subdir_data('https://conda.anaconda.org/conda-test/linux-64')
+
+    def test_round_trip(self):
+        tables = {
+            'packages': {
+                'zlib': [('zlib-1.2.11-0.tar.bz2', '{}')],
+                'flask': [('flask-0.11.1-py35_0.tar.bz2', '{"a":1}'),
+                          ('flask-0.12-py36_0.tar.bz2', '{"b":"\u00e9"}')],
+                'ünicode': [],
+            },
+        }
+        with tempdir() as td:
+            path = join(td, 'test.idx')
+            with open(path, 'wb') as fh:
+                write_mapped_index(fh, 3, {'key': 'value'}, tables)
+
+            with MappedIndex(path, 3) as mapped_index:
+                assert mapped_index.metadata == {'key': 'value'}
+                table = mapped_index.table('packages')
+                assert len(table) == 3
+                assert sorted(table) == sorted(tables['packages'])
+                for key, value in iteritems(tables['packages']):
+                    assert key in table
+                    assert table[key] == value
+                assert 'numpy' not in table
+                with pytest.raises(KeyError):
+                    table['numpy']
+            # the file is unmapped on leaving the with block
+            with pytest.raises(ValueError):
+                table['flask']
+
+            with pytest.raises(MappedIndexError):
+                MappedIndex(path, 4)
+
+            with open(path, 'wb') as fh:
+                fh.write(b'not an index at all')
+            with pytest.raises(MappedIndexError):
+                MappedIndex(path, 3)
+
+    def test_subdir_data_index_round_trip(self):
+        channel = Channel('https://conda.anaconda.org/conda-test/linux-64')
+        with tempdir() as td:
+            sd = SubdirData(channel)
+            sd.cache_path_base = join(td, 'abcdef12')
+            raw_repodata_str = json.dumps(dict(StreamingRepodataTests.repodata,
+                                               _url=sd.url_w_credentials))
+            with open(sd.cache_path_json, 'w') as fh:
+                fh.write(raw_repodata_str)
+            sd._process_raw_repodata_str(raw_repodata_str)
+            sd._loaded = True
+            sd._write_index()
+            # writing the index doesn't build the secondary indexes
+            assert sd._secondary_indexes is None
+            expected = sorted(sd.iter_records(), key=lambda prec: prec.fn)
+
+            forget_subdir_data(channel.url())
+            sd2 = SubdirData(channel)
+            sd2.cache_path_base = sd.cache_path_base
+            assert sd2._read_index(StreamingRepodataTests.repodata['_etag'], 'mod') is None
+            state = sd2._read_index(StreamingRepodataTests.repodata['_etag'], None)
+            sd2._set_internal_state(state)
+            sd2._loaded = True
+            records = sorted(sd2.iter_records(), key=lambda prec: prec.fn)
+            assert records == expected
+            assert [prec.url for prec in records] == [prec.url for prec in expected]
+            assert state['_track_features_index'] == {'mkl': {'mkl'}}
+            assert [prec.fn for prec in sd2.reverse_dependencies('python')] == [
+                "flask-0.11.1-py35_0.tar.bz2"
+            ]
+            assert sd2.reverse_dependencies('numpy') == ()
+            assert isfile(sd2.cache_path_depends_index)
+
+            # the reverse-dependency index is reused, rather than built again
+            forget_subdir_data(channel.url())
+            sd3 = SubdirData(channel)
+            sd3.cache_path_base = sd.cache_path_base
+            sd3._set_internal_state(sd3._read_index(StreamingRepodataTests.repodata['_etag'],
+                                                    None))
+            sd3._loaded = True
+            assert [prec.fn for prec in sd3.reverse_dependencies('python')] == [
+                "flask-0.11.1-py35_0.tar.bz2"
+            ]
+            assert sd3._secondary_indexes is None
+
+            # the indexes mapped by a state are closed when the state is replaced
+            mapped_indexes = [sd3._internal_state[key] for key in ('_mapped_index',
+                                                                   '_depends_index')]
+            with patch.object(MappedIndex, 'close', autospec=True) as close:
+                sd3._set_internal_state(sd3._read_index(StreamingRepodataTests.repodata['_etag'],
+                                                        None))
+            assert close.call_args_list == [call(mapped_index) for mapped_index in mapped_indexes]
+            for mapped_index in mapped_indexes:
+                mapped_index.close()
+            sd2._close_mapped_indexes()
+            sd3._close_mapped_indexes()
+
+
+class RepodataPatchTests(TestCase):
+
+    channel_url = 'https://conda.anaconda.test/patched/linux-64'
+    repodata = {
+        '_etag': '"etag-1"',
+        'info': {'subdir': 'linux-64'},
+        'packages': {
+            'flask-0.11.1-py35_0.tar.bz2': {
+                'build': 'py35_0', 'build_number': 0, 'depends': [],
+                'md5': 'a1da6cbe2e1e9fa9fdfc8ba8cea5bdc5', 'name': 'flask',
+                'subdir': 'linux-64', 'version': '0.11.1',
+            },
+        },
+    }
+    new_package = {
+        'build': 'py36_0', 'build_number': 0, 'depends': [],
+        'md5': 'b1da6cbe2e1e9fa9fdfc8ba8cea5bdc5', 'name': 'flask',
+        'subdir': 'linux-64', 'version': '0.12',
+    }
+
+    def setUp(self):
+        self.td_context = tempdir()
+        td = self.td_context.__enter__()
+        self.sd = SubdirData(Channel(self.channel_url))
+        self.sd.cache_path_base = join(td, 'abcdef12')
+        with open(self.sd.cache_path_json, 'w') as fh:
+            fh.write(json.dumps(self.repodata))
+
+    def tearDown(self):
+        forget_subdir_data(self.channel_url)
+        self.td_context.__exit__(None, None, None)
+
+    def test_apply_json_patch(self):
+        doc = {'a': {'b': [1, 2]}, 'c~d': 'x'}
+        doc = apply_json_patch(doc, [
+            {'op': 'test', 'path': '/c~0d', 'value': 'x'},
+            {'op': 'add', 'path': '/a/b/1', 'value': 5},
+            {'op': 'add', 'path': '/a/b/-', 'value': 6},
+            {'op': 'copy', 'from': '/a/b', 'path': '/e'},
+            {'op': 'move', 'from': '/c~0d', 'path': '/a/f'},
+            {'op': 'remove', 'path': '/a/b/0'},
+        ])
+        assert doc == {'a': {'b': [5, 2, 6], 'f': 'x'}, 'e': [1, 5, 2, 6]}
+
+        for patch in ([{'op': 'test', 'path': '/e/0', 'value': 2}],
+                      [{'op': 'remove', 'path': '/missing'}],
+                      [{'op': 'replace', 'path': '/a/missing', 'value': 1}],
+                      [{'op': 'move', 'from': '/a', 'path': '/a/g'}],
+                      [{'op': 'add', 'path': '/a/b/9', 'value': 1}],
+                      [{'op': 'add', 'path': '/a'}],
+                      [{'op': 'frobnicate', 'path': '/a'}]):
+            with pytest.raises(JsonPatchError):
+                apply_json_patch(doc, patch)
+
+    def load(self):
+        with env_vars({'CONDA_LOCAL_REPODATA_TTL': '0',
+                       'CONDA_REPODATA_COMPRESSION_ORDER': 'json',
+                       'CONDA_USE_REPODATA_PATCHES': 'true'}, reset_context):
+            return self.sd.load()
+
+    @responses.activate
+    def test_patches_applied(self):
+        responses.add(responses.GET, self.channel_url + '/repodata.patch.json', json={
+            'latest': '"etag-3"',
+            'patches': [
+                {'from': '"etag-2"', 'to': '"etag-3"', 'patch': [
+                    {'op': 'replace', 'path': '/packages/flask-0.12-py36_0.tar.bz2/md5',
+                     'value': 'c1da6cbe2e1e9fa9fdfc8ba8cea5bdc5'},
+                ]},
+                {'from': '"etag-1"', 'to': '"etag-2"', 'patch': [
+                    {'op': 'add', 'path': '/packages/flask-0.12-py36_0.tar.bz2',
+                     'value': self.new_package},
+                    {'op': 'remove', 'path': '/packages/flask-0.11.1-py35_0.tar.bz2'},
+                ]},
+            ],
+        }, headers={'Cache-Control': 'public, max-age=30'})
+
+        precs = tuple(self.load().query('flask'))
+        assert [prec.version for prec in precs] == ['0.12']
+        assert precs[0].md5 == 'c1da6cbe2e1e9fa9fdfc8ba8cea5bdc5'
+        assert len(responses.calls) == 1
+
+        mod_etag_headers = read_mod_and_etag(self.sd.cache_path_json)
+        assert mod_etag_headers['_etag'] == '"etag-3"'
+        assert mod_etag_headers['_cache_control'] == 'public, max-age=30'
+
+    @responses.activate
+    def test_broken_patch_chain_fetches_full_repodata(self):
+        responses.add(responses.GET, self.channel_url + '/repodata.patch.json', json={
+            'latest': '"etag-3"',
+            'patches': [{'from': '"etag-2"', 'to': '"etag-3"', 'patch': []}],
+        })
+        repodata = dict(self.repodata, packages={
+            'flask-0.12-py36_0.tar.bz2': self.new_package,
+        })
+        del repodata['_etag']
+        responses.add(responses.GET, self.channel_url + '/repodata.json', json=repodata,
+                      headers={'Etag': '"etag-3"'})
+
+        precs = tuple(self.load().query('flask'))
+        assert [prec.version for prec in precs] == ['0.12']
+        assert len(responses.calls) == 2
+        assert read_mod_and_etag(self.sd.cache_path_json)['_etag'] == '"etag-3"'
+
+    @responses.activate
+    def test_patches_update_index(self):
+        six_package = {
+            'build': 'py_0', 'build_number': 0, 'depends': [],
+            'md5': 'd1da6cbe2e1e9fa9fdfc8ba8cea5bdc5', 'name': 'six',
+            'subdir': 'linux-64', 'version': '1.11.0',
+        }
+        with open(self.sd.cache_path_json, 'w') as fh:
+            fh.write(json.dumps(dict(self.repodata, _url=self.channel_url, packages=dict(
+                self.repodata['packages'], **{'six-1.11.0-py_0.tar.bz2': six_package}
+            ))))
+        with open(self.sd.cache_path_json, 'rb') as fh:
+            self.sd._process_raw_repodata(fh)
+        self.sd._write_index()
+
+        responses.add(responses.GET, self.channel_url + '/repodata.patch.json', json={
+            'latest': '"etag-2"',
+            'patches': [{'from': '"etag-1"', 'to': '"etag-2"', 'patch': [
+                {'op': 'add', 'path': '/packages/flask-0.12-py36_0.tar.bz2',
+                 'value': dict(self.new_package, track_features='mkl')},
+                {'op': 'replace', 'path': '/packages/flask-0.11.1-py35_0.tar.bz2/md5',
+                 'value': 'c1da6cbe2e1e9fa9fdfc8ba8cea5bdc5'},
+            ]}],
+        })
+
+        # the patched repodata is indexed without being parsed again
+        with patch.object(SubdirData, '_process_raw_repodata', side_effect=AssertionError):
+            self.load()
+        assert sorted(prec.md5 for prec in self.sd.query('flask')) == [
+            'b1da6cbe2e1e9fa9fdfc8ba8cea5bdc5', 'c1da6cbe2e1e9fa9fdfc8ba8cea5bdc5',
+        ]
+        assert [prec.version for prec in self.sd.query('six')] == ['1.11.0']
+        assert self.sd._track_features_index == {'mkl': {'flask'}}
+        assert self.sd._internal_state['_etag'] == '"etag-2"'
+        indexed_package_data = dict(self.sd._package_data)
+        self.sd._close_mapped_indexes()
+
+        with open(self.sd.cache_path_json, 'rb') as fh:
+            _internal_state = self.sd._process_raw_repodata(fh)
+        assert indexed_package_data == dict(_internal_state['_package_data'])
+
+    @responses.activate
+    def test_patch_spanning_entries_fetches_full_repodata(self):
+        responses.add(responses.GET, self.channel_url + '/repodata.patch.json', json={
+            'latest': '"etag-2"',
+            'patches': [{'from': '"etag-1"', 'to': '"etag-2"', 'patch': [
+                {'op': 'add', 'path': '/packages/flask-0.12-py36_0.tar.bz2',
+                 'value': self.new_package},
+                {'op': 'replace', 'path': '/packages', 'value': {}},
+            ]}],
+        })
+        repodata = dict(self.repodata, packages={
+            'flask-0.12-py36_0.tar.bz2': self.new_package,
+        })
+        del repodata['_etag']
+        responses.add(responses.GET, self.channel_url + '/repodata.json', json=repodata,
+                      headers={'Etag': '"etag-2"'})
+
+        precs = tuple(self.load().query('flask'))
+        assert [prec.version for prec in precs] == ['0.12']
+        assert len(responses.calls) == 2
+
+    @responses.activate
+    def test_no_patches_published(self):
+        responses.add(responses.GET, self.channel_url + '/repodata.patch.json', status=404)
+        responses.add(responses.GET, self.channel_url + '/repodata.json', status=304)
+
+        precs = tuple(self.load().query('flask'))
+        assert [prec.version for prec in precs] == ['0.11.1']
+        assert len(responses.calls) == 2
+
+        # the missing patch file is remembered, and not asked for again
+        self.sd._loaded = False
+        self.load()
+        assert [call.request.url for call in responses.calls[2:]] == [
+            self.channel_url + '/repodata.json',
+        ]
+
+
+class SharedRepodataCacheTests(TestCase):
+
+    channel_url = 'https://conda.anaconda.test/shared/linux-64'
+
+    def tearDown(self):
+        forget_subdir_data(self.channel_url)
+
+    @responses.activate
+    def test_waits_for_refresh_by_other_process(self):
+        with tempdir() as td:
+            sd = SubdirData(Channel(self.channel_url))
+            sd.cache_path_base = join(td, 'abcdef12')
+            loaded = []
+            thread = Thread(target=lambda: loaded.append(tuple(sd.query('flask'))))
+
+            with ReadWriteLock(sd.cache_path_base + '.lock').write():
+                thread.start()
+                sleep(0.1)
+                assert not loaded
+                # meanwhile, the process holding the lock refreshes the cache
+                with open(sd.cache_path_json, 'w') as fh:
+                    fh.write(json.dumps(dict(StreamingRepodataTests.repodata,
+                                             _cache_control='public, max-age=300')))
+            thread.join()
+
+            assert len(loaded[0]) == 1
+            assert len(responses.calls) == 0
+
+    def test_index_written_under_write_lock(self):
+        with tempdir() as td:
+            sd = SubdirData(Channel(self.channel_url))
+            sd.cache_path_base = join(td, 'abcdef12')
+            with open(sd.cache_path_json, 'w') as fh:
+                fh.write(json.dumps(dict(StreamingRepodataTests.repodata,
+                                         _cache_control='public, max-age=300')))
+
+            write_locked = []
+            write_index = SubdirData._write_index
+
+            def _write_index(self):
+                # a reader is shut out only while the lock is held for writing
+                try:
+                    with ReadWriteLock(sd.cache_path_base + '.lock', timeout=0).read():
+                        write_locked.append(False)
+                except LockError:
+                    write_locked.append(True)
+                return write_index(self)
+
+            with patch.object(SubdirData, '_write_index', autospec=True,
+                              side_effect=_write_index):
+                assert len(tuple(sd.query('flask'))) == 1
+            assert write_locked == [True]
+            assert isfile(sd.cache_path_index)
+
+
+class ShardedRepodataTests(TestCase):
+
+    channel_url = 'https://conda.anaconda.test/sharded/linux-64'
+    repodata = StreamingRepodataTests.repodata
+
+    def setUp(self):
+        self.td_context = tempdir()
+        td = self.td_context.__enter__()
+        self.sd = SubdirData(Channel(self.channel_url))
+        self.sd.cache_path_base = join(td, 'abcdef12')
+
+    def tearDown(self):
+        forget_subdir_data(self.channel_url)
+        self.td_context.__exit__(None, None, None)
+
+    def add_shard_responses(self):
+        responses.add(responses.GET, self.channel_url + '/shards/index.json', json={
+            'info': {'subdir': 'linux-64'},
+            'names': ['flask', 'mkl'],
+        }, headers={'Cache-Control': 'max-age=300'})
+        for name in ('flask', 'mkl'):
+            responses.add(responses.GET, self.channel_url + '/shards/%s.json' % name, json={
+                'packages': {fn: info for fn, info in iteritems(self.repodata['packages'])
+                             if info['name'] == name},
+            }, headers={'Etag': '"%s-1"' % name, 'Cache-Control': 'max-age=300'})
+
+    @responses.activate
+    def test_shards_fetched_per_name(self):
+        self.add_shard_responses()
+        with env_var('CONDA_USE_REPODATA_SHARDS', 'true', reset_context):
+            self.sd.load()
+            assert len(responses.calls) == 1
+
+            precs = tuple(self.sd.query('flask'))
+            assert [prec.fn for prec in precs] == ["flask-0.11.1-py35_0.tar.bz2"]
+            assert precs[0].url == self.channel_url + "/flask-0.11.1-py35_0.tar.bz2"
+            assert not tuple(self.sd.query('numpy'))
+            assert [call.request.url for call in responses.calls] == [
+                self.channel_url + '/shards/index.json',
+                self.channel_url + '/shards/flask.json',
+            ]
+            assert read_mod_and_etag(join(self.sd.cache_path_shards,
+                                          'flask.json'))['_etag'] == '"flask-1"'
+
+            # cached shards are reused while fresh
+            forget_subdir_data(self.channel_url)
+            sd = SubdirData(Channel(self.channel_url))
+            sd.cache_path_base = self.sd.cache_path_base
+            assert len(tuple(sd.query('flask'))) == 1
+            assert len(responses.calls) == 2
+
+    @responses.activate
+    def test_nameless_query_uses_full_repodata(self):
+        self.add_shard_responses()
+        responses.add(responses.GET, self.channel_url + '/repodata.json', json=self.repodata)
+        with env_var('CONDA_USE_REPODATA_SHARDS', 'true', reset_context):
+            with env_var('CONDA_REPODATA_COMPRESSION_ORDER', 'json', reset_context):
+                precs = tuple(self.sd.query('*[version=2017.0.1]'))
+        assert [prec.name for prec in precs] == ['mkl']
+        assert [call.request.url for call in responses.calls] == [
+            self.channel_url + '/shards/index.json',
+            self.channel_url + '/repodata.json',
+        ]
+
+    @responses.activate
+    def test_no_shards_published(self):
+        responses.add(responses.GET, self.channel_url + '/shards/index.json', status=404)
+        responses.add(responses.GET, self.channel_url + '/repodata.json', json=self.repodata)
+        with env_var('CONDA_USE_REPODATA_SHARDS', 'true', reset_context):
+            with env_var('CONDA_REPODATA_COMPRESSION_ORDER', 'json', reset_context):
+                precs = tuple(self.sd.query('flask'))
+        assert len(precs) == 1
+        assert len(responses.calls) == 2
+
+
+class CompressedRepodataTests(TestCase):
+
+    channel_url = 'https://conda.anaconda.test/compressed/linux-64'
+    repodata = {k: v for k, v in iteritems(RepodataPatchTests.repodata) if k != '_etag'}
+
+    def test_write_repodata_with_saved_fields(self):
+        raw = ensure_binary(json.dumps(self.repodata))
+        for chunk_size in (1, 2, 5, 1 << 16):
+            chunks = [raw[i:i + chunk_size] for i in range(0, len(raw), chunk_size)]
+            out_fh = BytesIO()
+            write_repodata_with_saved_fields(chunks, {'_url': 'url'}, out_fh)
+            assert json.loads(out_fh.getvalue().decode('utf-8')) == dict(self.repodata,
+                                                                         _url='url')
+
+        for raw in (b'', b'  ', b' {', b'{}', b'\n{ }\n'):
+            out_fh = BytesIO()
+            write_repodata_with_saved_fields([raw], {'_url': 'url'}, out_fh)
+            assert json.loads(out_fh.getvalue().decode('utf-8')) == {'_url': 'url'}
+
+        with pytest.raises(ValueError):
+            write_repodata_with_saved_fields([b'[]'], {}, BytesIO())
+
+    @responses.activate
+    def test_compression_fallback_order(self):
+        responses.add(responses.GET, self.channel_url + '/repodata.json.bz2', status=404)
+        responses.add(responses.GET, self.channel_url + '/repodata.json', json=self.repodata,
+                      headers={'Etag': '"etag-2"'})
+        with env_var('CONDA_REPODATA_COMPRESSION_ORDER', 'bz2,json', reset_context):
+            raw_repodata_str = fetch_repodata_remote_request(self.channel_url, None, None)
+        assert [call.request.url for call in responses.calls] == [
+            self.channel_url + '/repodata.json.bz2',
+            self.channel_url + '/repodata.json',
+        ]
+        assert json.loads(raw_repodata_str) == dict(self.repodata, _etag='"etag-2"',
+                                                    _url=self.channel_url)
+
+    @responses.activate
+    def test_missing_variant_remembered(self):
+        responses.add(responses.GET, self.channel_url + '/repodata.json.bz2', status=404)
+        responses.add(responses.GET, self.channel_url + '/repodata.json', json=self.repodata,
+                      headers={'Etag': '"etag-2"'})
+        with tempdir() as td:
+            sd = SubdirData(Channel(self.channel_url))
+            sd.cache_path_base = join(td, 'abcdef12')
+            try:
+                with env_vars({'CONDA_LOCAL_REPODATA_TTL': '0',
+                               'CONDA_REPODATA_COMPRESSION_ORDER': 'bz2,json'}, reset_context):
+                    sd.load()
+                    sd._loaded = False
+                    sd.load()
+            finally:
+                forget_subdir_data(self.channel_url)
+        assert [call.request.url for call in responses.calls] == [
+            self.channel_url + '/repodata.json.bz2',
+            self.channel_url + '/repodata.json',
+            self.channel_url + '/repodata.json',
+        ]
+
+    @responses.activate
+    def test_bz2_repodata(self):
+        responses.add(responses.GET, self.channel_url + '/repodata.json.bz2',
+                      body=bz2.compress(ensure_binary(json.dumps(self.repodata))))
+        with env_var('CONDA_REPODATA_COMPRESSION_ORDER', 'bz2', reset_context):
+            raw_repodata_str = fetch_repodata_remote_request(self.channel_url, None, None)
+        assert len(responses.calls) == 1
+        assert json.loads(raw_repodata_str) == dict(self.repodata, _url=self.channel_url)
+
+    @responses.activate
+    def test_truncated_bz2_repodata(self):
+        body = bz2.compress(ensure_binary(json.dumps(self.repodata)))
+        responses.add(responses.GET, self.channel_url + '/repodata.json.bz2',
+                      body=body[:len(body) // 2])
+        with tempdir() as td:
+            sd = SubdirData(Channel(self.channel_url))
+            sd.cache_path_base = join(td, 'abcdef12')
+            try:
+                with env_var('CONDA_REPODATA_COMPRESSION_ORDER', 'bz2', reset_context):
+                    with pytest.raises(CondaHTTPError):
+                        sd.load()
+            finally:
+                forget_subdir_data(self.channel_url)
+            # the partial download isn't cached
+            assert not isfile(sd.cache_path_json)
+
+    @pytest.mark.skipif(zstandard is None, reason="requires the zstandard package")
+    @responses.activate
+    def test_truncated_zst_repodata(self):
+        body = zstandard.ZstdCompressor().compress(ensure_binary(json.dumps(self.repodata)))
+        responses.add(responses.GET, self.channel_url + '/repodata.json.zst',
+                      body=body[:len(body) // 2])
+        with env_var('CONDA_REPODATA_COMPRESSION_ORDER', 'zst', reset_context):
+            with pytest.raises(CondaHTTPError):
+                fetch_repodata_remote_request(self.channel_url, None, None)
+
+    @pytest.mark.skipif(zstandard is None, reason="requires the zstandard package")
+    @responses.activate
+    def test_zst_repodata(self):
+        body = zstandard.ZstdCompressor().compress(ensure_binary(json.dumps(self.repodata)))
+        responses.add(responses.GET, self.channel_url + '/repodata.json.zst', body=body)
+        with env_var('CONDA_REPODATA_COMPRESSION_ORDER', 'zst,json', reset_context):
+            raw_repodata_str = fetch_repodata_remote_request(self.channel_url, None, None)
+        assert len(responses.calls) == 1
+        assert json.loads(raw_repodata_str) == dict(self.repodata, _url=self.channel_url)
+
+
 # @pytest.mark.integration
 # class SubdirDataTests(TestCase):
 #
@@ -5,20 +5,24 @@ from contextlib import contextmanager
 import os
 from unittest import TestCase
 
-from os.path import join
+from os import listdir
+from os.path import isdir, join
 
 import pytest
 
 from conda.base.context import context, reset_context, Context
 from conda.common.io import env_var, env_vars, stderr_log_level
+from conda.common.serialize import json_load
 from conda.core.prefix_data import PrefixData
 from conda.core.solve import DepsModifier, Solver, UpdateModifier
+from conda.core.subdir_data import SubdirData
 from conda.exceptions import UnsatisfiableError
 from conda.history import History
 from conda.models.channel import Channel
 from conda.models.records import PrefixRecord
-from conda.resolve import MatchSpec
-from ..helpers import get_index_r_1, get_index_r_2, get_index_r_3, get_index_r_4, get_index_r_5
+from conda.resolve import MatchSpec, Resolve
+from ..helpers import get_index_r_1, get_index_r_2, get_index_r_3, get_index_r_4, get_index_r_5, \
+    raises, tempdir
 from conda.common.compat import iteritems
 
 try:
@@ -148,6 +152,104 @@ def test_solve_1():
         assert convert_to_dist_str(final_state) == order
 
 
+def test_solver_cache():
+    get_index_r_1()
+    sd = SubdirData(Channel('https://conda.anaconda.org/channel-1/%s' % context.subdir))
+    specs = MatchSpec("numpy"),
+    with tempdir() as td:
+        with env_vars({'CONDA_PKGS_DIRS': td, 'CONDA_SOLVER_CACHE_SIZE': '2'}, reset_context):
+            # repodata without an etag or modification stamp can't be cached
+            with get_solver(specs) as solver:
+                final_state = solver.solve_final_state()
+            assert not isdir(join(td, 'cache', 'solver'))
+
+            sd._internal_state['_etag'] = '"1234"'
+            try:
+                with get_solver(specs) as solver:
+                    assert solver.solve_final_state() == final_state
+                with get_solver(specs) as solver:
+                    with patch.object(Resolve, 'solve', side_effect=AssertionError):
+                        cached_state = solver.solve_final_state()
+                assert convert_to_dist_str(cached_state) == convert_to_dist_str(final_state)
+                assert cached_state[0].url == final_state[0].url
+
+                # a change to the specs, the prefix, or the repodata is a miss
+                with get_solver(specs, prefix_records=final_state) as solver:
+                    with patch.object(Resolve, 'solve', side_effect=AssertionError):
+                        assert raises(AssertionError, solver.solve_final_state)
+                sd._internal_state['_etag'] = '"5678"'
+                with get_solver(specs) as solver:
+                    with patch.object(Resolve, 'solve', side_effect=AssertionError):
+                        assert raises(AssertionError, solver.solve_final_state)
+
+                # least recently used entries are evicted
+                for specs in ((MatchSpec("numpy"),), (MatchSpec("python=2"),),
+                              (MatchSpec("zlib"),)):
+                    with get_solver(specs) as solver:
+                        solver.solve_final_state()
+                assert len(listdir(join(td, 'cache', 'solver'))) == 2
+            finally:
+                sd._internal_state['_etag'] = None
+
+
+def test_solver_cache_hit_skips_repodata_load():
+    get_index_r_1()
+    sd = SubdirData(Channel('https://conda.anaconda.org/channel-1/%s' % context.subdir))
+    specs = MatchSpec("numpy"),
+    with tempdir() as td:
+        with env_vars({'CONDA_PKGS_DIRS': td, 'CONDA_SOLVER_CACHE_SIZE': '2',
+                       'CONDA_LOCAL_REPODATA_TTL': '3600'}, reset_context):
+            cache_path_base = sd.cache_path_base
+            sd._internal_state['_etag'] = '"1234"'
+            try:
+                with get_solver(specs) as solver:
+                    final_state = solver.solve_final_state()
+
+                # a fresh cache file with the same stamp is a hit, without loading anything
+                sd.cache_path_base = join(td, 'repodata')
+                with open(sd.cache_path_json, 'w') as fh:
+                    fh.write('{"_etag": "\\"1234\\"", "packages": {}}')
+                sd._loaded = False
+                with get_solver(specs) as solver:
+                    with patch.object(SubdirData, 'load', side_effect=AssertionError):
+                        cached_state = solver.solve_final_state()
+                assert convert_to_dist_str(cached_state) == convert_to_dist_str(final_state)
+                assert not sd._loaded
+
+                # with a different stamp, it's a miss
+                with open(sd.cache_path_json, 'w') as fh:
+                    fh.write('{"_etag": "\\"5678\\"", "packages": {}}')
+                with get_solver(specs) as solver:
+                    with patch.object(SubdirData, 'load', side_effect=AssertionError):
+                        assert raises(AssertionError, solver.solve_final_state)
+            finally:
+                sd.cache_path_base = cache_path_base
+                sd._loaded = True
+                sd._internal_state['_etag'] = None
+
+
+def test_solver_profile():
+    specs = MatchSpec("numpy"),
+    with tempdir() as td:
+        profile_path = join(td, 'profile.json')
+        with env_var('CONDA_SOLVER_PROFILE', profile_path, reset_context):
+            with get_solver(specs) as solver:
+                final_state = solver.solve_final_state()
+        with open(profile_path) as fh:
+            profile = json_load(fh.read())
+    assert profile['specs_to_add'] == ['numpy']
+    solve, = profile['solves']
+    assert solve['reduced_index']['numpy'] > 1
+    assert set(solve['reduced_index']) >= set(prec.name for prec in final_state)
+    component = solve['components'][0]
+    assert 0 < component['variables'] <= component['final_variables']
+    assert 0 < component['clauses'] <= component['final_clauses']
+    stages = [stage['stage'] for stage in component['minimize']]
+    assert stages[:2] == ['requested_channels', 'requested_versions']
+    assert stages[-1] == 'package_count'
+    assert sum(stage['bisection_rounds'] for stage in component['minimize']) > 0
+
+
 def test_prune_1():
     specs = MatchSpec("numpy=1.6"), MatchSpec("python=2.7.3"), MatchSpec("accelerate"),
 
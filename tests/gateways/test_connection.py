@@ -3,16 +3,20 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 from logging import getLogger
 from tempfile import NamedTemporaryFile
+from threading import Lock, Thread
+from time import sleep
 from unittest import TestCase
 import warnings
 
 import pytest
 from requests import HTTPError
 
+from conda.base.context import reset_context
 from conda.common.compat import ensure_binary, PY3
+from conda.common.io import env_var
 from conda.common.url import path_to_url
 from conda.gateways.anaconda_client import remove_binstar_token, set_binstar_token
-from conda.gateways.connection.session import CondaHttpAuth, CondaSession
+from conda.gateways.connection.session import CondaHttpAuth, CondaSession, host_request_limit
 from conda.gateways.disk.delete import rm_rf
 
 log = getLogger(__name__)
@@ -66,3 +70,40 @@ class CondaSessionTests(TestCase):
         finally:
             if test_path is not None:
                 rm_rf(test_path)
+
+    def test_http_adapter_shared_between_threads(self):
+        adapters = []
+        thread = Thread(target=lambda: adapters.append(CondaSession().get_adapter('https://')))
+        thread.start()
+        thread.join()
+        assert CondaSession().get_adapter('https://') is adapters[0]
+        assert CondaSession().get_adapter('http://') is adapters[0]
+
+    def test_host_request_limit(self):
+        lock = Lock()
+        active = [0]
+        max_active = [0]
+
+        def request(url):
+            with host_request_limit(url):
+                with lock:
+                    active[0] += 1
+                    max_active[0] = max(max_active[0], active[0])
+                sleep(0.02)
+                with lock:
+                    active[0] -= 1
+
+        with env_var('CONDA_REMOTE_MAX_CONNECTIONS_PER_HOST', '2', reset_context):
+            threads = [Thread(target=request, args=("https://limited.test/linux-64",))
+                       for _ in range(6)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        assert max_active[0] == 2
+
+        # file urls are never limited
+        with env_var('CONDA_REMOTE_MAX_CONNECTIONS_PER_HOST', '1', reset_context):
+            with host_request_limit('file:///some/path'):
+                with host_request_limit('file:///some/path'):
+                    pass
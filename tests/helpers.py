@@ -33,6 +33,12 @@ except ImportError:
     import mock
     from mock import patch
 
+def sat_solver_required(sat_solver_name):
+    # The SAT solver backends named in CONDA_TEST_SAT_SOLVERS must be installed: their tests
+    # fail, rather than being skipped, when they aren't.
+    return sat_solver_name in os.environ.get('CONDA_TEST_SAT_SOLVERS', '').split(',')
+
+
 expected_error_prefix = 'Using Anaconda Cloud api site https://api.anaconda.org'
 def strip_expected(stderr):
     if expected_error_prefix and stderr.startswith(expected_error_prefix):
@@ -169,7 +175,7 @@ def get_index_r_1():
     sd._loaded = True
     SubdirData._cache_[channel.url(with_credentials=True)] = sd
 
-    index = {prec: prec for prec in sd._package_records}
+    index = {prec: prec for prec in sd.iter_records()}
     add_feature_records_legacy(index)
     r = Resolve(index, channels=(channel,))
     return index, r
@@ -195,7 +201,7 @@ def get_index_r_2():
     sd._loaded = True
     SubdirData._cache_[channel.url(with_credentials=True)] = sd
 
-    index = {prec: prec for prec in sd._package_records}
+    index = {prec: prec for prec in sd.iter_records()}
     r = Resolve(index, channels=(channel,))
     return index, r
 
@@ -220,7 +226,7 @@ def get_index_r_3():
     sd._loaded = True
     SubdirData._cache_[channel.url(with_credentials=True)] = sd
 
-    index = {prec: prec for prec in sd._package_records}
+    index = {prec: prec for prec in sd.iter_records()}
     r = Resolve(index, channels=(channel,))
     return index, r
 
@@ -245,7 +251,7 @@ def get_index_r_4():
     sd._loaded = True
     SubdirData._cache_[channel.url(with_credentials=True)] = sd
 
-    index = {prec: prec for prec in sd._package_records}
+    index = {prec: prec for prec in sd.iter_records()}
     r = Resolve(index, channels=(channel,))
 
     return index, r
@@ -271,7 +277,7 @@ def get_index_r_5():
     sd._loaded = True
     SubdirData._cache_[channel.url(with_credentials=True)] = sd
 
-    index = {prec: prec for prec in sd._package_records}
+    index = {prec: prec for prec in sd.iter_records()}
     r = Resolve(index, channels=(channel,))
 
     return index, r
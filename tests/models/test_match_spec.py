@@ -1,21 +1,24 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import, division, print_function, unicode_literals
 
+import os
+from os.path import join
 from unittest import TestCase
 
 from conda._vendor.auxlib.collection import frozendict
 import pytest
 
 from conda import text_type
-from conda.base.context import context
+from conda.base.context import context, reset_context
 from conda.cli.common import arg2spec, spec_from_line
 from conda.common.compat import on_win
 from conda.exceptions import CondaValueError
 from conda.models.channel import Channel
 from conda.models.dist import Dist
 from conda.models.records import PackageRecord, PackageRecord, PackageRef
-from conda.models.match_spec import ChannelMatch, MatchSpec, _parse_spec_str
+from conda.models.match_spec import ChannelMatch, MatchSpec, _parse_spec_str, spec_cache
 from conda.models.version import VersionSpec
+from tests.helpers import tempdir
 
 
 blas_value = 'accelerate' if context.subdir == 'osx-64' else 'openblas'
@@ -115,7 +118,7 @@ class MatchSpecTests(TestCase):
         d = MatchSpec(c, optional=True)
         assert d.optional
         assert not c.optional
-        assert a is not b
+        assert a is b  # specs parsed from the same string are interned
         assert a is not c
         assert a is not d
         assert a == b
@@ -135,6 +138,48 @@ class MatchSpecTests(TestCase):
         assert c != d
         assert hash(c) != hash(d)
 
+    def test_spec_cache(self):
+        spec_str = 'python >=3.6,<3.7.0a0 *_cpython'
+        hits, misses = spec_cache.hits, spec_cache.misses
+        a = MatchSpec(spec_str)
+        b = MatchSpec(spec_str)
+        assert a is b
+        assert spec_cache.hits - hits >= 1
+        assert spec_cache.misses - misses <= 1
+        assert a.version is MatchSpec('python >=3.6,<3.7.0a0').version
+
+        c = MatchSpec(spec_str, optional=True)
+        assert c is not a
+        assert c.optional and not a.optional
+        assert MatchSpec(spec_str) is a
+
+        with pytest.raises(CondaValueError):
+            MatchSpec('numpy[foo=bar]')
+        assert 'numpy[foo=bar]' not in spec_cache
+
+    def test_spec_cache_relative_tarball(self):
+        spec_str = join('pkgs', 'zlib-1.2.11-0.tar.bz2')
+        old_cwd = os.getcwd()
+        with tempdir() as td:
+            urls = []
+            try:
+                for subdir in ('a', 'b'):
+                    os.makedirs(join(td, subdir))
+                    os.chdir(join(td, subdir))
+                    urls.append(MatchSpec(spec_str).get_exact_value('url'))
+            finally:
+                os.chdir(old_cwd)
+        assert urls[0] != urls[1]
+        assert urls[1].endswith('/b/pkgs/zlib-1.2.11-0.tar.bz2')
+
+    def test_spec_cache_reset_context(self):
+        a = MatchSpec('conda-forge::python 3.6*')
+        assert 'conda-forge::python 3.6*' in spec_cache
+        reset_context()
+        assert 'conda-forge::python 3.6*' not in spec_cache
+        assert MatchSpec('conda-forge::python 3.6*') is not a
+        assert MatchSpec('conda-forge::python 3.6*') is not a
+
     # def test_string_mcg1969(self):
     #     a = MatchSpec("foo1 >=1.3 2", optional=True, target="burg")
     #     b = MatchSpec('* [name="foo1", version=">=1.3", build="2"]', optional=True, target="burg")
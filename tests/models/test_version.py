@@ -3,7 +3,8 @@ from __future__ import absolute_import, print_function
 import unittest
 
 from conda.exceptions import InvalidVersionSpecError
-from conda.models.version import VersionOrder, VersionSpec, normalized_version, ver_eval, treeify
+from conda.models.version import VersionOrder, VersionSpec, normalized_version, ver_eval, treeify, \
+    version_cache
 
 
 class TestVersionSpec(unittest.TestCase):
@@ -80,6 +81,8 @@ class TestVersionSpec(unittest.TestCase):
         self.assertNotEqual(VersionOrder("0.4"), VersionOrder("0.4.1"))
         self.assertEqual(VersionOrder("0.4.a1"), VersionOrder("0.4.0a1"))
         self.assertNotEqual(VersionOrder("0.4.a1"), VersionOrder("0.4.1a1"))
+        self.assertEqual(hash(VersionOrder("0.4")), hash(VersionOrder("0.4.0.0")))
+        self.assertEqual(hash(VersionOrder("0.4.a1")), hash(VersionOrder("0.4.0a1")))
 
         # check __lt__
         self.assertEqual(sorted(versions, key=lambda x: x[1]), versions)
@@ -101,6 +104,17 @@ class TestVersionSpec(unittest.TestCase):
                                              '1.0.1post.z', '1.0.1post.za', '1.0.2']]
         self.assertEqual(sorted(openssl), openssl)
 
+    def test_version_cache_is_bounded(self):
+        maxsize = version_cache.maxsize
+        version_cache.maxsize = 2
+        try:
+            vos = [VersionOrder(v) for v in ("100.1", "100.2", "100.3")]
+            self.assertEqual(len(version_cache), 2)
+            self.assertEqual(VersionOrder("100.1"), vos[0])
+            self.assertIs(VersionOrder("100.3"), vos[2])
+        finally:
+            version_cache.maxsize = maxsize
+
     def test_pep440(self):
         # this list must be in sorted order (slightly modified from the PEP 440 test suite
         # https://github.com/pypa/packaging/blob/master/tests/test_version.py)
@@ -228,6 +242,34 @@ class TestVersionSpec(unittest.TestCase):
             assert repr(m) == "VersionSpec('%s')" % vspec
             assert m.match('1.7.1') == res, vspec
 
+    def test_as_intervals(self):
+        def intervals(vspec):
+            res = VersionSpec(vspec).as_intervals()
+            if res is None:
+                return None
+            return [(lo and str(lo), lo_incl, hi and str(hi), hi_incl)
+                    for lo, lo_incl, hi, hi_incl in res]
+
+        assert intervals('*') == [(None, False, None, False)]
+        assert intervals('1.7.1') == [('1.7.1', True, '1.7.1', True)]
+        assert intervals('>=1.5,<2') == [('1.5', True, '2', False)]
+        assert intervals('!=1.5') == [(None, False, '1.5', False), ('1.5', False, None, False)]
+        assert intervals('>=2|<1,>0.5|==1.2|>=1.2,<1.4') == [
+            ('0.5', False, '1', False), ('1.2', True, '1.4', False), ('2', True, None, False),
+        ]
+        assert intervals('<1|>=1') == [(None, False, None, False)]
+        assert intervals('>2,<1') == []
+        assert intervals('>=1,<=1') == [('1', True, '1', True)]
+        assert intervals('1.7.*') is None
+        assert intervals('>1.5,1.7.*') is None
+        assert intervals('^1.7.1$') is None
+
+        m = VersionSpec('>=1.5,<2,!=1.7.1|>3')
+        for version, res in [('1.4', False), ('1.5', True), ('1.7.1', False), ('1.7.1.0', False),
+                             ('1.9', True), ('2', False), ('2.0a1', True), ('3', False),
+                             ('3.0.1', True)]:
+            assert m.match(version) == res, version
+
     def test_local_identifier(self):
         """The separator for the local identifier should be either `.` or `+`"""
         # a valid versionstr should match itself
@@ -1,4 +1,6 @@
 import json
+import os
+from os.path import join
 import unittest
 
 from conda._vendor.auxlib.ish import dals
@@ -6,8 +8,9 @@ import pytest
 
 from conda.base.context import context
 from conda.common.io import captured
+from conda.common.url import path_to_url
 from conda.gateways.disk.delete import rm_rf
-from tests.helpers import capture_json_with_argv, run_inprocess_conda_command
+from tests.helpers import capture_json_with_argv, run_inprocess_conda_command, tempdir
 
 
 class TestJson(unittest.TestCase):
@@ -128,3 +131,38 @@ class TestJson(unittest.TestCase):
     @pytest.mark.integration
     def test_search_5(self):
         self.assertIsInstance(capture_json_with_argv('conda search --platform win-32 --json'), dict)
+
+    def test_search_reverse_dependency(self):
+        def record(name, version, depends=()):
+            return {'name': name, 'version': version, 'build': '0', 'build_number': 0,
+                    'depends': list(depends)}
+        packages = {
+            'numpy-1.19.0-0.tar.bz2': record('numpy', '1.19.0'),
+            'numpy-1.21.0-0.tar.bz2': record('numpy', '1.21.0'),
+            'pandas-1.0.0-0.tar.bz2': record('pandas', '1.0.0', ['numpy <1.20']),
+            'scipy-1.5.0-0.tar.bz2': record('scipy', '1.5.0', ['numpy >=1.20', 'six']),
+            'six-1.11.0-0.tar.bz2': record('six', '1.11.0'),
+        }
+        with tempdir() as channel_dir:
+            for subdir, subdir_packages in ((context.subdir, packages), ('noarch', {})):
+                os.makedirs(join(channel_dir, subdir))
+                with open(join(channel_dir, subdir, 'repodata.json'), 'w') as f:
+                    json.dump({'info': {'subdir': subdir}, 'packages': subdir_packages}, f)
+            search = ('conda search --reverse-dependency --json --override-channels -c %s %%s'
+                      % path_to_url(channel_dir))
+
+            res = capture_json_with_argv(search % 'numpy')
+            assert sorted(res) == ['pandas', 'scipy']
+            res = capture_json_with_argv(search % "'numpy>=1.20'")
+            assert sorted(res) == ['scipy']
+            res = capture_json_with_argv(search % "'numpy 1.19.*'")
+            assert sorted(res) == ['pandas']
+            res = capture_json_with_argv(search % 'scipy')
+            assert res == {}
+
+            stdout, stderr, rc = run_inprocess_conda_command(search % "'numpy*'")
+            assert json.loads(stdout.strip())['exception_name'] == 'CondaValueError'
+            stdout, stderr, rc = run_inprocess_conda_command(search % "'numpy<1.19'")
+            assert json.loads(stdout.strip())['exception_name'] == 'PackagesNotFoundError'
+            stdout, stderr, rc = run_inprocess_conda_command(search % 'not-a-package')
+            assert json.loads(stdout.strip())['exception_name'] == 'PackagesNotFoundError'
@@ -1,5 +1,6 @@
 import pytest
-from conda.lock import DirectoryLock, FileLock, LockError
+from conda.common.compat import on_win
+from conda.lock import DirectoryLock, FileLock, LockError, ReadWriteLock
 from os.path import basename, exists, isfile, join
 
 
@@ -126,3 +127,26 @@ def test_permission_file():
 
             path = basename(lock.lock_file_path)
             assert not exists(join(f.name, path))
+
+
+def test_read_write_lock(tmpdir):
+    lock_file_path = join(tmpdir.strpath, "cache.lock")
+    with ReadWriteLock(lock_file_path).read():
+        assert isfile(lock_file_path)
+        if not on_win:
+            # readers share the lock
+            with ReadWriteLock(lock_file_path, timeout=0).read():
+                pass
+        with pytest.raises(LockError):
+            with ReadWriteLock(lock_file_path, timeout=0).write():
+                assert False  # this should never happen
+
+    with ReadWriteLock(lock_file_path).write():
+        with pytest.raises(LockError):
+            with ReadWriteLock(lock_file_path, timeout=0.05).read():
+                assert False  # this should never happen
+
+    # the lock is released, and the lock file is left in place
+    with ReadWriteLock(lock_file_path, timeout=0).write():
+        pass
+    assert isfile(lock_file_path)
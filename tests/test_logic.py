@@ -1,10 +1,18 @@
 from itertools import chain, combinations, permutations, product
+import pickle
 
 import pytest
 
 from conda.common.compat import iteritems, string_types
-from conda.common.logic import (Clauses, evaluate_eq, minimal_unsatisfiable_subset)
-from tests.helpers import raises
+from conda.common.logic import (ClauseArray, Clauses, CryptoMiniSatSolver, SAT_SOLVERS,
+                                evaluate_eq, minimal_unsatisfiable_subset,
+                                parallel_minimal_unsatisfiable_subset)
+from tests.helpers import raises, sat_solver_required
+
+try:
+    from unittest.mock import Mock, call, patch
+except ImportError:
+    from mock import Mock, call, patch
 
 
 # These routines implement logical tests with short-circuiting
@@ -246,8 +254,52 @@ def test_LinearBound():
             assert not(rhs[0] <= my_EVAL(eq2,sol) <= rhs[1]), ('Cneg',Cneg.clauses)
 
 
-def test_sat():
-    C = Clauses()
+sat_solvers = pytest.mark.parametrize('sat_solver', [
+    pytest.param(sat_solver, marks=pytest.mark.skipif(
+        sat_solver.module is None and not sat_solver_required(sat_solver.name),
+        reason="%s is not installed" % sat_solver.package_name))
+    for _, sat_solver in sorted(iteritems(SAT_SOLVERS))
+])
+
+
+def test_ClauseArray():
+    clauses = [(1, -2), (3,), (-4, 5, -6)]
+    C = ClauseArray(clauses[:1])
+    C.extend(clauses[1:])
+    assert len(C) == 3 and C == clauses and list(C) == clauses
+    assert C[1] == (3,) and C[-1] == (-4, 5, -6) and C[1:] == clauses[1:]
+    assert list(C.flat()) == [1, -2, 0, 3, 0, -4, 5, -6, 0]
+    assert list(C.flat(2)) == [-4, 5, -6, 0]
+    del C[1:]
+    C.append((7, 8))
+    assert C == [(1, -2), (7, 8)] and C != clauses
+    assert raises(TypeError, lambda: C.__delitem__(slice(0, 1)))
+    assert raises(TypeError, lambda: C.__delitem__(0))
+    del C[:]
+    assert not C and list(C.flat()) == []
+
+
+def test_Totalizer():
+    eq = [(1, 1), (2, 2), (3, 3), (3, 4), (5, 5)]
+    assignments = list(product((False, True), repeat=5))
+    for bound in range(15):
+        C = Clauses(5)
+        outputs = C.Totalizer(eq, bound)
+        assert [c for c, _ in outputs] == sorted(c for c, _ in outputs)
+        assert all(0 < c <= bound + 1 for c, _ in outputs)
+        for K in range(bound + 1):
+            bounded = [(-a,) for c, a in outputs if c > K]
+            sols = set(tuple(k > 0 for k in sol[:5]) for sol in C.itersolve(bounded, 5))
+            assert sols == set(x for x in assignments
+                               if sum(c for (c, _), v in zip(eq, x) if v) <= K)
+    C = Clauses(5)
+    assert C.Totalizer(eq, 10, max_clauses=10) is None
+    assert C.m == 5 and not C.clauses
+
+
+@sat_solvers
+def test_sat(sat_solver):
+    C = Clauses(sat_solver=sat_solver)
     C.new_var('x1')
     C.new_var('x2')
     assert C.sat() is not None
@@ -264,13 +316,14 @@ def test_sat():
     assert C.sat() is None
     assert C.sat([]) is None
     assert C.sat([(True,)]) is None
-    assert len(Clauses(10).sat([[1]])) == 10
+    assert len(Clauses(10, sat_solver=sat_solver).sat([[1]])) == 10
 
 
-def test_minimize():
+@sat_solvers
+def test_minimize(sat_solver):
     # minimize    x1 + 2 x2 + 3 x3 + 4 x4 + 5 x5
     # subject to  x1 + x2 + x3 + x4 + x5  == 1
-    C = Clauses(15)
+    C = Clauses(15, sat_solver=sat_solver)
     C.Require(C.ExactlyOne, range(1,6))
     sol = C.sat()
     C.unsat = True
@@ -289,6 +342,88 @@ def test_minimize():
     assert sval == 11
 
 
+@sat_solvers
+def test_minimize_lexicographic(sat_solver):
+    # minimize    x1 + x2 + x3 + x4, then 4 x1 + 3 x2 + 2 x3 + x4,
+    # subject to  at least two of x1..x4, not both x3 and x4
+    C = Clauses(4, sat_solver=sat_solver)
+    C.Require(C.LinearBound, [(1, k) for k in range(1, 5)], 2, 4)
+    C.Prevent(C.All, (3, 4))
+    sol, sval = C.minimize({1: 1, 2: 1, 3: 1, 4: 1})
+    assert sval == 2
+    sol, sval = C.minimize({1: 4, 2: 3, 3: 2, 4: 1}, sol)
+    assert sval == 4
+    assert {k for k in sol if 0 < k <= 4} == {2, 4}
+    assert C.sat([(1,)]) is None
+    assert C.sat([(2,)]) is not None
+
+
+@sat_solvers
+def test_minimize_peak(sat_solver):
+    # minimize    2 x1 + x2 + x3 + x4 + 2 x5 + 2 x6
+    # subject to  x1 or all of x2..x4, and x5 or x6
+    # as a whole, and as two parts bounded by the peak of the whole
+    def clauses():
+        C = Clauses(6, sat_solver=sat_solver)
+        C.Require(C.Or, 1, C.All((2, 3, 4)))
+        C.Require(C.Or, 5, 6)
+        return C
+    parts = {1: 2, 2: 1, 3: 1, 4: 1}, {5: 2, 6: 2}
+    sol, sval = clauses().minimize(dict(chain(iteritems(parts[0]), iteritems(parts[1]))))
+    assert sval == 4
+    assert {k for k in sol if 0 < k <= 4} == {1}
+
+    C = clauses()
+    sol, sval = C.minimize(parts[0])
+    assert sval == 3
+    assert {k for k in sol if 0 < k <= 4} == {2, 3, 4}
+
+    C = clauses()
+    peaks = [C.min_peak(part)[1] for part in parts]
+    assert peaks == [1, 2]
+    sol, sval = C.minimize(parts[0], peak=max(peaks))
+    assert sval == 2
+    sol, sval = C.minimize(parts[1], sol, peak=max(peaks))
+    assert sval == 2
+    assert {k for k in sol if 0 < k <= 4} == {1}
+
+
+@sat_solvers
+def test_sat_limit(sat_solver):
+    C = Clauses(sat_solver=sat_solver)
+    C.Require(C.ExactlyOne, [C.new_var() for _ in range(20)])
+    assert C.sat(limit=1000000) is not None
+    assert C.sat([(1,), (2,)], limit=1000000) is None
+
+
+def test_cryptominisat_conflict_limit():
+    # runs against a stand-in for pycryptosat, so that it's never skipped
+    pycryptosat = Mock()
+    pycryptosat.Solver.return_value.nb_vars.return_value = 2
+    pycryptosat.Solver.return_value.solve.return_value = (True, (None, True, False))
+    with patch('conda.common.logic.pycryptosat', pycryptosat):
+        with patch.object(CryptoMiniSatSolver, 'module', pycryptosat):
+            C = Clauses(2, sat_solver=CryptoMiniSatSolver)
+            C.Require(C.Or, 1, 2)
+            assert C.sat() == [1, -2]
+            assert C.sat(limit=100) == [1, -2]
+    # no limit means no confl_limit, rather than a limit of 0 conflicts
+    assert pycryptosat.Solver.call_args_list == [call(), call(confl_limit=100)]
+
+
+@sat_solvers
+def test_minimize_budget(sat_solver):
+    C = Clauses(5, sat_solver=sat_solver)
+    C.Require(C.ExactlyOne, range(1, 6))
+    sol = C.sat([(5,)])
+    C.deadline = 0
+    assert C.minimize([(k, k) for k in range(1, 6)], sol) == (sol, 5)
+    assert C.budget_exhausted
+    C.deadline = None
+    C.budget_exhausted = False
+    assert C.minimize([(k, k) for k in range(1, 6)], sol)[1] == 1
+
+
 def test_minimal_unsatisfiable_subset():
     def sat(val):
         return Clauses(max(abs(v) for v in chain(*val))).sat(val)
@@ -311,3 +446,22 @@ def test_minimal_unsatisfiable_subset():
         res = minimal_unsatisfiable_subset(perm, sat)
         assert sorted(res) in [[[-1], [1]], [[-2], [2]]]
         assert not sat(res)
+
+
+def test_parallel_minimal_unsatisfiable_subset():
+    C = Clauses(10)
+    C.Require(C.Or, 7, C.Or(8, C.Or(9, 10)))
+    items = ['a', 'b', 'c', 'd', 'e', 'f']
+    item_clauses = [[(-10,)], [(1,)], [(-7,)], [(2,)], [(-8,)], [(-9,)]]
+    assert raises(ValueError, lambda: parallel_minimal_unsatisfiable_subset(
+        items[:3], item_clauses[:3], C, 2))
+    for processes in (2, 3):
+        res = parallel_minimal_unsatisfiable_subset(items, item_clauses, C, processes)
+        assert sorted(res) == ['a', 'c', 'e', 'f']
+
+
+def test_clause_array_pickle():
+    # parallel_minimal_unsatisfiable_subset sends the clauses to its workers as a ClauseArray
+    clauses = ClauseArray([(1, -2), (3,), (-1, 2, -3)])
+    for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+        assert pickle.loads(pickle.dumps(clauses, protocol)) == clauses
@@ -8,12 +8,19 @@ import pytest
 from conda.base.context import context, reset_context
 from conda.common.compat import iteritems, itervalues
 from conda.common.io import env_var
-from conda.exceptions import UnsatisfiableError
+from conda.common.logic import SAT_SOLVERS
+from conda.exceptions import CondaDependencyError, SolverBudgetExhaustedError, UnsatisfiableError
 from conda.models.channel import Channel
 from conda.models.records import PackageRecord
+from conda.models.version import VersionOrder
 from conda.resolve import MatchSpec, Resolve, ResolvePackageNotFound
 
-from .helpers import get_index_r_1, get_index_r_3, raises
+from .helpers import get_index_r_1, get_index_r_3, raises, sat_solver_required
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
 
 index, r, = get_index_r_1()
 f_mkl = set(['mkl'])
@@ -157,6 +164,16 @@ def test_get_dists():
     assert 'channel-1::dynd-python-0.3.0-np17py33_0' in dist_strs
 
 
+def test_version_rank():
+    numpys = r.groups['numpy']
+    for p1 in numpys:
+        for p2 in numpys:
+            vo1, vo2 = VersionOrder(p1.version), VersionOrder(p2.version)
+            rank1, rank2 = r._version_rank(p1), r._version_rank(p2)
+            assert (rank1 < rank2) == (vo1 < vo2)
+            assert (rank1 == rank2) == (vo1 == vo2)
+
+
 def test_generate_eq_1():
     reduced_index = r.get_reduced_index(['anaconda'])
     r2 = Resolve(reduced_index, True, True)
@@ -390,6 +407,85 @@ def test_generate_eq_1():
     assert eqt == {}
 
 
+def _simple_record(name, version, depends=()):
+    return PackageRecord(channel='defaults', subdir=context.subdir, md5='0123456789',
+                         fn='%s-%s-0.tar.bz2' % (name, version), build='0', build_number=0,
+                         depends=list(depends), name=name, version=version)
+
+
+def test_independent_components():
+    records = [
+        _simple_record('a', '1'),
+        _simple_record('a', '2', ['b 2']),
+        _simple_record('b', '1'),
+        _simple_record('b', '2'),
+        _simple_record('c', '1'),
+        _simple_record('c', '2', ['d']),
+        _simple_record('d', '1'),
+    ]
+    r2 = Resolve({prec: prec for prec in records})
+    specs = tuple(map(MatchSpec, ['a', 'b', 'c']))
+    reduced_index = r2.get_reduced_index(specs)
+    subproblems = r2._split_index(specs, reduced_index)
+    assert sorted(tuple(str(s) for s in sub_specs) for sub_specs, _ in subproblems) == [
+        ('a', 'b'), ('c',),
+    ]
+    solution = r2.install(specs)
+    assert [prec.dist_str() for prec in solution] == [
+        'defaults::a-2-0', 'defaults::b-2-0', 'defaults::c-2-0', 'defaults::d-1-0',
+    ]
+    with patch.object(Resolve, '_split_index', lambda self, specs, index: [(specs, index)]):
+        assert r2.install(specs) == solution
+
+    # the alternatives of each component combine into those of the whole problem
+    records = [PackageRecord.from_objects(_simple_record(name, '1'), build=build)
+               for name in 'be' for build in ('x', 'y')]
+    records.extend([_simple_record('a', '1', ['b']), _simple_record('d', '1', ['e'])])
+    r2 = Resolve({prec: prec for prec in records})
+    specs = tuple(map(MatchSpec, ['a', 'd']))
+    assert len(r2._split_index(specs, r2.get_reduced_index(specs))) == 2
+    with env_var('CONDA_JSON', 'false', reset_context):
+        with patch('conda.resolve.stdoutlog') as stdoutlog:
+            r2.install(specs)
+    assert '4 possible package resolutions' in stdoutlog.info.call_args[0][0]
+
+    specs = tuple(map(MatchSpec, ['numpy', 'redis', 'yaml', 'iopro 1.4*', 'python 2.7*']))
+    subproblems = r._split_index(specs, r.get_reduced_index(specs))
+    assert sorted(tuple(str(s) for s in sub_specs) for sub_specs, _ in subproblems) == [
+        ('numpy', 'iopro=1.4', 'python=2.7'), ('redis',), ('yaml',),
+    ]
+    solution = r.install(specs)
+    with patch.object(Resolve, '_split_index', lambda self, specs, index: [(specs, index)]):
+        assert r.install(specs) == solution
+    assert raises(UnsatisfiableError, lambda: r.install(['redis', 'numpy 1.5*', 'python 3*']))
+
+
+def test_independent_components_peak():
+    # Every z and w pair that can be installed puts one of them two versions below its best,
+    # so the peak of the requested versions metric is 2.  Within that peak, x-1 with the best
+    # y, u and v has a lower sum than x-3 with the second best; minimizing the peak of x, y,
+    # u and v apart from z and w would choose x-3 for its peak of 1.
+    records = [_simple_record(name, version) for name in 'yuvw' for version in '123']
+    records.extend([
+        _simple_record('x', '3', ['y 2', 'u 2', 'v 2']),
+        _simple_record('x', '2', ['y 1', 'u 1', 'v 1']),
+        _simple_record('x', '1'),
+        _simple_record('z', '3', ['w 1']),
+        _simple_record('z', '2', ['w 1']),
+        _simple_record('z', '1', ['w']),
+    ])
+    r2 = Resolve({prec: prec for prec in records})
+    specs = tuple(map(MatchSpec, ['x', 'y', 'u', 'v', 'z', 'w']))
+    reduced_index = r2.get_reduced_index(specs)
+    assert len(r2._split_index(specs, reduced_index)) == 2
+    solution = r2.install(specs)
+    assert [prec.dist_str() for prec in solution if prec.name in 'xyuv'] == [
+        'defaults::u-3-0', 'defaults::v-3-0', 'defaults::x-1-0', 'defaults::y-3-0',
+    ]
+    with patch.object(Resolve, '_split_index', lambda self, specs, index: [(specs, index)]):
+        assert r2.install(specs) == solution
+
+
 def test_unsat():
     # scipy 0.12.0b1 is not built for numpy 1.5, only 1.6 and 1.7
     assert raises(UnsatisfiableError, lambda: r.install(['numpy 1.5*', 'scipy 0.12.0b1']))
@@ -398,6 +494,44 @@ def test_unsat():
     assert raises(UnsatisfiableError, lambda: r.install(['numpy 1.5*', 'numpy 1.6*']))
 
 
+@pytest.mark.parametrize('sat_solver', ['pycryptosat', 'pysat'])
+def test_sat_solver_backends(sat_solver):
+    specs = ['iopro 1.4*', 'python 2.7*', 'numpy 1.7*']
+    expected = [prec.dist_str() for prec in r.install(specs)]
+    with env_var("CONDA_SAT_SOLVER", sat_solver, reset_context):
+        if SAT_SOLVERS[sat_solver].module is None and not sat_solver_required(sat_solver):
+            assert raises(CondaDependencyError, lambda: r.install(specs))
+            return
+        assert [prec.dist_str() for prec in r.install(specs)] == expected
+        assert raises(UnsatisfiableError, lambda: r.install(['numpy 1.5*', 'scipy 0.12.0b1']))
+
+
+def test_solve_budget():
+    specs = ['iopro 1.4*', 'python 2.7*', 'numpy 1.7*']
+    with env_var("CONDA_SOLVER_TIME_BUDGET_SECS", "1e-9", reset_context):
+        installed = r.install(specs)
+        assert r.suboptimal
+        assert all(any(MatchSpec(spec).match(prec) for prec in installed) for spec in specs)
+    with env_var("CONDA_SOLVER_PROPAGATION_LIMIT", "1", reset_context):
+        assert raises(SolverBudgetExhaustedError, lambda: r.install(specs))
+    r.install(specs)
+    assert not r.suboptimal
+
+    limits = []
+    minimal_unsatisfiable_specs = Resolve._minimal_unsatisfiable_specs
+
+    def conflict_search(self, C, specs, sat):
+        limits.append((C.limit, C.deadline))
+        return minimal_unsatisfiable_specs(self, C, specs, sat)
+
+    specs = ['numpy 1.5*', 'scipy 0.12.0b1']
+    with env_var("CONDA_SOLVER_PROPAGATION_LIMIT", "1000000", reset_context):
+        with env_var("CONDA_SOLVER_TIME_BUDGET_SECS", "1000", reset_context):
+            with patch.object(Resolve, '_minimal_unsatisfiable_specs', conflict_search):
+                assert raises(UnsatisfiableError, lambda: r.solve(specs))
+    assert limits == [(0, None)]
+
+
 def test_nonexistent():
     assert not r.find_matches(MatchSpec('notarealpackage 2.0*'))
     assert raises(ResolvePackageNotFound, lambda: r.install(['notarealpackage 2.0*']))